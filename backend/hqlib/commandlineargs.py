@@ -32,10 +32,38 @@ def parse() -> Namespace:
                         action='store_true')
     parser.add_argument('--log', default="WARNING", choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
                         help="log level (WARNING by default)")
+    parser.add_argument('--prefetch-workers', default=8, type=int,
+                        help='number of threads used to read metric source urls in advance (8 by default, 0 disables '
+                             'prefetching)')
+    parser.add_argument('--max-connections-per-host', default=8, type=int,
+                        help='maximum number of idle connections kept open per host for reuse (8 by default)')
+    parser.add_argument('--connection-idle-time', default=30, type=int,
+                        help='number of seconds after which idle connections are closed (30 by default)')
+    parser.add_argument('--cache-folder', help='folder for the on-disk cache of metric source responses (no cache by '
+                                               'default)')
+    parser.add_argument('--cache-size', default=500, type=int,
+                        help='maximum size of the on-disk response cache in megabytes (500 by default)')
+    parser.add_argument('--git-cache-folder',
+                        help='folder for the mirrors of Git repositories (~/.cache/quality-report/git by default)')
+    parser.add_argument('--max-host-failures', default=3, type=int,
+                        help='number of consecutive connection failures or time outs after which a host is not '
+                             'contacted for a while (3 by default, 0 disables this)')
+    parser.add_argument('--host-cool-down', default=300, type=int,
+                        help='number of seconds a host that failed too often is not contacted (300 by default)')
+    recording = parser.add_mutually_exclusive_group()
+    recording.add_argument('--record', metavar='DIR',
+                           help='record the responses of the metric sources in the folder (note that the recording '
+                                'may contain confidential information)')
+    recording.add_argument('--replay', metavar='DIR',
+                           help='replay the responses recorded in the folder instead of contacting the metric sources')
+    parser.add_argument('--replay-latency', action='store_true',
+                        help='when replaying, wait as long as the metric sources took to respond when recording')
     parser.add_argument('--version', action='version', version=hqlib.VERSION)
     args = parser.parse_args()
     if not args.project:
         parser.error('Need a project folder or filename')
     if not args.report:
         parser.error('Need a report folder')
+    if args.replay_latency and not args.replay:
+        parser.error('Can only replay latency when replaying')
     return args
@@ -253,6 +253,20 @@ class Metric(object):
         else:
             return []
 
+    def prefetch_requests(self) -> List[Tuple[MetricSource, str]]:
+        """ Return the metric source and url pairs the metric will read, so they can be fetched in advance. """
+        if not self._metric_source:
+            return []
+        return [(self._metric_source, url) for url in
+                self._metric_source.prefetch_urls(*self._get_metric_source_ids())]
+
+    def bulk_prefetch_requests(self) -> List[Tuple[MetricSource, str]]:
+        """ Return the metric source and metric source id pairs of the metric, so that metric sources can retrieve
+            the data of all metric source ids at once. """
+        if not self._metric_source:
+            return []
+        return [(self._metric_source, metric_source_id) for metric_source_id in self._get_metric_source_ids()]
+
     def _get_metric_source_ids(self) -> List[str]:
         """ Allow for subclasses to override what the metric source id is. """
         ids = self._metric_source_id if isinstance(self._metric_source_id, list) else [self._metric_source_id]
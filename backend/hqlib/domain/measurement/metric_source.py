@@ -38,6 +38,19 @@ class MetricSource(DomainObject):  # pylint: disable=too-few-public-methods
         """ Return the url(s) to the metric source for the metric source id. """
         return list(metric_source_ids)  # Default implementation assumes the metric source ids are urls.
 
+    def prefetch_urls(self, *metric_source_ids: str) -> List[str]:  # pylint: disable=unused-argument,no-self-use
+        """ Return the urls the metric source will read for the metric source ids, so they can be fetched in
+            advance. Metric sources that return urls should also implement prefetch(url). """
+        return []
+
+    def prefetch(self, url: str) -> None:  # pylint: disable=unused-argument,no-self-use
+        """ Read one of the urls returned by prefetch_urls, so that its contents are cached by the time a metric
+            needs them. Metric sources that return prefetch urls need to override this method. """
+
+    def bulk_prefetch(self, *metric_source_ids: str) -> None:  # pylint: disable=unused-argument,no-self-use
+        """ Retrieve the data for all metric source ids at once, before the metrics are evaluated. Metric sources
+            that can retrieve data for multiple metric source ids with one request can override this method. """
+
     def datetime(self, *metric_source_ids: str) -> DateTime:  # pylint: disable=unused-argument,no-self-use
         """ Return the date and time of the last measurement. """
         return datetime.datetime.now()
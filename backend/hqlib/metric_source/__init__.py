@@ -32,6 +32,9 @@ from .coverage_report.ncover import NCover
 from .history import History, CompactHistory
 from .holiday_planner import HolidayPlanner
 from .ci_server.jenkins import Jenkins
+from .ci_server.jenkins_api import JenkinsApi
+from .circuit_breaker import CircuitBreaker
+from .connection_pool import ConnectionPool
 from .jira import Jira
 from .open_vas_scan_report import OpenVASScanReport
 from .owasp_dependency_report.jenkins_owasp_dependency_plugin import JenkinsOWASPDependencyReport
@@ -42,6 +45,8 @@ from .performance_report.ictu_lrk import ICTULRKPerformanceLoadTestReport, ICTUL
     ICTULRKPerformanceScalabilityTestReport
 from .performance_report.spirit_splunk_csv import SpiritSplunkCSVPerformanceLoadTestReport, \
     SpiritSplunkCSVPerformanceEnduranceTestReport, SpiritSplunkCSVPerformanceScalabilityTestReport
+from .response_cache import ResponseCache
+from .single_flight import SingleFlight
 from .sonar import Sonar
 from .team_spirit.happiness import Happiness
 from .team_spirit.wiki import Wiki
@@ -53,7 +58,9 @@ from .test_report.uft_test_report import UFTTestReport
 from .test_report.sonar_test_report import SonarTestReport
 from .issue_log.trello import TrelloBoard
 from .issue_log.wekan import WekanBoard
+from .traffic_recorder import TrafficRecorder
 from .url_opener import UrlOpener
+from .url_prefetcher import UrlPrefetcher
 from .version_control_system.git import Git
 from .version_control_system.subversion import Subversion
 from .zap_scan_report import ZAPScanReport
@@ -29,8 +29,10 @@ class CoverageReport(domain.MetricSource):
     """ Abstract class representing a coverage report. """
     metric_source_name = 'Coverage report'
     needs_metric_source_id = True
+    cache_ttl = 15 * 60  # Coverage reports change at most once per build, so cached reports are fresh for a while
 
     def __init__(self, url_open: Callable[[str], bytes]=None, **kwargs) -> None:
+        kwargs.setdefault('cache_ttl', self.cache_ttl)
         self.__url_open = url_open or UrlOpener(**kwargs).url_open
         super().__init__()
 
@@ -17,7 +17,7 @@ limitations under the License.
 
 import datetime
 import functools
-from typing import Callable
+from typing import Callable, List
 
 from .. import url_opener
 from ... import domain
@@ -35,6 +35,17 @@ class TestReport(domain.MetricSource):
             password=kwargs.pop('password', '')).url_read
         super().__init__(*args, **kwargs)
 
+    def prefetch_urls(self, *report_urls: str) -> List[str]:
+        """ Return the urls of the reports, so they can be fetched in advance. """
+        return list(report_urls)
+
+    def prefetch(self, url: str) -> None:
+        """ Read the url so that its contents are cached by the time a metric needs them. """
+        try:
+            self._url_read(url)
+        except url_opener.UrlOpener.url_open_exceptions:
+            pass  # The metric will retry and deal with the exception itself
+
     @functools.lru_cache(maxsize=1024)
     def datetime(self, *report_urls: str) -> DateTime:
         """ Return the (oldest) date and time of the reports. """
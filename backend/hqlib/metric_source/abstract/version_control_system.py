@@ -17,13 +17,17 @@ limitations under the License.
 
 import functools
 import logging
-import os
 import re
 import subprocess
+import threading
+import time
+from xml.etree import ElementTree
 
-from typing import Tuple, List
+from typing import Dict, Iterator, Tuple, List
 
 from . import archive_system
+from ..response_cache import ResponseCache
+from ..traffic_recorder import ReplayMissError, TrafficRecorder
 
 
 class VersionControlSystem(archive_system.ArchiveSystem):
@@ -31,6 +35,13 @@ class VersionControlSystem(archive_system.ArchiveSystem):
 
     metric_source_name = 'Version control system'
     needs_metric_source_id = True
+    default_recorder: TrafficRecorder = None
+    default_response_cache: ResponseCache = None  # On-disk cache for results derived from the repository
+    __repository_locks: Dict[str, threading.Lock] = dict()
+    __lock = threading.Lock()
+    __nr_commands = 0
+    __command_time = 0.
+    xml_chunk_size = 64 * 1024  # Number of characters of XML output fed to the XML parser at a time
 
     def __init__(self, username: str='', password: str='', url: str=None,
                  run_shell_command=subprocess.check_output) -> None:
@@ -74,12 +85,63 @@ class VersionControlSystem(archive_system.ArchiveSystem):
 
     @functools.lru_cache(maxsize=1024)
     def _run_shell_command(self, shell_command: Tuple[str, ...], folder: str='', log_level: int=logging.WARNING) -> str:
-        """ Invoke a shell and run the command. If a folder is specified, run the command in that folder. """
-        original_working_dir = os.getcwd()
-        if folder:
-            os.chdir(folder)
+        """ Invoke a shell and run the command. If a folder is specified, run the command in that folder. If there is
+            a traffic recorder, record the output of the command or replay it. """
+        if not self.default_recorder:
+            return self.__run_shell_command(shell_command, folder, log_level)
         try:
-            return self._shell_command(shell_command, universal_newlines=True)
+            return self.default_recorder.call(self._recording_key(shell_command),
+                                              lambda: self.__run_shell_command(shell_command, folder, log_level))
+        except ReplayMissError as reason:
+            logging.log(log_level, 'Shell command %s failed: %s', ' '.join(shell_command), reason)
+            if log_level > logging.WARNING:
+                raise subprocess.CalledProcessError(1, shell_command, str(reason))
+            else:
+                return ''
+
+    @classmethod
+    def _xml_elements(cls, xml_text: str, tag: str) -> Iterator[ElementTree.Element]:
+        """ Yield the elements with the tag from the XML output of a shell command. The XML is parsed incrementally
+            and each element is cleared once the caller is done with it, so the complete document tree is never held
+            in memory. Callers need to extract what they need from an element before asking for the next one. """
+        if not xml_text:
+            return  # The shell command failed and that has been logged already
+        parser = ElementTree.XMLPullParser(events=('end',))
+        try:
+            for start in range(0, len(xml_text), cls.xml_chunk_size):
+                parser.feed(xml_text[start:start + cls.xml_chunk_size])
+                for _, element in parser.read_events():
+                    if element.tag == tag:
+                        yield element
+                        element.clear()
+            parser.close()
+        except ElementTree.ParseError as reason:
+            logging.warning("Couldn't parse XML output: %s", reason)
+
+    @classmethod
+    def _repository_lock(cls, folder: str) -> threading.Lock:
+        """ Return the lock that commands that change the repository in the folder, such as cloning or updating
+            it, need to hold, so that they don't overlap. """
+        with cls.__lock:
+            return cls.__repository_locks.setdefault(folder, threading.Lock())
+
+    @classmethod
+    def shell_command_statistics(cls) -> Dict[str, float]:
+        """ Return the number of shell commands run and the total time they took. """
+        with cls.__lock:
+            return dict(commands=cls.__nr_commands, time=cls.__command_time)
+
+    def _recording_key(self, shell_command: Tuple[str, ...]) -> str:
+        """ Return the key used to record the output of the shell command. The folder is not part of the key, because
+            it may not exist when replaying. """
+        return ' '.join(('shell', self.url() or '') + tuple(shell_command))
+
+    def __run_shell_command(self, shell_command: Tuple[str, ...], folder: str, log_level: int) -> str:
+        """ Invoke a shell and run the command. If a folder is specified, run the command in that folder. The
+            working directory of the process isn't changed, so commands can run concurrently in different threads. """
+        start = time.monotonic()
+        try:
+            return self._shell_command(shell_command, cwd=folder or None, universal_newlines=True)
         except subprocess.CalledProcessError as reason:
             # No need to include the shell command in the log, because the reason contains the shell command.
             logging.log(log_level, 'Shell command in folder %s failed: %s', folder, reason)
@@ -88,4 +150,8 @@ class VersionControlSystem(archive_system.ArchiveSystem):
             else:
                 return ''
         finally:
-            os.chdir(original_working_dir)
+            duration = time.monotonic() - start
+            logging.debug('Shell command %s in folder %s took %.2f seconds', ' '.join(shell_command), folder, duration)
+            with self.__lock:
+                VersionControlSystem.__nr_commands += 1
+                VersionControlSystem.__command_time += duration
@@ -26,6 +26,7 @@ from hqlib.typing import DateTime
 
 class BirtReport(beautifulsoup.BeautifulSoupOpener):
     """ Class representing a specific Birt report. """
+    cache_ttl = 15 * 60  # Birt generates the reports on each request, without validators, so cache them for a while
     def __init__(self, url: str) -> None:
         super().__init__()
         self.__url = url
@@ -141,6 +142,7 @@ class Birt(domain.MetricSource, beautifulsoup.BeautifulSoupOpener):
     """ Class representing the Birt report engine instance. """
 
     metric_source_name = 'Birt reports'
+    cache_ttl = BirtReport.cache_ttl
 
     def __init__(self, birt_url: str) -> None:
         birt_url += 'birt/'
@@ -14,38 +14,49 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import ast
 import datetime
 import functools
 import logging
 import re
 import urllib.parse
-from typing import Dict, IO, List, Optional
+from typing import Any, Dict, IO, Iterator, List, Optional
 
 from hqlib.typing import DateTime, TimeDelta
 from .. import url_opener
 from ..abstract import ci_server
+from .jenkins_api import JenkinsApi
 
-Job = Dict[str, str]
+Job = Dict[str, Any]
 Jobs = List[Job]
 
 
 class Jenkins(ci_server.CIServer, url_opener.UrlOpener):
-    """ Class representing the Jenkins instance. """
+    """ Class representing the Jenkins instance. Jobs in folders and multibranch pipelines are included up to the
+        folder depth, where depth 0 means only top level jobs. The names of nested jobs include the folders they are
+        in, separated by slashes, e.g. 'folder/pipeline/branch'. """
 
     metric_source_name = 'Jenkins build server'
-    api_postfix = 'api/python'
-    jobs_api_postfix = api_postfix + '?tree=jobs[name,description,color,url,buildable]'
+    api_postfix = JenkinsApi.json_postfix
+    # Retrieve everything needed to determine failing and unused jobs with one request:
+    job_fields = 'name,description,color,url,buildable,lastCompletedBuild[timestamp],lastStableBuild[timestamp],' \
+        'builds[number]{0,1}'
 
-    def __init__(self, url: str, username: str='', password: str='', job_re: str='') -> None:
+    def __init__(self, url: str, username: str='', password: str='', job_re: str='', folder_depth: int=0) -> None:
         super().__init__(url=url, username=username, password=password)
         self.__job_re = re.compile(job_re)
         self.__job_url = url + 'job/{job}/'
-        self.__last_completed_build_url = self.__job_url + 'lastCompletedBuild/'
         self._last_successful_build_url = self.__job_url + 'lastSuccessfulBuild/'
         self._last_stable_build_url = self.__job_url + 'lastStableBuild/'
-        self._jobs_api_url = url + self.jobs_api_postfix
-        self.__builds_api_url = self.__job_url + self.api_postfix + '?tree=builds'
+        self._jobs_api_url = url + self.api_postfix + '?tree=' + self.__jobs_tree(folder_depth)
+        self.__api = JenkinsApi(lambda api_url: self.url_read(api_url))
+
+    def prefetch_urls(self, *metric_source_ids: str) -> List[str]:  # pylint: disable=unused-argument
+        """ Return the url of the jobs API, so it can be fetched in advance. """
+        return [self._jobs_api_url]
+
+    def prefetch(self, url: str) -> None:
+        """ Read the url so that its contents are cached by the time a metric needs them. """
+        url_opener.UrlOpener.prefetch(self, url)
 
     def number_of_active_jobs(self) -> int:
         """ Return the total number of active Jenkins jobs. """
@@ -108,26 +119,61 @@ class Jenkins(ci_server.CIServer, url_opener.UrlOpener):
 
     def __jobs(self) -> Jobs:
         """ Return all Jenkins jobs that match our job regular expression. """
-        all_jobs = self._api(self._jobs_api_url)['jobs']
+        all_jobs = self.__flatten(self._api(self._jobs_api_url)['jobs'])
         return [job for job in all_jobs if self.__job_re.match(job['name'])]
 
+    @classmethod
+    def __jobs_tree(cls, depth: int) -> str:
+        """ Return the tree parameter that retrieves the jobs and, up to the depth, the jobs in folders. """
+        nested_jobs = ',' + cls.__jobs_tree(depth - 1) if depth > 0 else ''
+        return 'jobs[' + cls.job_fields + nested_jobs + ']'
+
+    @classmethod
+    def __flatten(cls, jobs: Jobs, folder: str='') -> Iterator[Job]:
+        """ Yield the jobs, replacing folders and multibranch pipelines by the jobs they contain. The names of
+            nested jobs are prefixed with their folders. """
+        for job in jobs:
+            name = folder + job['name']
+            if 'jobs' in job:
+                yield from cls.__flatten(job['jobs'] or [], name + '/')
+            else:
+                yield dict(job, name=name)
+
     def __age_of_last_completed_build(self, job: Job) -> TimeDelta:
         """ Return the age of the last completed build of the job. """
-        return self.__age_of_build(job, self.__last_completed_build_url)
+        return self.__age_of_build(job, 'lastCompletedBuild')
 
     def __age_of_last_stable_build(self, job: Job) -> TimeDelta:
         """ Return the age of the last stable build of the job. """
-        return self.__age_of_build(job, self._last_stable_build_url)
+        return self.__age_of_build(job, 'lastStableBuild')
 
-    def __age_of_build(self, job: Job, url: str) -> TimeDelta:
-        """ Return the age of the last completed or stable build of the job. """
-        build_time = self._job_datetime(job, url)
+    def __age_of_build(self, job: Job, build: str) -> TimeDelta:
+        """ Return the age of the last completed or stable build of the job, as retrieved with the jobs. """
+        build_time = self.__build_datetime(job, build)
         return datetime.timedelta.max if build_time == datetime.datetime.min else \
             datetime.datetime.utcnow() - build_time
 
+    @staticmethod
+    def __build_datetime(job: Job, build: str) -> DateTime:
+        """ Return the datetime of the last completed or stable build of the job, as retrieved with the jobs. """
+        build_info = job.get(build)
+        if not build_info:
+            return datetime.datetime.min  # The job has no such build
+        try:
+            return datetime.datetime.utcfromtimestamp(float(build_info['timestamp']) / 1000)
+        except (TypeError, KeyError, ValueError) as reason:
+            logging.warning("Couldn't get timestamp of %s of job %s: %s.", build, job['name'], reason)
+            return datetime.datetime.min
+
+    @staticmethod
+    def _job_url(url: str, job_name: str) -> str:
+        """ Return the url for the job, given a url with a {job} placeholder for the job path. Jenkins puts jobs in
+            folders under job/ as well, so the nested job 'folder/job' has the job path 'folder/job/job'. """
+        return url.format(job='/job/'.join(job_name.split('/')))
+
     def _job_datetime(self, job: Job, url: str) -> DateTime:
         """ Return the datetime of the last completed or stable build of the job. """
-        builds_url = url.format(job=job['name']) + self.api_postfix
+        builds_url = self._job_url(url, job['name']) + self.api_postfix
         try:
             job = self._api(builds_url)
         except url_opener.UrlOpener.url_open_exceptions:
@@ -138,21 +184,15 @@ class Jenkins(ci_server.CIServer, url_opener.UrlOpener):
             logging.warning("Couldn't get timestamp from %s: %s.", builds_url, reason)
             return datetime.datetime.min
 
-    def __has_builds(self, job: Job) -> bool:
+    @staticmethod
+    def __has_builds(job: Job) -> bool:
         """ Return whether the job has builds or not. """
-        return bool(self._api(self.__builds_api_url.format(job=job['name']))['builds'])
+        return bool(job.get('builds'))
 
     @functools.lru_cache(maxsize=1024)
     def _api(self, url: str) -> Dict:
         """ Return the result of the API call at the url. """
-        data = self.url_read(url)
-        if isinstance(data, bytes):
-            data = data.decode('utf-8')
-        try:
-            return ast.literal_eval(data)
-        except Exception as reason:
-            logging.error("Couldn't evaluate %s from %s: %s", data, url, reason)
-            raise
+        return self.__api.read(url)
 
     def url_open(self, url: str) -> IO:
         """ Override to safely quote the url, needed because Jenkins may return unquoted urls. """
@@ -0,0 +1,100 @@
+"""
+Copyright 2012-2017 Ministerie van Sociale Zaken en Werkgelegenheid
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import ast
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict
+
+from ..url_opener import UrlOpener
+
+
+class JenkinsApi(object):
+    """ Client for the remote API of Jenkins, shared by the metric sources that read from Jenkins. Responses are
+        read from the JSON API. If the JSON API response can't be parsed but the Python API response can, the client
+        assumes the server only exposes the Python API and uses that from then on. HTTP errors are passed on, so
+        failing urls aren't read twice. """
+
+    json_postfix = 'api/json'
+    python_postfix = 'api/python'
+
+    __lock = threading.Lock()
+    __nr_parses = 0
+    __parse_time = 0.
+    __nr_fallbacks = 0
+
+    def __init__(self, url_read: Callable[[str], str], clock: Callable[[], float]=time.perf_counter) -> None:
+        self.__url_read = url_read
+        self.__clock = clock
+        self.__python_only = False
+
+    def read(self, api_url: str) -> Any:
+        """ Return the parsed response of the JSON API url. Raises one of the url open exceptions if the url can't be
+            read and a ValueError if the response can't be parsed. """
+        python_url = self.python_url(api_url)
+        if self.__python_only:
+            return self.__read(python_url, self.__parse_python)
+        try:
+            return self.__read(api_url, json.loads)
+        except ValueError as reason:
+            try:
+                result = self.__read(python_url, self.__parse_python)
+            except UrlOpener.url_open_exceptions + (ValueError,) as python_reason:
+                raise reason from python_reason
+        logging.warning("Jenkins API %s couldn't be parsed, using the Python API instead", api_url)
+        self.__python_only = True
+        with self.__lock:
+            JenkinsApi.__nr_fallbacks += 1
+        return result
+
+    @classmethod
+    def python_url(cls, api_url: str) -> str:
+        """ Return the Python API url corresponding to the JSON API url. """
+        head, separator, tail = api_url.rpartition(cls.json_postfix)
+        return head + cls.python_postfix + tail if separator else api_url
+
+    @classmethod
+    def statistics(cls) -> Dict[str, float]:
+        """ Return the number of parsed responses, the time spent parsing them, and the number of times the JSON API
+            couldn't be used. """
+        with cls.__lock:
+            return dict(parses=cls.__nr_parses, parse_time=cls.__parse_time, fallbacks=cls.__nr_fallbacks)
+
+    def __read(self, url: str, parse: Callable[[str], Any]) -> Any:
+        """ Read the url and parse the response, keeping track of the time spent parsing. """
+        data = self.__url_read(url)
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        start = self.__clock()
+        try:
+            return parse(data)
+        except ValueError as reason:
+            logging.warning("Couldn't parse %s from %s: %s", data, url, reason)
+            raise
+        finally:
+            with self.__lock:
+                JenkinsApi.__nr_parses += 1
+                JenkinsApi.__parse_time += self.__clock() - start
+
+    @staticmethod
+    def __parse_python(data: str) -> Any:
+        """ Parse a response of the Python API. """
+        try:
+            return ast.literal_eval(data)
+        except (SyntaxError, TypeError, ValueError) as reason:
+            raise ValueError(reason) from reason
@@ -0,0 +1,79 @@
+"""
+Copyright 2012-2017 Ministerie van Sociale Zaken en Werkgelegenheid
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import logging
+import threading
+import time
+import urllib.error
+import urllib.parse
+from typing import Callable, Dict, List
+
+
+class CircuitOpenError(urllib.error.URLError):
+    """ Exception raised when a url is not opened because its host is considered unreachable. """
+
+
+class CircuitBreaker(object):
+    """ Keep track of consecutive connection failures per host. After too many consecutive failures, requests to
+        the host fail immediately until the cool down period has passed, instead of each waiting for a time out. """
+
+    def __init__(self, max_failures: int=3, cool_down: float=300, clock: Callable[[], float]=time.monotonic) -> None:
+        self.__max_failures = max_failures
+        self.__cool_down = cool_down
+        self.__clock = clock
+        self.__failures: Dict[str, int] = dict()
+        self.__open_until: Dict[str, float] = dict()
+        self.__tripped_hosts: List[str] = []
+        self.__lock = threading.Lock()
+
+    def check(self, url: str) -> None:
+        """ Raise a CircuitOpenError if the host of the url is considered unreachable. """
+        host = self.host(url)
+        with self.__lock:
+            open_until = self.__open_until.get(host, 0)
+        if self.__clock() < open_until:
+            raise CircuitOpenError("Not opening {0} because {1} failed {2} times in a row".format(
+                url, host, self.__max_failures))
+
+    def success(self, url: str) -> None:
+        """ Record that the host of the url could be reached. """
+        host = self.host(url)
+        with self.__lock:
+            self.__failures.pop(host, None)
+            self.__open_until.pop(host, None)
+
+    def failure(self, url: str) -> None:
+        """ Record that the host of the url couldn't be reached and open the circuit if it failed too often. """
+        host = self.host(url)
+        with self.__lock:
+            failures = self.__failures[host] = self.__failures.get(host, 0) + 1
+            if failures < self.__max_failures:
+                return
+            self.__open_until[host] = self.__clock() + self.__cool_down
+            if host not in self.__tripped_hosts:
+                self.__tripped_hosts.append(host)
+        logging.warning("%s failed %d times in a row, not contacting it for %d seconds", host, failures,
+                        self.__cool_down)
+
+    def tripped_hosts(self) -> List[str]:
+        """ Return the hosts that were considered unreachable at some point. """
+        with self.__lock:
+            return self.__tripped_hosts[:]
+
+    @staticmethod
+    def host(url: str) -> str:
+        """ Return the host, including the port if any, of the url. """
+        return urllib.parse.urlsplit(url).netloc.rpartition('@')[2]
@@ -0,0 +1,229 @@
+"""
+Copyright 2012-2017 Ministerie van Sociale Zaken en Werkgelegenheid
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import http.client
+import threading
+import time
+import urllib.error
+import urllib.request
+import urllib.response
+import weakref
+from typing import Callable, Dict, List, Optional, Tuple, Type
+
+
+class ConnectionPool(object):
+    """ Pool of persistent (keep-alive) HTTP and HTTPS connections per host. Connections are returned to the pool
+        after the response has been read completely and are closed when they have been idle too long or when the
+        pool for the host is full. Connections tunnelled through a proxy are pooled per proxy and origin host. """
+
+    def __init__(self, max_connections_per_host: int=8, max_idle_time: float=30,
+                 clock: Callable[[], float]=time.monotonic) -> None:
+        self.__max_connections_per_host = max_connections_per_host
+        self.__max_idle_time = max_idle_time
+        self.__clock = clock
+        self.__idle_connections: Dict[Tuple, List[Tuple[http.client.HTTPConnection, float]]] = dict()
+        self.__lock = threading.Lock()
+
+    def handlers(self) -> List[urllib.request.BaseHandler]:
+        """ Return the url handlers that use this pool, to be passed to urllib.request.build_opener. """
+        return [KeepAliveHTTPHandler(self), KeepAliveHTTPSHandler(self)]
+
+    def open(self, connection_class: Type[http.client.HTTPConnection], request: urllib.request.Request,
+             **connection_args) -> urllib.response.addinfourl:
+        """ Send the request using a pooled connection and return the response. The response body is not read
+            here; the connection is returned to the pool once the caller has read the complete body. """
+        tunnel_host = getattr(request, '_tunnel_host', None)
+        tunnel_headers = self.__tunnel_headers(request) if tunnel_host else dict()
+        key = (connection_class, request.host, tunnel_host)
+        connection, reused = self.__acquire(key), True
+        if connection is None:
+            connection, reused = self.__connect(connection_class, request, tunnel_host, tunnel_headers,
+                                                **connection_args), False
+        try:
+            response = self.__send(connection, request)
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            connection.close()
+            if not reused:
+                raise
+            # The server closed the idle connection, try once more with a fresh connection:
+            connection = self.__connect(connection_class, request, tunnel_host, tunnel_headers, **connection_args)
+            response = self.__send(connection, request)
+        if response.length == 0:
+            response.read()  # There's no body, so the connection can be reused right away
+        result = urllib.response.addinfourl(PooledResponse(response, lambda: self.__release(key, connection),
+                                                           connection.close),
+                                            response.msg, request.get_full_url(), response.status)
+        result.msg = response.reason
+        return result
+
+    def close(self) -> None:
+        """ Close all idle connections. """
+        with self.__lock:
+            idle_connections = [connection for connections in self.__idle_connections.values()
+                                for connection, _ in connections]
+            self.__idle_connections.clear()
+        for connection in idle_connections:
+            connection.close()
+
+    def nr_idle_connections(self) -> int:
+        """ Return the number of idle connections in the pool. """
+        with self.__lock:
+            return sum(len(connections) for connections in self.__idle_connections.values())
+
+    @staticmethod
+    def __connect(connection_class: Type[http.client.HTTPConnection], request: urllib.request.Request,
+                  tunnel_host: Optional[str], tunnel_headers: Dict[str, str],
+                  **connection_args) -> http.client.HTTPConnection:
+        """ Create a new connection, tunnelled through the proxy if the request has a tunnel host. """
+        connection = connection_class(request.host, timeout=request.timeout, **connection_args)
+        if tunnel_host:
+            connection.set_tunnel(tunnel_host, headers=tunnel_headers)
+        return connection
+
+    @staticmethod
+    def __tunnel_headers(request: urllib.request.Request) -> Dict[str, str]:
+        """ Return the headers for setting up the tunnel. Like urllib does, the proxy authorization header is sent
+            to the proxy when setting up the tunnel and not to the origin host. """
+        proxy_authorization = request.unredirected_hdrs.pop('Proxy-authorization', None) or \
+            request.headers.pop('Proxy-authorization', None)
+        return {'Proxy-Authorization': proxy_authorization} if proxy_authorization else dict()
+
+    @staticmethod
+    def __send(connection: http.client.HTTPConnection, request: urllib.request.Request) -> http.client.HTTPResponse:
+        """ Send the request over the connection and return the response. """
+        headers = dict(request.unredirected_hdrs)
+        headers.update({name: value for name, value in request.headers.items() if name not in headers})
+        headers = {name.title(): value for name, value in headers.items()}
+        headers['Connection'] = 'keep-alive'
+        connection.timeout = request.timeout
+        if connection.sock:
+            connection.sock.settimeout(request.timeout)
+        try:
+            connection.request(request.get_method(), request.selector, request.data, headers)
+            return connection.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            raise  # Let the caller decide whether to retry
+        except OSError as reason:
+            connection.close()
+            raise urllib.error.URLError(reason)
+        except http.client.HTTPException:
+            connection.close()
+            raise
+
+    def __acquire(self, key: Tuple) -> http.client.HTTPConnection:
+        """ Return an idle connection for the key, if any. Close connections that have been idle too long. """
+        expired = []
+        connection = None
+        with self.__lock:
+            connections = self.__idle_connections.get(key, [])
+            while connections:
+                candidate, idle_since = connections.pop()
+                if self.__clock() - idle_since > self.__max_idle_time:
+                    expired.append(candidate)
+                else:
+                    connection = candidate
+                    break
+        for expired_connection in expired:
+            expired_connection.close()
+        return connection
+
+    def __release(self, key: Tuple, connection: http.client.HTTPConnection) -> None:
+        """ Return the connection to the pool, or close it if the pool for the host is full. """
+        with self.__lock:
+            connections = self.__idle_connections.setdefault(key, [])
+            if len(connections) < self.__max_connections_per_host:
+                connections.append((connection, self.__clock()))
+                return
+        connection.close()
+
+
+class PooledResponse(object):
+    """ Response body that streams from the connection. When the body has been read completely, the connection is
+        released so it can be reused, unless the server wants to close it. Closing the response before the body
+        has been read completely closes the connection, and so does discarding the response without reading or
+        closing it. """
+
+    def __init__(self, response: http.client.HTTPResponse, release: Callable[[], None],
+                 close: Callable[[], None]) -> None:
+        self.__response = response
+        self.__release = release
+        self.__close_connection = weakref.finalize(self, close)
+        self.__done = False
+        self.__finish_if_read()
+
+    def read(self, size: int=-1) -> bytes:
+        """ Read at most size bytes, or the rest of the body if size is negative. A read with size returns the bytes
+            received so far instead of waiting until size bytes have been received, so callers can check deadlines
+            between reads. """
+        data = self.__response.read() if size is None or size < 0 else self.__response.read1(size)
+        self.__finish_if_read()
+        return data
+
+    def readline(self, size: int=-1) -> bytes:
+        """ Read one line. """
+        data = self.__response.readline(size)
+        self.__finish_if_read()
+        return data
+
+    def close(self) -> None:
+        """ Close the response. The connection is closed if the body has not been read completely. """
+        if not self.__done:
+            self.__done = True
+            self.__response.close()
+            self.__close_connection()
+
+    def __finish_if_read(self) -> None:
+        """ Release or close the connection if the complete body has been read. """
+        if self.__done or not (self.__response.isclosed() or self.__response.length == 0):
+            return
+        self.__done = True
+        self.__response.close()  # Reading the last bytes with read1 doesn't close the response, so close it here
+        if self.__response.will_close:
+            self.__close_connection()
+        else:
+            self.__close_connection.detach()
+            self.__release()
+
+    def __getattr__(self, attribute: str):
+        return getattr(self.__response, attribute)
+
+
+class ClosingHTTPBasicAuthHandler(urllib.request.HTTPBasicAuthHandler):
+    """ Basic authentication handler that closes the 401 response before retrying with credentials, so the
+        connection of the unread response isn't left open. """
+    def http_error_401(self, req, fp, code, msg, headers):
+        fp.close()
+        return super().http_error_401(req, fp, code, msg, headers)
+
+
+class KeepAliveHTTPHandler(urllib.request.HTTPHandler):
+    """ HTTP handler that reuses connections from the connection pool. """
+    def __init__(self, connection_pool: ConnectionPool, debuglevel: int=0) -> None:
+        self.__connection_pool = connection_pool
+        super().__init__(debuglevel)
+
+    def http_open(self, req: urllib.request.Request) -> urllib.response.addinfourl:
+        return self.__connection_pool.open(http.client.HTTPConnection, req)
+
+
+class KeepAliveHTTPSHandler(urllib.request.HTTPSHandler):
+    """ HTTPS handler that reuses connections, and thus TLS sessions, from the connection pool. """
+    def __init__(self, connection_pool: ConnectionPool, debuglevel: int=0) -> None:
+        self.__connection_pool = connection_pool
+        super().__init__(debuglevel)
+
+    def https_open(self, req: urllib.request.Request) -> urllib.response.addinfourl:
+        return self.__connection_pool.open(http.client.HTTPSConnection, req, context=self._context)
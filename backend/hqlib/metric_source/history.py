@@ -14,41 +14,87 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import bisect
 import datetime
 import functools
 import io
 import json
 import logging
+import os
+import threading
 from ast import literal_eval
-from typing import Callable, TextIO, List, Dict, Union, Tuple, cast
+from typing import BinaryIO, Callable, Iterator, TextIO, List, Dict, Optional, Union, Tuple, cast
 
 from .. import domain
 from ..typing import DateTime, HistoryRecord, Number
 
 
 class CompactHistory(domain.MetricSource):
-    """ Class for reading and writing history JSON files. """
-    def __init__(self, history_filename: str, recent_history: int=100, file_: Callable[[str], TextIO]=None) -> None:
+    """ Class for reading and writing history JSON files. The history file contains, per metric, the intervals in
+        which the metric had the same value and status. Reports are not added to the history file directly, but
+        appended as one JSON record per line to a log file next to it. When the log gets long, the records are merged
+        into the history file in a background thread. Reading the history replays the log on top of the history
+        file, so callers don't notice whether a report has been merged or not.
+
+        Next to the history file, the compaction also writes an index file with the dates and statuses and, per
+        metric, only the intervals that overlap with the most recent dates plus the last interval. The index is read
+        instead of the history file, so reading the history doesn't parse the complete history file.
+
+        Note that the history consists of three files: the history file, the log and the index. Jobs that copy or
+        commit the history file need to copy or commit the log and the index too, or call compact() first. """
+    log_file_extension = '.log'
+    index_file_extension = '.index'
+    compaction_threshold = 50  # Number of records in the log after which the log is merged into the history file
+    index_window = 1000  # Number of recent dates for which the index contains the measurements of the metrics
+
+    def __init__(self, history_filename: str, recent_history: int=100, file_: Callable[..., TextIO]=None) -> None:
         self.__history_filename = history_filename
         self.__recent_history = recent_history
         self.__file = file_ if file_ else open
+        self.__history: Optional[Dict[str, Union[List, Dict]]] = None
+        self.__interval_index: Dict[str, Optional[List[str]]] = dict()
+        self.__recent_histories: Optional[Dict[str, List[Number]]] = None
+        self.__lock = threading.Lock()
+        self.__compaction_lock = threading.Lock()
+        self.__compaction_thread: Optional[threading.Thread] = None
         super().__init__(url=history_filename)
 
     def filename(self) -> str:
         """ Return the history filename """
         return self.__history_filename
 
+    def log_filename(self) -> str:
+        """ Return the filename of the log with the reports not yet merged into the history file. """
+        return self.__history_filename + self.log_file_extension
+
+    def index_filename(self) -> str:
+        """ Return the filename of the index with the recent part of the history. """
+        return self.__history_filename + self.index_file_extension
+
     def recent_history(self, metric_id) -> List[Number]:
-        """ Retrieve the recent history for the metric_ids. """
+        """ Retrieve the recent history for the metric_ids. The recent history of all metrics is computed in one pass
+            when the recent history of the first metric is needed, and kept until a report is added. """
+        recent_histories = self.__recent_histories
+        if recent_histories is None:
+            recent_histories = self.__recent_histories = self.recent_history_for_all()
+        return list(recent_histories.get(metric_id, []))
+
+    def recent_history_for_all(self) -> Dict[str, List[Number]]:
+        """ Retrieve the recent history of all metrics. The recent dates and the measurements of each metric are both
+            sorted, so they can be merged in one pass. """
         history = self.__read_history()
-        measurements = history['metrics'].get(metric_id, [])
-        values = []
-        for date in history['dates'][-self.__recent_history:]:
-            for measurement in reversed(measurements):
-                if measurement['start'] <= date <= measurement['end']:
-                    values.append(measurement.get('value', -1))
-                    break  # Next date
-        return values
+        recent_dates = history['dates'][-self.__recent_history:]
+        chronological = recent_dates == sorted(recent_dates)
+        recent_histories = dict()
+        for metric_id, measurements in history['metrics'].items():
+            start_dates = self.__start_dates(metric_id, measurements)
+            if chronological and start_dates is not None:
+                recent_histories[metric_id] = self.__merge_recent_values(measurements, start_dates, recent_dates)
+            else:
+                recent_histories[metric_id] = [measurement.get('value', -1) for measurement in
+                                               (self.__measurement(measurements, date) for date in recent_dates)
+                                               if measurement]
+        return recent_histories
 
     def status_start_date(self, metric_id: str, current_status: str,
                           now: Callable[[], DateTime]=datetime.datetime.now) -> DateTime:
@@ -77,44 +123,186 @@ class CompactHistory(domain.MetricSource):
         self.add_metrics(quality_report.date(), quality_report.metrics())
 
     def add_metrics(self, date_time, metrics):
-        """ Add the metrics to the history file. """
-        history = self.__read_history()
-        date = date_time.strftime('%Y-%m-%d %H:%M:%S')
-        history['dates'].append(date)
-        history['statuses'].append(dict())
+        """ Add the metrics to the history by appending a record to the log. Start merging the log into the history
+            file in the background if the log has become long enough or if the index is missing. """
+        record = dict(date=date_time.strftime('%Y-%m-%d %H:%M:%S'), metrics=dict())
         for metric in metrics:
-            measurements = history['metrics'].setdefault(metric.stable_id(), [])
             value = metric.numerical_value()
-            status = metric.status()
-            if measurements and measurements[-1].get('value', -1) == value and measurements[-1].get('status') == status:
-                measurements[-1]['end'] = date
-            else:
-                new_measurement = dict(start=date, end=date, status=status)
-                if value != -1:
-                    new_measurement['value'] = value
-                measurements.append(new_measurement)
-            history['statuses'][-1][status] = history['statuses'][-1].get(status, 0) + 1
-        self.__write_history(history)
+            record['metrics'][metric.stable_id()] = dict(status=metric.status()) if value == -1 else \
+                dict(status=metric.status(), value=value)
+        with self.__lock:
+            with self.__file(self.log_filename(), mode='a', encoding='utf-8') as log_file:
+                log_file.write(json.dumps(record, sort_keys=True) + '\n')
+            if self.__history is not None:
+                self.__merge_records(self.__history, [record])
+                self.__interval_index.clear()
+                self.__recent_histories = None
+        index_missing = os.path.exists(self.__history_filename) and not os.path.exists(self.index_filename())
+        if (len(self.__read_log()) >= self.compaction_threshold or index_missing) and not self.__compacting():
+            self.__compaction_thread = threading.Thread(target=self.compact, name='History compaction')
+            self.__compaction_thread.start()
+
+    def compact(self) -> None:
+        """ Merge the records in the log into the history file, update the index and remove the merged records from
+            the log. Reading and writing the history file is done without holding the lock, so the history can be
+            used while compacting. The lock is only held for replacing the files. The history file, the index and the
+            log are replaced atomically, so an interrupted compaction doesn't corrupt the history. """
+        with self.__compaction_lock:
+            records = self.__read_log()
+            if not records and (os.path.exists(self.index_filename()) or
+                                not os.path.exists(self.__history_filename)):
+                return
+            history = self.__read_history_file()
+            self.__merge_records(history, records)
+            history_filename = self.__write_temporary_file(
+                self.__history_filename, lambda history_file: json.dump(history, history_file, sort_keys=True,
+                                                                         indent=2))
+            index_filename = self.__write_temporary_file(
+                self.index_filename(), lambda index_file: json.dump(self.__index(history), index_file))
+            with self.__lock:
+                os.replace(history_filename, self.__history_filename)
+                os.replace(index_filename, self.index_filename())
+                remaining_records = self.__read_log()[len(records):]
+                log_filename = self.__write_temporary_file(self.log_filename(), lambda log_file: log_file.writelines(
+                    json.dumps(record, sort_keys=True) + '\n' for record in remaining_records))
+                os.replace(log_filename, self.log_filename())
+        logging.info('Merged %d records from %s into %s', len(records), self.log_filename(), self.__history_filename)
+
+    @staticmethod
+    def __merge_recent_values(measurements: List[Dict], start_dates: List[str],
+                              recent_dates: List[str]) -> List[Number]:
+        """ Return the values of the measurements on the recent dates. The start of the recent dates is looked up in
+            the start dates, after which the recent dates and the measurements are walked through together. """
+        index = max(bisect.bisect_right(start_dates, recent_dates[0]) - 1, 0) if recent_dates else 0
+        values = []
+        for date in recent_dates:
+            while index < len(measurements) - 1 and measurements[index + 1]['start'] <= date:
+                index += 1
+            if index < len(measurements) and measurements[index]['start'] <= date <= measurements[index]['end']:
+                values.append(measurements[index].get('value', -1))
+        return values
+
+    @staticmethod
+    def __measurement(measurements: List[Dict], date: str) -> Optional[Dict]:
+        """ Return the last measurement that includes the date, if any. """
+        return next((measurement for measurement in reversed(measurements)
+                     if measurement['start'] <= date <= measurement['end']), None)
+
+    def __start_dates(self, metric_id: str, measurements: List[Dict]) -> Optional[List[str]]:
+        """ Return the sorted start dates of the measurements of the metric. The index is created once per metric.
+            Return None if the measurements overlap, because of records added out of chronological order. """
+        with self.__lock:
+            if metric_id not in self.__interval_index:
+                chronological = all(measurement['end'] < next_measurement['start'] for measurement, next_measurement
+                                    in zip(measurements, measurements[1:]))
+                self.__interval_index[metric_id] = [measurement['start'] for measurement in measurements] \
+                    if chronological else None
+            return self.__interval_index[metric_id]
+
+    def __compacting(self) -> bool:
+        """ Return whether the log is being merged into the history file. """
+        return self.__compaction_thread is not None and self.__compaction_thread.is_alive()
 
-    @functools.lru_cache(maxsize=1024)
     def __read_history(self) -> Dict[str, Union[List, Dict]]:
+        """ Return the history, including the records in the log. The history is read once and kept in memory. The
+            index is read instead of the history file, unless the index is missing or doesn't contain enough dates
+            for the recent history. """
+        with self.__lock:
+            if self.__history is None:
+                history = self.__read_index()
+                if history is None:
+                    history = self.__read_history_file()
+                self.__merge_records(history, self.__read_log())
+                self.__history = history
+            return self.__history
+
+    def __read_history_file(self) -> Dict[str, Union[List, Dict]]:
         """ Return the parsed history JSON. """
         try:
             return json.load(self.__file(self.__history_filename))
         except FileNotFoundError:
             return dict(dates=[], statuses=[], metrics={})
 
-    def __write_history(self, history):
-        """ Write the history to the JSON file. """
-        json.dump(history, self.__file(self.__history_filename, mode='w', encoding='utf-8'),
-                  sort_keys=True, indent=2)
+    def __read_index(self) -> Optional[Dict[str, Union[List, Dict]]]:
+        """ Return the parsed index JSON, or None if there is no index or if the index doesn't contain enough dates
+            for the recent history. """
+        try:
+            index = json.load(self.__file(self.index_filename()))
+        except FileNotFoundError:
+            return None
+        return index if index.pop('window', 0) >= self.__recent_history else None
+
+    def __read_log(self) -> List[Dict]:
+        """ Return the records in the log. """
+        try:
+            log_file = self.__file(self.log_filename())
+        except FileNotFoundError:
+            return []
+        records = [json.loads(line) for line in log_file if line.strip()]
+        log_file.close()
+        return records
+
+    def __index(self, history: Dict[str, Union[List, Dict]]) -> Dict[str, Union[List, Dict, int]]:
+        """ Return the index for the history: the dates and statuses and, per metric, the intervals that end on or
+            after the first of the recent dates, plus the last interval. """
+        recent_dates = history['dates'][-self.index_window:]
+        first_recent_date = min(recent_dates) if recent_dates else ''
+        metrics = dict()
+        for metric_id, measurements in history['metrics'].items():
+            recent_measurements = [measurement for measurement in measurements
+                                   if measurement['end'] >= first_recent_date]
+            if measurements and (not recent_measurements or recent_measurements[-1] is not measurements[-1]):
+                recent_measurements.append(measurements[-1])
+            metrics[metric_id] = recent_measurements
+        return dict(window=self.index_window, dates=history['dates'], statuses=history['statuses'], metrics=metrics)
+
+    @classmethod
+    def __merge_records(cls, history: Dict[str, Union[List, Dict]], records: List[Dict]) -> None:
+        """ Add the records that are not yet in the history to the history. Records with a date that is already in
+            the history have been merged already, but may still be in the log if a compaction was interrupted. """
+        dates = set(history['dates'])
+        for record in records:
+            if record['date'] in dates:
+                logging.warning('Skipping the logged report of %s because the history already contains a report of '
+                                'that date', record['date'])
+            else:
+                cls.__add_record(history, record)
+                dates.add(record['date'])
+
+    @staticmethod
+    def __add_record(history: Dict[str, Union[List, Dict]], record: Dict) -> None:
+        """ Add the record to the history. """
+        date = record['date']
+        history['dates'].append(date)
+        history['statuses'].append(dict())
+        for metric_id, measurement in record['metrics'].items():
+            measurements = history['metrics'].setdefault(metric_id, [])
+            value, status = measurement.get('value', -1), measurement['status']
+            if measurements and measurements[-1].get('value', -1) == value and \
+                    measurements[-1].get('status') == status and measurements[-1]['end'] <= date:
+                measurements[-1]['end'] = date
+            else:
+                new_measurement = dict(start=date, end=date, status=status)
+                if value != -1:
+                    new_measurement['value'] = value
+                measurements.append(new_measurement)
+            history['statuses'][-1][status] = history['statuses'][-1].get(status, 0) + 1
+
+    def __write_temporary_file(self, filename: str, write: Callable[[TextIO], None]) -> str:
+        """ Write a temporary file next to the file and return its filename, so it can replace the file. """
+        temporary_filename = filename + '.tmp'
+        with self.__file(temporary_filename, mode='w', encoding='utf-8') as temporary_file:
+            write(temporary_file)
+        return temporary_filename
 
 
 class History(domain.MetricSource):
-    """ Class representing the history file. """
+    """ Class representing the history file. The recent history is read from the end of the file, so only the lines
+        needed are parsed. """
     metric_source_name = 'Measurement history file'
+    block_size = 64 * 1024  # Number of bytes read at a time when reading the history file backwards
 
-    def __init__(self, history_filename: str, recent_history: int=100, file_: Callable[[str], TextIO]=None) -> None:
+    def __init__(self, history_filename: str, recent_history: int=100, file_: Callable[..., BinaryIO]=None) -> None:
         self.__history_filename = history_filename
         self.__recent_history = recent_history
         self.__file = file_ if file_ else open
@@ -139,10 +327,10 @@ class History(domain.MetricSource):
         return date if last_status == current_status else now()
 
     def statuses(self) -> List[Dict[str, Union[str, int]]]:
-        """ Return the statuses for each measurement. """
-        measurements = self.__load_history(recent_only=False)
+        """ Return the statuses for each measurement. The history file is read line by line, so only the status
+            counts are kept in memory. """
         statuses = []
-        for measurement in measurements:
+        for measurement in self.__measurements(self.__lines()):
             measurement_statuses: Dict[str, int] = dict()
             for measurement_data in list(measurement.values()):
                 if isinstance(measurement_data, tuple):
@@ -157,7 +345,7 @@ class History(domain.MetricSource):
     def __last_status(self, metric_id: str) -> Tuple[str, DateTime]:
         """ Return the last recorded status of the metric and the date that the metric first had that status. """
         try:
-            last_measurement = self.__load_history()[-1][metric_id]
+            last_measurement = self.__load_recent_history()[-1][metric_id]
         except (IndexError, KeyError):
             last_measurement = None
         if isinstance(last_measurement, tuple) and len(last_measurement) >= 3:
@@ -172,9 +360,9 @@ class History(domain.MetricSource):
             return '', datetime.datetime.min
 
     @functools.lru_cache(maxsize=1024)
-    def __historic_values(self, recent_only: bool=True) -> List[Dict[str, int]]:
-        """ Return only the historic values from the history file, so without the status and status date. """
-        measurements = self.__load_history(recent_only)
+    def __historic_values(self) -> List[Dict[str, int]]:
+        """ Return only the recent historic values from the history file, so without the status and status date. """
+        measurements = self.__load_recent_history()
         value_only_measurements = []
         for measurement in measurements:
             values_only_measurement: Dict[str, int] = dict()
@@ -184,24 +372,58 @@ class History(domain.MetricSource):
             value_only_measurements.append(values_only_measurement)
         return value_only_measurements
 
-    def __load_history(self, recent_only: bool=True) -> List[HistoryRecord]:
-        """ Load measurements from the history file. """
-        lines = self.__load_complete_history()
-        return lines[-self.__recent_history:] if recent_only else lines
-
     @functools.lru_cache(maxsize=1024)
-    def __load_complete_history(self) -> List[HistoryRecord]:
-        """ Load all measurements from the history file. """
+    def __load_recent_history(self) -> List[HistoryRecord]:
+        """ Load the recent measurements from the history file, reading the file from the end. """
+        measurements = []
+        for measurement in self.__measurements(self.__reversed_lines()):
+            measurements.append(measurement)
+            if len(measurements) == self.__recent_history:
+                break
+        measurements.reverse()
+        logging.info('Read %d lines from %s', len(measurements), self.__history_filename)
+        return measurements
+
+    @staticmethod
+    def __measurements(lines: Iterator[str]) -> Iterator[HistoryRecord]:
+        """ Parse the lines and yield the measurements. """
+        for line in lines:
+            if line.strip():
+                measurement = literal_eval(line.strip())
+                if len(measurement) > 6:  # Weed out lines with meta metrics only
+                    yield measurement
+
+    def __lines(self) -> Iterator[str]:
+        """ Yield the lines of the history file. """
+        history_file = self.__open()
+        with history_file:
+            for line in history_file:
+                yield line.decode('utf-8')
+
+    def __reversed_lines(self) -> Iterator[str]:
+        """ Yield the lines of the history file, starting with the last line. The file is read backwards in blocks,
+            so reading stops as soon as the caller has seen enough lines. """
+        history_file = self.__open()
+        with history_file:
+            position = history_file.seek(0, io.SEEK_END)
+            remainder = b''
+            while position > 0:
+                size = min(self.block_size, position)
+                position -= size
+                history_file.seek(position)
+                lines = (history_file.read(size) + remainder).split(b'\n')
+                remainder = lines.pop(0)
+                for line in reversed(lines):
+                    yield line.decode('utf-8')
+            yield remainder.decode('utf-8')
+
+    def __open(self) -> BinaryIO:
+        """ Open the history file for reading. """
         try:
-            history_file = self.__file(self.__history_filename)
+            return self.__file(self.__history_filename, mode='rb')
         except IOError:
             logging.warning('Could not open %s', self.__history_filename)
-            history_file = io.StringIO()  # Fake an empty file
-        lines = [literal_eval(line) for line in history_file if line.strip()]
-        history_file.close()
-        lines = [line for line in lines if len(line) > 6]  # Weed out lines with meta metrics only
-        logging.info('Read %d lines from %s', len(lines), self.__history_filename)
-        return lines
+            return io.BytesIO()  # Fake an empty file
 
     def add_report(self, quality_report):
         """ Write the report to the history file. """
@@ -32,10 +32,12 @@ class TrelloObject(object):
 
     url_template = 'https://api.trello.com/1/{object_type}/{object_id}{argument}?key={appkey}&token={token}{parameters}'
 
-    def __init__(self, object_id: str, appkey: str, token: str, urlopen=urllib.request.urlopen) -> None:
+    def __init__(self, object_id: str, appkey: str, token: str, urlopen=urllib.request.urlopen,
+                 timeout: url_opener.Timeout=None) -> None:
         self._appkey = appkey
         self._token = token
         self.__urlopen = urlopen
+        self.__timeout = timeout or url_opener.Timeout()
         object_type = self.__class__.__name__[len('Trello'):].lower()
         self.__parameters = dict(object_type=object_type, object_id=object_id, appkey=appkey, token=token)
         self.__json: Dict[str, Any] = dict()
@@ -58,8 +60,16 @@ class TrelloObject(object):
         """ Return and evaluate the JSON at the url. """
         if url in self.__json:
             return self.__json[url]
+        return url_opener.UrlOpener.single_flight.call(url, lambda: self.__read_json(url))
+
+    def __read_json(self, url: str) -> Any:
+        """ Read and evaluate the JSON at the url. """
+        recorder = url_opener.UrlOpener.default_recorder
         try:
-            json_string = self.__urlopen(url).read()
+            if recorder:
+                json_string = recorder.url_open('url ' + url, lambda: self.__timeout.open(self.__urlopen, url)).read()
+            else:
+                json_string = self.__timeout.open(self.__urlopen, url).read()
         except url_opener.UrlOpener.url_open_exceptions as reason:
             logging.warning("Couldn't open %s: %s", url, reason)
             raise
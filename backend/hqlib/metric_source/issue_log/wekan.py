@@ -15,13 +15,30 @@ limitations under the License.
 """
 
 import datetime
+import json
 import logging
-from typing import Dict, Iterator, Optional
+from typing import Dict, Iterator, Optional, Type
 
 import wekanapi
 
 from hqlib import domain, utils
 from hqlib.typing import DateTime
+from hqlib.metric_source.traffic_recorder import TrafficRecorder
+from hqlib.metric_source.url_opener import UrlOpener
+
+
+def recorded_api(api: Type[wekanapi.WekanApi], recorder: TrafficRecorder) -> Type[wekanapi.WekanApi]:
+    """ Return a subclass of the Wekan API whose calls are recorded or replayed by the traffic recorder. """
+
+    class RecordedWekanApi(api):  # type: ignore
+        """ Wekan API that records or replays its API calls. """
+        def api_call(self, url, *args, **kwargs):
+            """ Record or replay the API call. """
+            request = ' '.join(['wekan', self.api_url, json.dumps([url, args, kwargs], sort_keys=True, default=str)])
+            api_call = super().api_call
+            return recorder.call(request, lambda: api_call(url, *args, **kwargs))
+
+    return RecordedWekanApi
 
 
 class WekanBoard(domain.MetricSource):
@@ -104,8 +121,10 @@ class WekanBoard(domain.MetricSource):
 
     def __board(self) -> Optional[wekanapi.models.Board]:
         """ Return the Wekan board API. """
+        api_class = recorded_api(self.__wekan_api, UrlOpener.default_recorder) if UrlOpener.default_recorder \
+            else self.__wekan_api
         try:
-            api = self.__wekan_api(self.__url, credentials=dict(username=self.__username, password=self.__password))
+            api = api_class(self.__url, credentials=dict(username=self.__username, password=self.__password))
         except Exception as reason:
             logging.error("Couldn't create API for Wekan at %s for user %s: %s", self.__url, self.__username, reason)
             return None
@@ -33,14 +33,18 @@ class JenkinsOWASPDependencyReport(owasp_dependency_report.OWASPDependencyReport
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
         self.__report_url = self._last_successful_build_url + 'dependency-check-jenkins-pluginResult/'
-        self.__report_api_url = self.__report_url + self.api_postfix
 
         # URL for the partial OWASP dependency page listing individual files
         self.__report_html_file_list = self.__report_url + 'tab.files/'
 
+    def prefetch_urls(self, *metric_source_ids: str) -> List[str]:
+        """ Return the urls of the pages listing the vulnerable files of the jobs, so they can be fetched in advance.
+            Unlike the Jenkins build server, the reports don't need the jobs API. """
+        return [self._job_url(self.__report_html_file_list, job_name) for job_name in metric_source_ids]
+
     def _nr_warnings(self, job_name: str, priority: str) -> int:
         """ Return the number of vulnerable files of the specified type in the job. """
-        url = self.__report_html_file_list.format(job=job_name)
+        url = self._job_url(self.__report_html_file_list, job_name)
         try:
             soup = self._get_soup(url)
         except url_opener.UrlOpener.url_open_exceptions as reason:
@@ -57,7 +61,7 @@ class JenkinsOWASPDependencyReport(owasp_dependency_report.OWASPDependencyReport
 
     def metric_source_urls(self, *job_names: str) -> List[str]:
         """ Return the url of the job. """
-        return [self.__report_url.format(job=job_name) for job_name in job_names]
+        return [self._job_url(self.__report_url, job_name) for job_name in job_names]
 
     def _report_datetime(self, job_name: str) -> DateTime:
         """ Return the date and time of one report. """
@@ -65,5 +69,6 @@ class JenkinsOWASPDependencyReport(owasp_dependency_report.OWASPDependencyReport
 
     @functools.lru_cache(maxsize=1024)
     def _get_soup(self, url: str):
-        """ Get a beautiful soup of the HTML at the url. """
-        return bs4.BeautifulSoup(self.url_open(url), "lxml")
+        """ Get a beautiful soup of the HTML at the url. The url is read with url_read, so prefetched pages are
+            used. """
+        return bs4.BeautifulSoup(self.url_read(url), "lxml")
@@ -0,0 +1,113 @@
+"""
+Copyright 2012-2017 Ministerie van Sociale Zaken en Werkgelegenheid
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, NamedTuple, Optional
+
+
+class CachedResponse(NamedTuple):
+    """ A response body with the validators needed to revalidate it. """
+    body: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+    stored_at: float
+
+
+class ResponseCache(object):
+    """ On-disk cache of url responses that survives between runs. Responses are stored with their ETag and
+        Last-Modified validators so they can be revalidated with a conditional request. When the total size of the
+        cached responses exceeds the maximum size, the least recently used responses are evicted. """
+
+    def __init__(self, filename: str, max_size: int=500 * 1024 * 1024, default_ttl: float=0,
+                 clock: Callable[[], float]=time.time) -> None:
+        self.__max_size = max_size
+        self.__default_ttl = default_ttl
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(filename, check_same_thread=False)
+        with self.__connection:
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, body BLOB, '
+                                      'etag TEXT, last_modified TEXT, stored_at REAL, used_at REAL, size INTEGER)')
+
+    @staticmethod
+    def key(url: str, username: str=None, password: str=None) -> str:
+        """ Return the cache key for the url and credentials. The credentials are hashed, not stored. """
+        return hashlib.sha256('\n'.join([url, username or '', password or '']).encode('utf-8')).hexdigest()
+
+    def lookup(self, key: str) -> Optional[CachedResponse]:
+        """ Return the cached response for the key, if any. """
+        with self.__lock:
+            row = self.__connection.execute('SELECT body, etag, last_modified, stored_at FROM responses WHERE key = ?',
+                                            (key,)).fetchone()
+            if row:
+                with self.__connection:
+                    self.__connection.execute('UPDATE responses SET used_at = ? WHERE key = ?', (self.__clock(), key))
+        return CachedResponse(*row) if row else None
+
+    def ttl(self, ttl: float=None) -> float:
+        """ Return the time to live, in seconds, using the default time to live if no time to live is passed. """
+        return self.__default_ttl if ttl is None else ttl
+
+    def is_fresh(self, response: CachedResponse, ttl: float=None) -> bool:
+        """ Return whether the response is younger than the time to live and can be used without revalidation. """
+        return self.__clock() - response.stored_at < self.ttl(ttl)
+
+    def store(self, key: str, body: bytes, etag: str=None, last_modified: str=None) -> None:
+        """ Store the response and evict the least recently used responses if the cache is too big. """
+        now = self.__clock()
+        with self.__lock, self.__connection:
+            self.__connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                      (key, body, etag, last_modified, now, now, len(body)))
+            self.__evict()
+
+    def lookup_json(self, key: str) -> Any:
+        """ Return the JSON-serializable value stored for the key, if any. """
+        response = self.lookup(key)
+        return json.loads(response.body.decode('utf-8')) if response else None
+
+    def store_json(self, key: str, value: Any) -> None:
+        """ Store a JSON-serializable value, for example data derived from responses. """
+        self.store(key, json.dumps(value).encode('utf-8'))
+
+    def revalidated(self, key: str) -> None:
+        """ Record that the server confirmed the cached response is still valid. """
+        with self.__lock, self.__connection:
+            now = self.__clock()
+            self.__connection.execute('UPDATE responses SET stored_at = ?, used_at = ? WHERE key = ?', (now, now, key))
+
+    def size(self) -> int:
+        """ Return the total size of the cached responses. """
+        with self.__lock:
+            return self.__connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def __evict(self) -> None:
+        """ Remove the least recently used responses until the cache fits its maximum size. """
+        total_size = self.__connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total_size <= self.__max_size:
+            return
+        evicted = 0
+        for key, size in self.__connection.execute('SELECT key, size FROM responses ORDER BY used_at').fetchall():
+            if total_size <= self.__max_size:
+                break
+            self.__connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+            total_size -= size
+            evicted += 1
+        logging.info('Evicted %d responses from the response cache', evicted)
@@ -0,0 +1,68 @@
+"""
+Copyright 2012-2017 Ministerie van Sociale Zaken en Werkgelegenheid
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+
+class _Flight(object):  # pylint: disable=too-few-public-methods
+    """ A call in progress whose outcome is shared with the callers that wait for it. """
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.exception: BaseException = None
+
+
+class SingleFlight(object):
+    """ Make sure that concurrent calls for the same key are executed only once. Callers that arrive while a call for
+        their key is in flight wait for that call to finish and share its result, or its exception. """
+
+    def __init__(self) -> None:
+        self.__flights: Dict[Hashable, _Flight] = dict()
+        self.__nr_flights = 0
+        self.__nr_coalesced = 0
+        self.__lock = threading.Lock()
+
+    def call(self, key: Hashable, function: Callable[[], Any]) -> Any:
+        """ Return the result of the function, unless a call for the key is in flight, then wait for its result. """
+        with self.__lock:
+            flight = self.__flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = self.__flights[key] = _Flight()
+                self.__nr_flights += 1
+            else:
+                self.__nr_coalesced += 1
+        if not is_leader:
+            flight.done.wait()
+            if flight.exception is not None:
+                raise flight.exception
+            return flight.result
+        try:
+            flight.result = function()
+        except BaseException as reason:
+            flight.exception = reason
+            raise
+        finally:
+            with self.__lock:
+                del self.__flights[key]
+            flight.done.set()
+        return flight.result
+
+    def statistics(self) -> Dict[str, int]:
+        """ Return the number of calls executed and the number of calls that waited for a call in flight. """
+        with self.__lock:
+            return dict(flights=self.__nr_flights, coalesced=self.__nr_coalesced)
@@ -15,10 +15,12 @@ limitations under the License.
 """
 
 
+import concurrent.futures
 import datetime
 import functools
 import logging
-from typing import List, Dict, Optional, Union
+import threading
+from typing import Any, Iterable, Iterator, List, Dict, Optional, Set, Tuple, Union
 from distutils.version import LooseVersion
 
 from . import url_opener
@@ -30,49 +32,98 @@ class Sonar(domain.MetricSource, url_opener.UrlOpener):
     """ Class representing the Sonar instance. """
 
     metric_source_name = 'SonarQube'
+    metric_keys = ('ncloc', 'lines', 'major_violations', 'critical_violations', 'blocker_violations',
+                   'duplicated_lines', 'line_coverage', 'branch_coverage', 'tests', 'test_failures', 'test_errors',
+                   'it_line_coverage', 'it_branch_coverage', 'overall_line_coverage', 'overall_branch_coverage',
+                   'functions')
+    complex_methods_rules = ('checkstyle:com.puppycrawl.tools.checkstyle.checks.metrics.CyclomaticComplexityCheck',
+                             'pmd:CyclomaticComplexity',
+                             'squid:MethodCyclomaticComplexity',
+                             'csharpsquid:S1541',
+                             'csharpsquid:FunctionComplexity',
+                             'javascript:FunctionComplexity',
+                             'Web:ComplexityCheck',
+                             'python:FunctionComplexity',
+                             'vb:S1541',
+                             'tslint:cyclomatic-complexity')
+    # NB: There is no long methods rule for C#. How to deal with this? FIXME
+    long_methods_rules = ('squid:S138',
+                          'checkstyle:com.puppycrawl.tools.checkstyle.checks.metrics.JavaNCSSCheck',
+                          'Pylint:R0915',
+                          'Web:LongJavaScriptCheck',
+                          'vb:S138')
+    many_parameters_methods_rules = ('checkstyle:com.puppycrawl.tools.checkstyle.checks.metrics.ParameterNumberCheck',
+                                     'pmd:ExcessiveParameterList',
+                                     'csharpsquid:S107',
+                                     'squid:S00107',
+                                     'javascript:ExcessiveParameterList',
+                                     'python:S107')
+    commented_loc_rules = ('csharpsquid:CommentedCode', 'csharpsquid:S125', 'squid:CommentedOutCodeLine',
+                           'javascript:CommentedCode', 'python:S125', 'Web:AvoidCommentedOutCodeCheck')
+    no_sonar_rule = 'squid:NoSonar'
+    # The Sonar versions that introduced the APIs that replace deprecated APIs:
+    api_versions = dict(measures_api='5.4', measures_search_api='6.2', analyses_api='6.3', components_show_api='6.4',
+                        quality_profiles_api='5.2', metrics_search_api='5.2')
+    max_url_length = 2000  # Maximum length of urls that retrieve the measures of multiple projects at once
+    max_workers = 8  # Maximum number of analysis dates retrieved concurrently
+    server_version_ttl = 24 * 60 * 60  # Number of seconds the version of the Sonar server is kept in the cache
+    max_issues = 10000  # Sonar doesn't return issues beyond the first 10,000 results of a search
+    metrics_page_size = 500  # Maximum number of metrics Sonar returns per page
+    rule_keys = complex_methods_rules + long_methods_rules + many_parameters_methods_rules + commented_loc_rules + \
+        (no_sonar_rule,)
 
     def __init__(self, sonar_url: str, *args, **kwargs) -> None:
         super().__init__(url=sonar_url, *args, **kwargs)
         self.__base_dashboard_url = sonar_url + 'dashboard/index/'
         self.__base_violations_url = sonar_url + 'issues/search#resolved=false|componentRoots='
-        self.__issues_api_url = sonar_url + 'api/issues/search?componentRoots={component}&resolved=false&rules={rule}'
+        self.__issues_search_api_url = sonar_url + 'api/issues/search?componentRoots={component}'
+        # Only the paging information and facets are needed for counting issues, so ask for a page with one issue:
+        self.__issues_api_url = self.__issues_search_api_url + '&resolved=false&rules={rule}&ps=1'
+        self.__issues_by_rule_api_url = self.__issues_search_api_url + '&resolved=false&rules={rule}&facets=rules&ps=1'
         self.__analyses_api_url = sonar_url + 'api/project_analyses/search?project={project}&format=json'
         self.__components_show_api_url = sonar_url + 'api/components/show?component={component}'
         self.__resource_api_url = sonar_url + 'api/resources?resource={resource}&format=json'
         self.__projects_api_url = sonar_url + 'api/projects/index?subprojects=true'
         self.__measures_api_url = sonar_url + 'api/measures/component?componentKey={component}&metricKeys={metric}'
+        self.__measures_search_api_url = sonar_url + 'api/measures/search?projectKeys={projects}&metricKeys={metric}'
+        self.__metrics_search_api_url = sonar_url + 'api/metrics/search?ps={page_size}&p={page}'
         self.__false_positives_api_url = sonar_url + \
-            'api/issues/search?resolutions=FALSE-POSITIVE&componentRoots={resource}'
+            'api/issues/search?resolutions=FALSE-POSITIVE&componentRoots={resource}&ps=1'
         self.__false_positives_url = sonar_url + 'issues/search#resolutions=FALSE-POSITIVE|componentRoots={resource}'
         self.__version_number_url = sonar_url + 'api/server/version'
         self.__plugin_api_url = sonar_url + 'api/updatecenter/installed_plugins'  # Deprecated API
         self.__quality_profiles_api_url = sonar_url + 'api/qualityprofiles/search?language={language}&format=json'
         self.__old_quality_profiles_api_url = sonar_url + 'api/profiles/list?language={language}&format=json'
+        self.__bulk_measures: Dict[str, Dict[str, float]] = dict()
+        self.__snapshot_lock = threading.Lock()
 
     def version(self, product: str) -> str:
         """ Return the version of the product. """
-        url = self.__analyses_api_url.format(project=product)+'&category=VERSION'
-        try:
-            json = self.__get_json(url)
-            try:
-                return json['analyses'][0]['events'][0]['name']
-            except (KeyError, IndexError, TypeError) as reason:
-                logging.warning("Couldn't get version number of %s from JSON %s (retrieved from %s): %s",
-                                product, json, url, reason)
-                return '?'
-        except self.url_open_exceptions:
-            # Try older API:
-            url = self.__resource_api_url.format(resource=product)
+        if self.__supports('analyses_api') is not False:
+            url = self.__analyses_api_url.format(project=product)+'&category=VERSION'
             try:
                 json = self.__get_json(url)
+                try:
+                    return json['analyses'][0]['events'][0]['name']
+                except (KeyError, IndexError, TypeError) as reason:
+                    logging.warning("Couldn't get version number of %s from JSON %s (retrieved from %s): %s",
+                                    product, json, url, reason)
+                    return '?'
             except self.url_open_exceptions:
-                return '?'
-            try:
-                return json[0]['version']
-            except (KeyError, IndexError, TypeError) as reason:
-                logging.warning("Couldn't get version number of %s from JSON %s (retrieved from %s): %s",
-                                product, json, url, reason)
-                return '?'
+                if self.__supports('analyses_api'):
+                    return '?'  # No use trying the older API, the server doesn't have it anymore
+        # Try older API:
+        url = self.__resource_api_url.format(resource=product)
+        try:
+            json = self.__get_json(url)
+        except self.url_open_exceptions:
+            return '?'
+        try:
+            return json[0]['version']
+        except (KeyError, IndexError, TypeError) as reason:
+            logging.warning("Couldn't get version number of %s from JSON %s (retrieved from %s): %s",
+                            product, json, url, reason)
+            return '?'
 
     def plugin_version(self, plugin: str) -> str:
         try:
@@ -88,10 +139,15 @@ class Sonar(domain.MetricSource, url_opener.UrlOpener):
 
     def default_quality_profile(self, language: str) -> str:
         """ Return the default quality profile for the language. """
-        url = self.__quality_profiles_api_url.format(language=language)
-        try:
-            profiles = self.__get_json(url)['profiles']
-        except self.url_open_exceptions + (KeyError, TypeError):
+        profiles = None
+        if self.__supports('quality_profiles_api') is not False:
+            url = self.__quality_profiles_api_url.format(language=language)
+            try:
+                profiles = self.__get_json(url)['profiles']
+            except self.url_open_exceptions + (KeyError, TypeError):
+                if self.__supports('quality_profiles_api'):
+                    return ''  # No use trying the old API, the server doesn't have it anymore
+        if profiles is None:
             # Try old API
             url = self.__old_quality_profiles_api_url.format(language=language)
             try:
@@ -109,6 +165,47 @@ class Sonar(domain.MetricSource, url_opener.UrlOpener):
         """ Return the quality profiles url. """
         return self.url() + 'profiles/'
 
+    def prefetch_urls(self, *products: str) -> List[str]:
+        """ Return the urls needed to measure the products, so they can be fetched in advance. """
+        urls = [self.__projects_api_url]
+        for product in products:
+            if self.response_cache() and self.__supports('components_show_api'):
+                urls.append(self.__components_show_api_url.format(component=product))
+            # Stored data of the product is reused if Sonar didn't analyse the product since, so only prefetch
+            # data that isn't stored for the last analysis
+            if self.__supports('measures_api') is not False and product not in self.__bulk_measures and \
+                    self.__stored(product, 'measures') is None:
+                urls.append(self.__measures_api_url.format(component=product, metric=','.join(self.__metric_keys())))
+            if self.__stored(product, 'violations_by_rule') is None:
+                urls.append(self.__issues_by_rule_api_url.format(component=product, rule=','.join(self.rule_keys)))
+        return urls
+
+    def prefetch(self, url: str) -> None:
+        """ Read the url so that its contents are cached by the time a metric needs them. """
+        url_opener.UrlOpener.prefetch(self, url)
+
+    def bulk_prefetch(self, *products: str) -> None:
+        """ Retrieve the analysis dates of the products, needed to decide whether stored data can be reused, and
+            the measures of all products that are Sonar projects with as few requests as possible. """
+        if products and self.response_cache() and self.__supports('components_show_api'):
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.max_workers, len(products))) as executor:
+                list(executor.map(self.__analysis_date, products))
+        if self.__supports('measures_search_api') is False:
+            return
+        # Only pass root projects, because module keys can make Sonar reject the whole request:
+        root_projects = self.__projects(qualifier='TRK')
+        projects = [product for product in products if product in root_projects]
+        metric_keys = ','.join(self.__metric_keys())
+        url_length = len(self.__measures_search_api_url.format(projects='', metric=metric_keys))
+        chunk: List[str] = []
+        for project in projects:
+            if chunk and url_length + len(','.join(chunk + [project])) > self.max_url_length:
+                self.__bulk_measures.update(self.__search_measures(chunk))
+                chunk = []
+            chunk.append(project)
+        if chunk:
+            self.__bulk_measures.update(self.__search_measures(chunk))
+
     # Sonar projects
 
     def __has_project(self, project: str) -> bool:
@@ -118,11 +215,11 @@ class Sonar(domain.MetricSource, url_opener.UrlOpener):
             logging.warning("Sonar has no analysis of %s", project)
         return found
 
-    def __projects(self) -> List[str]:
-        """ Return all projects in Sonar. """
+    def __projects(self, qualifier: str='') -> List[str]:
+        """ Return all projects in Sonar, including modules, or only the projects with the qualifier. """
         try:
             json = self.__get_json(self.__projects_api_url)
-            return [project['k'] for project in json]
+            return [project['k'] for project in json if not qualifier or project.get('qu') == qualifier]
         except self.url_open_exceptions:
             return []
 
@@ -198,63 +295,23 @@ class Sonar(domain.MetricSource, url_opener.UrlOpener):
 
     def complex_methods(self, product: str) -> int:
         """ Return the number of methods that violate the Cyclomatic complexity threshold. """
-        rule_names = ('checkstyle:com.puppycrawl.tools.checkstyle.checks.metrics.CyclomaticComplexityCheck',
-                      'pmd:CyclomaticComplexity',
-                      'squid:MethodCyclomaticComplexity',
-                      'csharpsquid:S1541',
-                      'csharpsquid:FunctionComplexity',
-                      'javascript:FunctionComplexity',
-                      'Web:ComplexityCheck',
-                      'python:FunctionComplexity',
-                      'vb:S1541',
-                      'tslint:cyclomatic-complexity')
-        for rule_name in rule_names:
-            nr_complex_methods = self.__rule_violation(product, rule_name)
-            if nr_complex_methods:
-                return nr_complex_methods
-        return 0
+        return self.__first_rule_violation(product, self.complex_methods_rules)
 
     def long_methods(self, product: str) -> int:
         """ Return the number of methods in the product that have to many non-comment statements. """
-        # NB: There is no long methods rule for C#. How to deal with this? FIXME
-        rule_names = ('squid:S138',
-                      'checkstyle:com.puppycrawl.tools.checkstyle.checks.metrics.JavaNCSSCheck',
-                      'Pylint:R0915',
-                      'Web:LongJavaScriptCheck',
-                      'vb:S138')
-        for rule_name in rule_names:
-            nr_long_methods = self.__rule_violation(product, rule_name)
-            if nr_long_methods:
-                return nr_long_methods
-        return 0
+        return self.__first_rule_violation(product, self.long_methods_rules)
 
     def many_parameters_methods(self, product: str) -> int:
         """ Return the number of methods in the product that have too many parameters. """
-        rule_names = ('checkstyle:com.puppycrawl.tools.checkstyle.checks.metrics.ParameterNumberCheck',
-                      'pmd:ExcessiveParameterList',
-                      'csharpsquid:S107',
-                      'squid:S00107',
-                      'javascript:ExcessiveParameterList',
-                      'python:S107')
-        for rule_name in rule_names:
-            nr_many_parameters = self.__rule_violation(product, rule_name)
-            if nr_many_parameters:
-                return nr_many_parameters
-        return 0
+        return self.__first_rule_violation(product, self.many_parameters_methods_rules)
 
     def commented_loc(self, product: str) -> int:
         """ Return the number of commented out lines in the source code of the product. """
-        rule_names = ('csharpsquid:CommentedCode', 'csharpsquid:S125', 'squid:CommentedOutCodeLine',
-                      'javascript:CommentedCode', 'python:S125', 'Web:AvoidCommentedOutCodeCheck')
-        for rule_name in rule_names:
-            nr_commented_loc = self.__rule_violation(product, rule_name)
-            if nr_commented_loc:
-                return nr_commented_loc
-        return 0
+        return self.__first_rule_violation(product, self.commented_loc_rules)
 
     def no_sonar(self, product: str) -> int:
         """ Return the number of NOSONAR usages in the source code of the product. """
-        return self.__rule_violation(product, 'squid:NoSonar')
+        return self.__rule_violation(product, self.no_sonar_rule)
 
     def violations_url(self, product: str) -> str:
         """ Return the url for the violations of the product. """
@@ -266,6 +323,30 @@ class Sonar(domain.MetricSource, url_opener.UrlOpener):
         """ Return the number of false positives listed for the product. """
         return self.__false_positives(product)
 
+    def issues(self, product: str, page_size: int=500, **criteria: str) -> Iterator[Dict]:
+        """ Yield the issues of the product that meet the criteria, for example resolutions='FALSE-POSITIVE', one
+            page at a time. Only for when the issues themselves are needed; counting uses the paging information. """
+        url = self.__issues_search_api_url.format(component=product) + \
+            ''.join('&{0}={1}'.format(name, value) for name, value in sorted(criteria.items()))
+        page = 1
+        while True:
+            page_url = url + '&ps={0}&p={1}'.format(page_size, page)
+            try:
+                data = self.url_open(page_url).read()
+            except self.url_open_exceptions:
+                return
+            json = utils.eval_json(data.decode('utf-8') if isinstance(data, bytes) else data)
+            try:
+                issues, total = json['issues'], self.__total(json)
+            except (TypeError, KeyError, ValueError) as reason:
+                logging.warning("Can't get issues of %s from %s (retrieved from %s): %s", product, json, page_url,
+                                reason)
+                return
+            yield from issues
+            if not issues or page * page_size >= min(total, self.max_issues):
+                return
+            page += 1
+
     def false_positives_url(self, product: str) -> str:
         """ Return the url to the list of false positives. """
         return self.__false_positives_url.format(resource=product)
@@ -274,15 +355,11 @@ class Sonar(domain.MetricSource, url_opener.UrlOpener):
 
     def version_number(self) -> Optional[str]:
         """ Return the version number of Sonar. """
-        try:
-            return self.url_read(self.__version_number_url)
-        except self.url_open_exceptions:
-            return None
+        return self.__server_version()
 
     def datetime(self, *products: str) -> DateTime:
         """ Return the date and time of the last analysis of the product. """
-        sonar_version = self.version_number()
-        if sonar_version and LooseVersion(sonar_version) >= LooseVersion('6.4'):
+        if self.__supports('components_show_api'):
             # Use the components API, it should contain the analysis date both for projects and components
             url = self.__components_show_api_url.format(component=products[0])
             try:
@@ -297,11 +374,16 @@ class Sonar(domain.MetricSource, url_opener.UrlOpener):
             except self.url_open_exceptions:
                 pass
             return datetime.datetime.min
-        # Use analyses API:
-        url = self.__analyses_api_url.format(project=products[0])
-        try:
-            json = self.__get_json(url)['analyses']
-        except self.url_open_exceptions:
+        json = None
+        if self.__supports('analyses_api') is not False:
+            # Use analyses API:
+            url = self.__analyses_api_url.format(project=products[0])
+            try:
+                json = self.__get_json(url)['analyses']
+            except self.url_open_exceptions:
+                if self.__supports('analyses_api'):
+                    return datetime.datetime.min  # No use trying the older API, the server doesn't have it anymore
+        if json is None:
             # Try older API:
             url = self.__resource_api_url.format(resource=products[0])
             try:
@@ -324,21 +406,31 @@ class Sonar(domain.MetricSource, url_opener.UrlOpener):
         """ Return a specific metric value for the product. """
         if not self.__has_project(product):
             return -1
-        url = self.__measures_api_url.format(component=product, metric=metric_name)
-        try:
-            json = self.__get_json(url)
+        if self.__supports('measures_api') is not False:
+            measures = self.__measures(product)
+            if measures is not None:
+                if metric_name in measures:
+                    return measures[metric_name]
+                logging.warning("Can't get %s value for %s: metric not found in component measures", metric_name,
+                                product)
+                return -1
+            # Sonar didn't return the measures of all metrics at once, try to get this metric separately
+            url = self.__measures_api_url.format(component=product, metric=metric_name)
             try:
-                for measure in json['component']['measures']:
-                    if measure['metric'] == metric_name:
-                        return float(measure['value'])
-                reason = 'metric not found in component measures'
-            except (TypeError, KeyError, IndexError, ValueError) as reason:
-                pass  # Next lines will log exception and return from this method
-            logging.warning("Can't get %s value for %s from %s (retrieved from %s): %s", metric_name, product,
-                            json, url, reason)
-            return -1
-        except self.url_open_exceptions:
-            pass  # Keep going, and try the old API
+                json = self.__get_json(url)
+                try:
+                    for measure in json['component']['measures']:
+                        if measure['metric'] == metric_name:
+                            return float(measure['value'])
+                    reason = 'metric not found in component measures'
+                except (TypeError, KeyError, IndexError, ValueError) as reason:
+                    pass  # Next lines will log exception and return from this method
+                logging.warning("Can't get %s value for %s from %s (retrieved from %s): %s", metric_name, product,
+                                json, url, reason)
+                return -1
+            except self.url_open_exceptions:
+                if self.__supports('measures_api'):
+                    return -1  # No use trying the old API, the server doesn't have it anymore
         url = self.__resource_api_url.format(resource=product) + '&metrics=' + metric_name
         try:
             json = self.__get_json(url)
@@ -351,25 +443,224 @@ class Sonar(domain.MetricSource, url_opener.UrlOpener):
         except self.url_open_exceptions:
             return -1
 
+    @functools.lru_cache(maxsize=16)
+    def __metric_keys(self) -> Tuple[str, ...]:
+        """ Return the keys of the metrics to retrieve that the Sonar server knows. Sonar rejects a request for the
+            measures of multiple metrics if one of the metrics doesn't exist, for example the integration test and
+            overall coverage metrics that newer Sonar versions dropped. """
+        if self.__supports('metrics_search_api') is False:
+            return self.metric_keys
+        known_keys: Set[str] = set()
+        page = 1
+        while True:
+            url = self.__metrics_search_api_url.format(page_size=self.metrics_page_size, page=page)
+            try:
+                json = self.__get_json(url)
+            except self.url_open_exceptions:
+                return self.metric_keys
+            try:
+                known_keys.update(metric['key'] for metric in json['metrics'])
+                total = int(json['total'])
+            except (TypeError, KeyError, ValueError) as reason:
+                logging.warning("Can't get the metrics from %s (retrieved from %s): %s", json, url, reason)
+                return self.metric_keys
+            if page * self.metrics_page_size >= total:
+                break
+            page += 1
+        unknown_keys = [key for key in self.metric_keys if key not in known_keys]
+        if unknown_keys:
+            logging.info("Not retrieving the metrics %s because Sonar doesn't have them", ', '.join(unknown_keys))
+        return tuple(key for key in self.metric_keys if key in known_keys)
+
+    @functools.lru_cache(maxsize=4096)
+    def __measures(self, product: str) -> Optional[Dict[str, float]]:
+        """ Return the values of all metrics of the product, retrieved with one request, or None if Sonar can't
+            return the measures of multiple metrics at once. """
+        if product in self.__bulk_measures:
+            return self.__bulk_measures[product]
+        stored_measures = self.__stored(product, 'measures')
+        if stored_measures is not None:
+            return stored_measures
+        url = self.__measures_api_url.format(component=product, metric=','.join(self.__metric_keys()))
+        try:
+            json = self.__get_json(url)
+        except self.url_open_exceptions:
+            return None
+        measures = dict()
+        try:
+            for measure in json['component']['measures']:
+                try:
+                    measures[measure['metric']] = float(measure['value'])
+                except (TypeError, KeyError, ValueError) as reason:
+                    logging.warning("Can't get %s value for %s from %s (retrieved from %s): %s",
+                                    measure.get('metric'), product, measure, url, reason)
+        except (TypeError, KeyError) as reason:
+            logging.warning("Can't get measures for %s from %s (retrieved from %s): %s", product, json, url, reason)
+            return measures  # Don't store the measures, so they are retrieved again next time
+        self.__store(product, 'measures', measures)
+        return measures
+
+    def __search_measures(self, projects: List[str]) -> Dict[str, Dict[str, float]]:
+        """ Return the values of all metrics of the projects, retrieved with one request. Projects that Sonar returns
+            no measures for are left out, so their measures will be retrieved separately. """
+        url = self.__measures_search_api_url.format(projects=','.join(projects), metric=','.join(self.__metric_keys()))
+        try:
+            json = self.__get_json(url)
+        except self.url_open_exceptions:
+            return dict()
+        measures: Dict[str, Dict[str, float]] = dict()
+        try:
+            for measure in json['measures']:
+                try:
+                    measures.setdefault(measure['component'], dict())[measure['metric']] = float(measure['value'])
+                except (TypeError, KeyError, ValueError) as reason:
+                    logging.warning("Can't get measure from %s (retrieved from %s): %s", measure, url, reason)
+        except (TypeError, KeyError) as reason:
+            logging.warning("Can't get measures for %s from %s (retrieved from %s): %s", projects, json, url, reason)
+        return measures
+
+    def __first_rule_violation(self, product: str, rule_names: Iterable[str]) -> int:
+        """ Return the number of violations of the first rule, in order of the rule names, that has violations. The
+            rule names are ordered so that the rules of the most likely language are tried first. """
+        for rule_name in rule_names:
+            nr_violations = self.__rule_violation(product, rule_name)
+            if nr_violations:
+                return nr_violations
+        return 0
+
     def __rule_violation(self, product: str, rule_name: str, default=0) -> int:
         """ Return a specific violation value for the product. """
         if not self.__has_project(product):
             return -1
+        violations_by_rule = self.__violations_by_rule(product)
+        if violations_by_rule is not None:
+            return violations_by_rule.get(rule_name, 0)
+        url = self.__issues_api_url.format(component=product, rule=rule_name)
         try:
-            json = self.__get_json(self.__issues_api_url.format(component=product, rule=rule_name))
+            json = self.__get_json(url)
         except self.url_open_exceptions:
             return default
-        return int(json['paging']['total'])
+        try:
+            return self.__total(json)
+        except (TypeError, KeyError, ValueError) as reason:
+            logging.warning("Can't get the number of violations of %s for %s from %s (retrieved from %s): %s",
+                            rule_name, product, json, url, reason)
+            return default
+
+    @functools.lru_cache(maxsize=4096)
+    def __violations_by_rule(self, product: str) -> Optional[Dict[str, int]]:
+        """ Return the number of violations per rule for the product, retrieved with one request, or None if Sonar
+            can't return the number of violations per rule. """
+        stored_violations = self.__stored(product, 'violations_by_rule')
+        if stored_violations is not None:
+            return stored_violations
+        url = self.__issues_by_rule_api_url.format(component=product, rule=','.join(self.rule_keys))
+        try:
+            json = self.__get_json(url)
+        except self.url_open_exceptions:
+            return None
+        try:
+            facet = [facet for facet in json['facets'] if facet['property'] == 'rules'][0]
+            violations_by_rule = {value['val']: int(value['count']) for value in facet['values']}
+        except (TypeError, KeyError, IndexError, ValueError) as reason:
+            logging.warning("Can't get the number of violations per rule for %s from %s (retrieved from %s): %s",
+                            product, json, url, reason)
+            return None
+        self.__store(product, 'violations_by_rule', violations_by_rule)
+        return violations_by_rule
 
     def __false_positives(self, product: str, default=0) -> int:
         """ Return the number of issues resolved as false positive. """
         if not self.__has_project(product):
             return -1
+        stored_false_positives = self.__stored(product, 'false_positives')
+        if stored_false_positives is not None:
+            return stored_false_positives
+        url = self.__false_positives_api_url.format(resource=product)
         try:
-            json = self.__get_json(self.__false_positives_api_url.format(resource=product))
+            json = self.__get_json(url)
         except self.url_open_exceptions:
             return default
-        return len(json['issues'])
+        try:
+            false_positives = self.__total(json)
+        except (TypeError, KeyError, ValueError) as reason:
+            logging.warning("Can't get the number of false positives for %s from %s (retrieved from %s): %s",
+                            product, json, url, reason)
+            return default
+        self.__store(product, 'false_positives', false_positives)
+        return false_positives
+
+    @staticmethod
+    def __total(json: Dict) -> int:
+        """ Return the total number of issues from the paging information of an issue search response. Sonar
+            versions before 5.2 report the total outside the paging information. """
+        return int(json['paging']['total'] if 'paging' in json else json['total'])
+
+    @functools.lru_cache(maxsize=4096)
+    def __analysis_date(self, product: str) -> Optional[str]:
+        """ Return the date of the last analysis of the product as reported by Sonar, or None if unknown. """
+        if not self.__supports('components_show_api'):
+            return None
+        try:
+            json = self.__get_json(self.__components_show_api_url.format(component=product))
+        except self.url_open_exceptions:
+            return None
+        try:
+            return json['component']['analysisDate']
+        except (TypeError, KeyError):
+            return None
+
+    def __snapshot_key(self, product: str) -> str:
+        """ Return the key of the stored data of the product. The metric and rule keys are part of the key so that
+            data stored by a version of this class that retrieves other metrics is not used. """
+        return self.response_cache().key(' '.join(['sonar snapshot', self.url(), product, *self.metric_keys,
+                                                   *self.rule_keys]), self.username(), self.password())
+
+    def __stored(self, product: str, field: str) -> Any:
+        """ Return the stored value of the field for the product, if there is a response cache and Sonar hasn't
+            analysed the product since the value was stored. """
+        analysis_date = self.__analysis_date(product) if self.response_cache() else None
+        if not analysis_date:
+            return None
+        snapshot = self.response_cache().lookup_json(self.__snapshot_key(product))
+        return snapshot.get(field) if snapshot and snapshot.get('analysis_date') == analysis_date else None
+
+    def __store(self, product: str, field: str, value: Any) -> None:
+        """ Store the value of the field for the product, together with the date of the last analysis, so it can
+            be reused until Sonar analyses the product again. """
+        analysis_date = self.__analysis_date(product) if self.response_cache() else None
+        if not analysis_date:
+            return
+        key = self.__snapshot_key(product)
+        with self.__snapshot_lock:
+            snapshot = self.response_cache().lookup_json(key) or dict()
+            if snapshot.get('analysis_date') != analysis_date:
+                snapshot = dict(analysis_date=analysis_date)
+            snapshot[field] = value
+            self.response_cache().store_json(key, snapshot)
+
+    def __supports(self, api: str) -> Optional[bool]:
+        """ Return whether the Sonar server supports the API, or None if the version of the server is unknown. """
+        version = self.version_number()
+        return LooseVersion(version) >= LooseVersion(self.api_versions[api]) if version else None
+
+    @functools.lru_cache(maxsize=1024)
+    def __server_version(self) -> Optional[str]:
+        """ Return the version of the Sonar server, which determines the APIs the server supports. If there is a
+            response cache, the version is kept in the cache so the server is probed only once per time to live. """
+        cache = self.response_cache()
+        key = cache.key(self.__version_number_url + '#server_version', self.username(), self.password()) \
+            if cache else ''
+        cached_version = cache.lookup(key) if cache else None
+        if cached_version and cache.is_fresh(cached_version, self.server_version_ttl):
+            return cached_version.body.decode('utf-8')
+        try:
+            version = self.url_read(self.__version_number_url)
+        except self.url_open_exceptions:
+            return None
+        if cache and version:
+            cache.store(key, version.encode('utf-8'))
+        return version
 
     @functools.lru_cache(maxsize=4096)
     def __get_json(self, url: str) -> Union[Dict[str, Dict], List[Dict[str, Union[str, List[Dict[str, str]]]]]]:
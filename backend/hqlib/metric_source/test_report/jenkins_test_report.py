@@ -15,12 +15,11 @@ limitations under the License.
 """
 
 
-import ast
 import datetime
-import logging
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 from ..abstract import test_report
+from ..ci_server.jenkins_api import JenkinsApi
 from ..url_opener import UrlOpener
 from ...typing import DateTime
 
@@ -29,6 +28,17 @@ class JenkinsTestReport(test_report.TestReport):
     """ Class representing Jenkins test reports. """
     metric_source_name = 'Jenkins testreport'
     needs_metric_source_id = True
+    test_report_api = 'lastCompletedBuild/testReport/' + JenkinsApi.json_postfix
+    build_api = 'lastCompletedBuild/' + JenkinsApi.json_postfix
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.__api = JenkinsApi(self._url_read)
+
+    def prefetch_urls(self, *report_urls: str) -> List[str]:
+        """ Return the API urls of the reports, so they can be fetched in advance. """
+        return [self.__join_url(report_url, api) for report_url in report_urls
+                for api in (self.test_report_api, self.build_api)]
 
     def _passed_tests(self, report_url: str) -> int:
         """ Return the number of passed tests. """
@@ -51,24 +61,19 @@ class JenkinsTestReport(test_report.TestReport):
 
     def __test_count(self, report_url: str, result_type: str) -> int:
         """ Return the number of tests with the specified result in the test report. """
-        json = self.__read_json(self.__join_url(report_url, 'lastCompletedBuild/testReport/api/python'))
+        json = self.__read_json(self.__join_url(report_url, self.test_report_api))
         return int(json[result_type]) if json else -1
 
     def _report_datetime(self, report_url: str) -> DateTime:
         """ Return the date and time of the specified report. """
-        json = self.__read_json(self.__join_url(report_url, 'lastCompletedBuild/api/python'))
+        json = self.__read_json(self.__join_url(report_url, self.build_api))
         return datetime.datetime.fromtimestamp(float(json["timestamp"])/1000.) if json else datetime.datetime.min
 
     def __read_json(self, api_url: str) -> Optional[Dict[str, int]]:
         """ Return the json from the url, or the default when something goes wrong. """
         try:
-            contents = self._url_read(api_url)
-        except UrlOpener.url_open_exceptions:
-            return None
-        try:
-            return ast.literal_eval(contents)
-        except (SyntaxError, NameError, TypeError) as reason:
-            logging.warning("Couldn't eval %s: %s\nData received: %s", api_url, reason, contents)
+            return self.__api.read(api_url)
+        except UrlOpener.url_open_exceptions + (ValueError,):
             return None
 
     @staticmethod
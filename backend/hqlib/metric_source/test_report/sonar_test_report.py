@@ -14,7 +14,7 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-from typing import Sequence
+from typing import List, Sequence
 
 from ... import metric_source
 from hqlib.typing import DateTime
@@ -27,6 +27,14 @@ class SonarTestReport(metric_source.TestReport):
         self.__sonar = sonar_class(sonar_url, username=kwargs.pop('username', ''), password=kwargs.pop('password', ''))
         super().__init__(url=sonar_url, *args, **kwargs)
 
+    def prefetch_urls(self, *sonar_ids: str) -> List[str]:
+        """ Return the Sonar urls needed for the test data, so they can be fetched in advance. """
+        return self.__sonar.prefetch_urls(*sonar_ids)
+
+    def prefetch(self, url: str) -> None:
+        """ Let Sonar read the url. """
+        self.__sonar.prefetch(url)
+
     def _report_datetime(self, sonar_id: str) -> DateTime:
         return self.__sonar.datetime(sonar_id)
 
@@ -0,0 +1,116 @@
+"""
+Copyright 2012-2017 Ministerie van Sociale Zaken en Werkgelegenheid
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import base64
+import hashlib
+import http.client
+import io
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import time
+import urllib.error
+from typing import Any, Callable, Dict, IO
+
+
+class ReplayMissError(urllib.error.URLError):
+    """ Exception raised when replaying a request that wasn't recorded. """
+
+
+class TrafficRecorder(object):
+    """ Record the responses of metric sources in a folder, or replay them from that folder, so that reports can be
+        generated repeatedly against identical inputs without contacting the metric sources. Each request is stored
+        in its own file, named after a hash of the request, together with the time it took. Failed requests are
+        recorded too and raise the same kind of exception when replayed. When replaying, the recorded latencies can
+        optionally be injected to simulate the real metric sources. """
+
+    recordable_exceptions = (urllib.error.URLError, OSError, http.client.HTTPException, subprocess.CalledProcessError)
+
+    def __init__(self, folder: str, replay: bool=False, inject_latency: bool=False,
+                 clock: Callable[[], float]=time.monotonic, sleep: Callable[[float], None]=time.sleep) -> None:
+        self.__folder = folder
+        self.__replay = replay
+        self.__inject_latency = inject_latency
+        self.__clock = clock
+        self.__sleep = sleep
+
+    def replaying(self) -> bool:
+        """ Return whether requests are replayed instead of recorded. """
+        return self.__replay
+
+    def call(self, request: str, function: Callable[[], Any]) -> Any:
+        """ Record the JSON-serializable result of the function for the request, or replay it. """
+        filename = os.path.join(self.__folder, hashlib.sha256(request.encode('utf-8')).hexdigest() + '.json')
+        if self.__replay:
+            return self.__replay_call(filename)
+        start = self.__clock()
+        try:
+            result = function()
+        except self.recordable_exceptions as reason:
+            self.__write(filename, dict(latency=self.__clock() - start, exception=self.__encode_exception(reason)))
+            raise
+        self.__write(filename, dict(latency=self.__clock() - start, result=result))
+        return result
+
+    def url_open(self, request: str, url_open: Callable[[], IO]) -> IO:
+        """ Record the contents of the opened url, or replay them. """
+        def read() -> str:
+            """ Open and read the url and encode the contents so they can be stored as JSON. """
+            contents = url_open().read()
+            return base64.b64encode(contents if isinstance(contents, bytes) else contents.encode('utf-8')).decode()
+        return io.BytesIO(base64.b64decode(self.call(request, read)))
+
+    def __replay_call(self, filename: str) -> Any:
+        """ Return the recorded result or raise the recorded exception. """
+        try:
+            with open(filename, encoding='utf-8') as recording_file:
+                recording = json.load(recording_file)
+        except FileNotFoundError:
+            raise ReplayMissError('No recording in {0}'.format(filename)) from None
+        if self.__inject_latency:
+            self.__sleep(recording['latency'])
+        if 'exception' in recording:
+            raise self.__decode_exception(recording['exception'])
+        return recording['result']
+
+    def __write(self, filename: str, recording: Dict[str, Any]) -> None:
+        """ Write the recording. Write to a temporary file first so concurrent readers never see partial files. """
+        file_descriptor, temporary_filename = tempfile.mkstemp(dir=self.__folder, suffix='.tmp')
+        with os.fdopen(file_descriptor, 'w', encoding='utf-8') as recording_file:
+            json.dump(recording, recording_file)
+        os.replace(temporary_filename, filename)
+        logging.debug('Recorded %s', filename)
+
+    @staticmethod
+    def __encode_exception(reason: Exception) -> Dict[str, Any]:
+        """ Return a JSON-serializable description of the exception. """
+        if isinstance(reason, urllib.error.HTTPError):
+            return dict(type='HTTPError', url=str(reason.filename), code=reason.code, msg=str(reason.msg))
+        if isinstance(reason, subprocess.CalledProcessError):
+            return dict(type='CalledProcessError', returncode=reason.returncode, cmd=list(reason.cmd),
+                        output=reason.output)
+        return dict(type='URLError', reason=str(reason))
+
+    @staticmethod
+    def __decode_exception(exception: Dict[str, Any]) -> Exception:
+        """ Return an exception like the recorded one. """
+        if exception['type'] == 'HTTPError':
+            return urllib.error.HTTPError(exception['url'], exception['code'], exception['msg'], {}, None)
+        if exception['type'] == 'CalledProcessError':
+            return subprocess.CalledProcessError(exception['returncode'], exception['cmd'], exception['output'])
+        return urllib.error.URLError(exception['reason'])
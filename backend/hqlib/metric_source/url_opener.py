@@ -17,46 +17,101 @@ limitations under the License.
 import base64
 import functools
 import http.client
+import io
 import logging
-import signal
 import socket
+import time
 import urllib.error
 import urllib.request
-import sys
-from typing import cast, Callable, IO
-import types
+from typing import cast, Callable, Dict, IO, Optional, Union
 
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .connection_pool import ConnectionPool, ClosingHTTPBasicAuthHandler
+from .response_cache import ResponseCache
+from .single_flight import SingleFlight
+from .traffic_recorder import TrafficRecorder
 
-class Timeout(object):
-    """ Time out class using the alarm signal. """
-    def __init__(self, duration_in_seconds: int, signal: types.ModuleType=signal) -> None:
-        self.__duration = duration_in_seconds
-        self.__signal_module = signal
-
-    def __enter__(self) -> None:
-        if not sys.platform.startswith("win"):
-            self.__signal_module.signal(self.__signal_module.SIGALRM, self.__raise_timeout)
-            self.__signal_module.alarm(self.__duration)
 
-    def __exit__(self, *args) -> None:
-        if not sys.platform.startswith("win"):
-            self.__signal_module.alarm(0)  # Disable the alarm
-
-    def __raise_timeout(self, *args) -> None:
-        """ Raise the TimeoutError exception. """
-        raise TimeoutError("Operation timed out after {0} seconds.".format(self.__duration))
+class Timeout(object):
+    """ Time out for url requests that, unlike a time out based on the alarm signal, works in any thread. The socket
+        time out limits connecting and each read from the socket, the deadline limits the request as a whole. """
+    def __init__(self, socket_timeout: float=15, deadline: float=60, clock: Callable[[], float]=time.monotonic) -> None:
+        self.__socket_timeout = socket_timeout
+        self.__deadline = deadline
+        self.__clock = clock
+
+    def open(self, opener: Callable[..., IO], url: Union[str, urllib.request.Request]) -> IO:
+        """ Open the url using the opener. Reading the response raises a TimeoutError when the deadline passes. """
+        expiration = self.__clock() + self.__deadline
+        response = opener(url, timeout=self.__socket_timeout)
+        if self.__clock() > expiration:
+            raise TimeoutError("Opening {0} took more than {1} seconds.".format(getattr(url, 'full_url', url),
+                                                                                 self.__deadline))
+        return DeadlineResponse(response, expiration, self.__clock) if hasattr(response, 'read') else response
+
+
+class DeadlineResponse(object):
+    """ Response wrapper that reads the response in chunks and checks the deadline before reading each chunk. """
+    chunk_size = 64 * 1024
+
+    def __init__(self, response: IO, expiration: float, clock: Callable[[], float]) -> None:
+        self.__response = response
+        self.__expiration = expiration
+        self.__clock = clock
+
+    def read(self, size: int=-1):
+        """ Read at most size bytes, or everything if size is negative. """
+        chunks = []
+        while True:
+            if self.__clock() > self.__expiration:
+                raise TimeoutError("Reading the response took too long.")
+            chunk = self.__response.read(self.chunk_size if size < 0 else min(size, self.chunk_size))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            if size >= 0:
+                size -= len(chunk)
+                if size <= 0:
+                    break
+        return chunk[:0].join(chunks)
+
+    def __getattr__(self, attribute: str):
+        return getattr(self.__response, attribute)
 
 
 class UrlOpener(object):
-    """ Class for opening urls with or without authentication. """
+    """ Class for opening urls with or without authentication. Unless another url open function is passed, urls
+        are opened using persistent connections from the connection pool. If there is a response cache, responses
+        are stored on disk and revalidated with conditional requests when the cache time to live has passed. If there
+        is a circuit breaker, urls on hosts that failed to respond repeatedly are not opened during the cool down.
+        Concurrent reads of the same url by the same opener share one request. If there is a traffic recorder, the
+        responses are recorded or replayed. """
 
     url_open_exceptions = (urllib.error.HTTPError, urllib.error.URLError, socket.error, socket.gaierror,
                            http.client.BadStatusLine, TimeoutError)
 
+    # Number of seconds cached responses without validators are fresh. None means the default of the response cache.
+    # Metric sources whose responses change seldom override this:
+    cache_ttl: Optional[float] = None
+    default_connection_pool = ConnectionPool()
+    default_response_cache: ResponseCache = None
+    default_circuit_breaker: CircuitBreaker = None
+    default_recorder: TrafficRecorder = None
+    single_flight = SingleFlight()
+
     def __init__(self, uri: str=None, username: str=None, password: str=None,
-                 build_opener=urllib.request.build_opener, url_open=urllib.request.urlopen) -> None:
+                 build_opener=urllib.request.build_opener, url_open=None, timeout: Timeout=None,
+                 connection_pool: ConnectionPool=None, response_cache: ResponseCache=None,
+                 cache_ttl: float=None, circuit_breaker: CircuitBreaker=None,
+                 recorder: TrafficRecorder=None) -> None:
         self.__username = username
         self.__password = password
+        self.__timeout = timeout or Timeout()
+        self.__connection_pool = connection_pool or self.default_connection_pool
+        self.__response_cache = response_cache or self.default_response_cache
+        self.__cache_ttl = self.cache_ttl if cache_ttl is None else cache_ttl
+        self.__circuit_breaker = circuit_breaker or self.default_circuit_breaker
+        self.__recorder = recorder or self.default_recorder
         self.__opener = self.__create_url_opener(uri, build_opener, url_open)
 
     def username(self) -> str:
@@ -67,21 +122,26 @@ class UrlOpener(object):
         """ Return the password, if any. """
         return self.__password
 
-    def __create_url_opener(self, uri: str, build_opener, url_open) -> Callable[[str], IO]:
+    def response_cache(self) -> Optional[ResponseCache]:
+        """ Return the on-disk response cache, if any. """
+        return self.__response_cache
+
+    def __create_url_opener(self, uri: str, build_opener, url_open) -> Callable[..., IO]:
         """ Return a url opener method. If credentials are supplied, create an opener with authentication handler. """
         if uri and self.__username and self.__password:
             password_manager = urllib.request.HTTPPasswordMgrWithDefaultRealm()
             password_manager.add_password(realm=None, uri=uri, user=self.__username, passwd=self.__password)
-            auth_handler = urllib.request.HTTPBasicAuthHandler(cast(urllib.request.HTTPPasswordMgr, password_manager))
-            return build_opener(auth_handler).open
-        elif self.__username and self.__password:
+            auth_handler = ClosingHTTPBasicAuthHandler(cast(urllib.request.HTTPPasswordMgr, password_manager))
+            return build_opener(auth_handler, *self.__connection_pool.handlers()).open
+        url_open = url_open or build_opener(*self.__connection_pool.handlers()).open
+        if self.__username and self.__password:
             credentials = base64.b64encode(bytes(':'.join([self.__username, self.__password]), 'utf-8')).decode('ascii')
 
-            def url_open_with_basic_auth(url: str):
+            def url_open_with_basic_auth(url: Union[str, urllib.request.Request], **kwargs):
                 """ Open the url with basic authentication. """
-                request = urllib.request.Request(url)
+                request = url if isinstance(url, urllib.request.Request) else urllib.request.Request(url)
                 request.add_header('Authorization', 'Basic ' + credentials)
-                return url_open(request)
+                return url_open(request, **kwargs)
 
             return url_open_with_basic_auth
         else:
@@ -90,14 +150,96 @@ class UrlOpener(object):
     def url_open(self, url: str) -> IO:
         """ Return an opened url, using the opener created earlier. """
         try:
-            with Timeout(15):
-                return self.__opener(url)
+            if self.__recorder:
+                return self.__recorder.url_open(' '.join(['url', url, self.__username or '']),
+                                                lambda: self.__guarded_url_open(url))
+            return self.__guarded_url_open(url)
+        except CircuitOpenError as reason:
+            logging.debug("Couldn't open %s: %s", url, reason)  # The circuit breaker already logged a warning
+            raise
         except self.url_open_exceptions as reason:
             logging.warning("Couldn't open %s: %s", url, reason)
             raise  # Let caller decide whether to ignore the exception
 
+    def __guarded_url_open(self, url: str) -> IO:
+        """ Open the url unless the circuit breaker, if any, considers the host unreachable, and report the outcome.
+            An HTTP error means the host could be reached, any other exception that it couldn't. """
+        if not self.__circuit_breaker:
+            return self.__unguarded_url_open(url)
+        self.__circuit_breaker.check(url)
+        try:
+            response = self.__unguarded_url_open(url)
+        except urllib.error.HTTPError:
+            self.__circuit_breaker.success(url)
+            raise
+        except self.url_open_exceptions:
+            self.__circuit_breaker.failure(url)
+            raise
+        self.__circuit_breaker.success(url)
+        return response
+
+    def __unguarded_url_open(self, url: str) -> IO:
+        """ Open the url, using the response cache if there is one. """
+        if self.__response_cache:
+            return self.__cached_url_open(url)
+        return self.__timeout.open(self.__opener, url)
+
+    def __cached_url_open(self, url: str) -> IO:
+        """ Return the response from the cache if it is fresh, else revalidate or retrieve it and cache it. """
+        key = self.__response_cache.key(url, self.__username, self.__password)
+        cached_response = self.__response_cache.lookup(key)
+        if cached_response and self.__response_cache.is_fresh(cached_response, self.__cache_ttl):
+            return io.BytesIO(cached_response.body)
+        request = urllib.request.Request(url)
+        if cached_response and cached_response.etag:
+            request.add_header('If-None-Match', cached_response.etag)
+        if cached_response and cached_response.last_modified:
+            request.add_header('If-Modified-Since', cached_response.last_modified)
+        try:
+            response = self.__timeout.open(self.__opener, request)
+        except urllib.error.HTTPError as reason:
+            if cached_response and reason.code == 304:
+                self.__response_cache.revalidated(key)
+                return io.BytesIO(cached_response.body)
+            raise
+        body = response.read()
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        headers = response.info() if hasattr(response, 'info') else dict()
+        etag, last_modified = headers.get('ETag'), headers.get('Last-Modified')
+        if etag or last_modified or self.__response_cache.ttl(self.__cache_ttl) > 0:
+            self.__response_cache.store(key, body, etag, last_modified)
+        return io.BytesIO(body)
+
+    def prefetch(self, url: str) -> None:
+        """ Read the url so that its contents are cached by the time a metric needs them. """
+        try:
+            self.url_read(url)
+        except self.url_open_exceptions:
+            pass  # The metric will retry and deal with the exception itself
+
     @functools.lru_cache(maxsize=4096)
     def url_read(self, url: str, encoding: str='utf-8') -> str:
         """ Open and read a url, and transform the bytes to a string. """
-        data = self.url_open(url).read()
+        return self.single_flight.call((self, url, encoding), lambda: self.__url_read(url, encoding))
+
+    def __url_read(self, url: str, encoding: str) -> str:
+        """ Open and read a url, and transform the bytes to a string. The circuit breaker records the outcome of
+            opening the url, so report failures to read the response body, such as time outs, to it as well. """
+        response = self.url_open(url)
+        try:
+            data = response.read()
+        except self.url_open_exceptions as reason:
+            logging.warning("Couldn't read %s: %s", url, reason)
+            if self.__circuit_breaker:
+                self.__circuit_breaker.failure(url)
+            raise
         return data.decode(encoding) if isinstance(data, bytes) else data
+
+    @classmethod
+    def url_read_statistics(cls) -> Dict[str, int]:
+        """ Return the number of url reads served from memory, the number of reads that waited for a read of the
+            same url in flight, and the number of reads that actually opened the url. """
+        statistics = cls.single_flight.statistics()
+        statistics['hits'] = UrlOpener.url_read.cache_info().hits
+        return statistics
@@ -0,0 +1,81 @@
+"""
+Copyright 2012-2017 Ministerie van Sociale Zaken en Werkgelegenheid
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import concurrent.futures
+import logging
+import time
+from typing import Dict, Iterable, List, Tuple
+
+from .. import domain
+
+
+class UrlPrefetcher(object):
+    """ Class for reading the urls that metrics need in parallel, before the metrics are evaluated. The metric
+        sources cache what they read, so the metrics subsequently run against warm data. """
+
+    def __init__(self, max_workers: int=8) -> None:
+        self.__max_workers = max_workers
+
+    def prefetch(self, metrics: Iterable[domain.Metric]) -> int:
+        """ Let the metric sources retrieve the data of all their metric source ids at once and then read the urls
+            the metrics still need, using a bounded pool of threads. Return the number of urls read. """
+        if self.__max_workers < 1:
+            return 0
+        metrics = list(metrics)
+        self.__bulk_prefetch(metrics)
+        requests = list(dict.fromkeys(request for metric in metrics for request in metric.prefetch_requests()))
+        if not requests:
+            return 0
+        logging.info('Prefetching %d urls using %d threads', len(requests), self.__max_workers)
+        start = time.monotonic()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.__max_workers) as executor:
+            for future in concurrent.futures.as_completed([executor.submit(self.__prefetch, request)
+                                                           for request in requests]):
+                future.result()
+        logging.info('Prefetched %d urls in %.1f seconds', len(requests), time.monotonic() - start)
+        return len(requests)
+
+    def __bulk_prefetch(self, metrics: List[domain.Metric]) -> None:
+        """ Let each metric source retrieve the data of the metric source ids of the metrics at once. """
+        metric_source_ids: Dict[domain.MetricSource, List[str]] = dict()
+        for metric in metrics:
+            for metric_source, metric_source_id in metric.bulk_prefetch_requests():
+                ids = metric_source_ids.setdefault(metric_source, [])
+                if metric_source_id not in ids:
+                    ids.append(metric_source_id)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.__max_workers) as executor:
+            for future in concurrent.futures.as_completed([executor.submit(self.__bulk_prefetch_ids, *item)
+                                                           for item in metric_source_ids.items()]):
+                future.result()
+
+    @staticmethod
+    def __bulk_prefetch_ids(metric_source: domain.MetricSource, metric_source_ids: List[str]) -> None:
+        """ Let the metric source retrieve the data of the metric source ids. """
+        try:
+            metric_source.bulk_prefetch(*metric_source_ids)
+        except Exception as reason:  # pylint: disable=broad-except
+            # Prefetching is an optimization, the metric will retrieve the data itself and deal with any problems
+            logging.warning("Couldn't prefetch data for %s from %s: %s", metric_source_ids, metric_source, reason)
+
+    @staticmethod
+    def __prefetch(request: Tuple[domain.MetricSource, str]) -> None:
+        """ Let the metric source read the url. """
+        metric_source, url = request
+        try:
+            metric_source.prefetch(url)
+        except Exception as reason:  # pylint: disable=broad-except
+            # Prefetching is an optimization, the metric will read the url again and deal with any problems
+            logging.warning("Couldn't prefetch %s: %s", url, reason)
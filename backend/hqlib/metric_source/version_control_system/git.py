@@ -16,23 +16,28 @@ limitations under the License.
 
 import datetime
 import functools
+import hashlib
 import logging
 import os
+import posixpath
 import urllib.request
-from typing import Callable, List, Dict, Tuple
+from typing import Callable, List, Dict, Optional, Set, Tuple
 
 from ..abstract.version_control_system import VersionControlSystem
 from hqlib.typing import DateTime
 
 
 class Git(VersionControlSystem):
-    """ Class representing a Git repository. """
+    """ Class representing a Git repository. Git repositories are kept as bare mirrors without file contents in the
+        mirrors folder, one mirror per repository url. Git instances for different branches of the same repository
+        share the mirror, which is fetched once per run. """
 
     metric_source_name = 'Git'
+    mirrors_folder = os.path.join(os.path.expanduser('~'), '.cache', 'quality-report', 'git')
+    __updated_mirrors: Set[str] = set()
 
     def __init__(self, *args, **kwargs) -> None:
         self.__branch_to_checkout: str = kwargs.pop('branch', '')
-        self.__chdir = kwargs.pop('chdir', os.chdir)
         super().__init__(*args, **kwargs)
         self.__repo_folder: str = None
 
@@ -44,19 +49,42 @@ class Git(VersionControlSystem):
 
     @functools.lru_cache(maxsize=1024)
     def _run_shell_command(self, shell_command: Tuple[str, ...], folder: str='', log_level: int=logging.WARNING) -> str:
-        """ Invoke a shell and run the command. If a folder is specified, run the command in that folder. """
+        """ Invoke a shell and run the command in the mirror. Wait until the mirror has been cloned or fetched. If
+            there's no mirror, because cloning failed, don't run the command and return empty output. When replaying
+            recorded traffic there's no mirror either, but the recorded output is returned. """
+        if not self.__repo_folder:
+            self.__get_repo()
+        replaying = self.default_recorder is not None and self.default_recorder.replaying()
+        if not os.path.exists(self.__repo_folder) and not replaying:
+            logging.warning("Can't run %s because the mirror of Git repo %s is missing", ' '.join(shell_command),
+                            self.url())
+            return ''
+        return super()._run_shell_command(shell_command, folder=self.__repo_folder, log_level=log_level)
+
+    def _recording_key(self, shell_command: Tuple[str, ...]) -> str:
+        """ Return the key used to record the output of the shell command. Whether the mirror is cloned or fetched
+            depends on the contents of the mirrors folder, so record both as an update of the mirror, which is shared
+            by all branches. """
+        if shell_command[1:2] in (('clone',), ('config',), ('fetch',)):
+            return super()._recording_key(('git', 'update'))
+        return super()._recording_key(shell_command + (self.__branch_to_checkout,))
+
+    def bulk_prefetch(self, *paths: str) -> None:  # pylint: disable=unused-argument
+        """ Clone or fetch the mirror before the metrics are evaluated. The prefetcher calls this for the different
+            repositories in parallel. """
         if not self.__repo_folder:
             self.__get_repo()
-        folder = self.__repo_folder if os.path.exists(self.__repo_folder) else folder
-        return super()._run_shell_command(shell_command, folder=folder, log_level=log_level)
 
     def last_changed_date(self, path: str) -> DateTime:
-        """ Return the date when the url was last changed in Git. """
-        timestamp = self._run_shell_command(('git', 'log', '--format="%ct"', '-n', '1', '--', path))
-        if timestamp:
-            return datetime.datetime.fromtimestamp(float(timestamp.strip('"\n')))
+        """ Return the date when the path, a file or a folder, was last changed in Git. """
+        timestamp: Optional[float]
+        if any(wildcard in path for wildcard in '*?['):
+            output = self._run_shell_command(('git', 'log', '--format="%ct"', '-n', '1', self.__revision(), '--',
+                                              path))
+            timestamp = float(output.strip('"\n')) if output else None
         else:
-            return datetime.datetime.min
+            timestamp = self.__last_changed_timestamps().get(self.__index_path(path))
+        return datetime.datetime.fromtimestamp(timestamp) if timestamp else datetime.datetime.min
 
     def branch(self) -> str:
         """ Return the checked out branch. """
@@ -73,8 +101,7 @@ class Git(VersionControlSystem):
         unmerged_branches = [branch for branch in self.__get_branches(unmerged_only=True) if not
                              self._ignore_branch(branch, list_of_branches_to_ignore, re_of_branches_to_ignore,
                                                  list_of_branches_to_include)]
-        branches_and_commits = [(branch, self.__nr_unmerged_commits(branch)) for branch in unmerged_branches]
-        return dict(branches_and_commits)
+        return self.__nr_unmerged_commits(unmerged_branches) if unmerged_branches else dict()
 
     @classmethod
     def branch_folder_for_branch(cls, trunk_url: str, branch: str) -> str:
@@ -85,34 +112,160 @@ class Git(VersionControlSystem):
         """ Get the (remote) branches for the repository. """
         command = ['git', 'branch', '--list', '--remote', '--no-color']
         if unmerged_only:
-            command.append('--no-merged')
+            command.extend(['--no-merged', self.__revision()])
         return self.__valid_names(self._run_shell_command(tuple(command)),
-                                  lambda name: bool(name and ' -> ' not in name and 'origin/master' not in name))
-
-    def __nr_unmerged_commits(self, branch_name: str) -> int:
-        """ Return whether the branch has unmerged commits. """
-        logging.info('Checking for unmerged commits in branch %s.', branch_name)
-        command = ('git', 'cherry', 'origin/master', branch_name)
-        commits = self._run_shell_command(command)
-        nr_commits = commits.count('\n')
-        logging.info('Branch %s has %d unmerged commits.', branch_name, nr_commits)
+                                  lambda name: bool(name and ' -> ' not in name and 'origin/master' not in name and
+                                                    name != 'origin/HEAD'))
+
+    def __nr_unmerged_commits(self, branch_names: List[str]) -> Dict[str, int]:
+        """ Return the number of commits of each branch that are not on the master branch. The commits of all
+            branches are retrieved with one walk over the commit graph. If there is a response cache, the numbers are
+            cached by the tips of the branch and of the master branch, so unchanged branches are not walked again. """
+        tips = self.__branch_tips()
+        master_tip = tips.get('origin/master')
+        nr_commits: Dict[str, int] = dict()
+        for branch_name in branch_names:
+            cached_nr_commits = self.__cached_nr_unmerged_commits(master_tip, tips.get(branch_name))
+            if cached_nr_commits is not None:
+                nr_commits[branch_name] = cached_nr_commits
+        branches_to_walk = [branch_name for branch_name in branch_names
+                            if branch_name not in nr_commits and branch_name in tips]
+        if branches_to_walk:
+            logging.info('Checking for unmerged commits in branches %s.', ', '.join(branches_to_walk))
+            parents = self.__unmerged_commits(branches_to_walk)
+            for branch_name in branches_to_walk:
+                nr_commits[branch_name] = self.__nr_reachable_commits(tips[branch_name], parents)
+                self.__cache_nr_unmerged_commits(master_tip, tips[branch_name], nr_commits[branch_name])
+        for branch_name in branch_names:
+            if branch_name not in nr_commits:
+                nr_commits[branch_name] = self.__count_unmerged_commits(branch_name)
+        for branch_name in branch_names:
+            logging.info('Branch %s has %d unmerged commits.', branch_name, nr_commits[branch_name])
         return nr_commits
 
+    def __branch_tips(self) -> Dict[str, str]:
+        """ Return the commit ids of the tips of the remote branches. """
+        output = self._run_shell_command(('git', 'for-each-ref', '--format=%(objectname) %(refname:short)',
+                                          'refs/remotes'))
+        return dict(reversed(line.split(' ', 1)) for line in self.__valid_names(output, lambda line: ' ' in line))
+
+    def __unmerged_commits(self, branch_names: List[str]) -> Dict[str, List[str]]:
+        """ Return the commits of the branches that are not on the master branch, with their parents. """
+        output = self._run_shell_command(('git', 'rev-list', '--parents', '^origin/master') + tuple(branch_names))
+        commits = [line.split() for line in self.__valid_names(output)]
+        return {commit[0]: commit[1:] for commit in commits}
+
+    def __count_unmerged_commits(self, branch_name: str) -> int:
+        """ Return the number of commits of the branch that are not on the master branch. Only used for branches
+            whose tip is unknown, because this needs a command per branch. """
+        output = self._run_shell_command(('git', 'rev-list', '--count', 'origin/master..' + branch_name))
+        return int(output.strip()) if output.strip().isdigit() else 0
+
+    @staticmethod
+    def __nr_reachable_commits(tip: str, parents: Dict[str, List[str]]) -> int:
+        """ Return the number of unmerged commits that can be reached from the tip. """
+        reachable, to_visit = set(), [tip]
+        while to_visit:
+            commit = to_visit.pop()
+            if commit in parents and commit not in reachable:
+                reachable.add(commit)
+                to_visit.extend(parents[commit])
+        return len(reachable)
+
+    def __cached_nr_unmerged_commits(self, master_tip: Optional[str], tip: Optional[str]) -> Optional[int]:
+        """ Return the cached number of unmerged commits of the branch tip, if any. """
+        cache = self.default_response_cache
+        if cache is None or not master_tip or not tip:
+            return None
+        return cache.lookup_json(cache.key(' '.join(['git unmerged commits', master_tip, tip])))
+
+    def __cache_nr_unmerged_commits(self, master_tip: Optional[str], tip: str, nr_commits: int) -> None:
+        """ Cache the number of unmerged commits of the branch tip. """
+        cache = self.default_response_cache
+        if cache is not None and master_tip:
+            cache.store_json(cache.key(' '.join(['git unmerged commits', master_tip, tip])), nr_commits)
+
+    @functools.lru_cache(maxsize=16)
+    def __last_changed_timestamps(self) -> Dict[str, float]:
+        """ Return the timestamp of the last commit of each file and folder in the repository. The index is built
+            from one pass over the log. If there is a response cache, the index is stored with the commit it was built
+            for, and the next time only the commits since that commit are added. """
+        head = self._run_shell_command(('git', 'rev-parse', self.__revision())).strip()
+        cache = self.default_response_cache
+        cache_key = cache.key(' '.join(['git last changed index', self.url(), self.__branch_to_checkout])) \
+            if cache is not None else None
+        index = cache.lookup_json(cache_key) if cache_key else None
+        if index and index['head'] == head:
+            return index['timestamps']
+        if index and head and self.__is_ancestor(index['head'], head):
+            timestamps, revisions = index['timestamps'], index['head'] + '..' + head
+        else:
+            timestamps, revisions = dict(), self.__revision()
+        # Don't detect renames, because that needs the file contents, which the mirror doesn't have:
+        log = self._run_shell_command(('git', '-c', 'core.quotePath=false', 'log', '--no-renames', '--name-only',
+                                       '--format=%x00%ct', revisions))
+        self.__add_to_index(timestamps, log)
+        if cache_key and head:
+            cache.store_json(cache_key, dict(head=head, timestamps=timestamps))
+        return timestamps
+
+    def __is_ancestor(self, commit: str, head: str) -> bool:
+        """ Return whether the commit is an ancestor of the head, i.e. whether the history wasn't rewritten. """
+        return self._run_shell_command(('git', 'merge-base', commit, head), log_level=logging.DEBUG).strip() == commit
+
+    @staticmethod
+    def __add_to_index(timestamps: Dict[str, float], log: str) -> None:
+        """ Add the timestamps of the commits in the log to the index of files and folders. Commit lines start with
+            a NUL character, so they can't be confused with file names. The root folder has the empty path. """
+        timestamp = None
+        for line in log.split('\n'):
+            if line.startswith('\x00'):
+                timestamp = float(line[1:])
+            elif line and timestamp is not None:
+                path = line
+                while timestamps.get(path, 0) < timestamp:
+                    timestamps[path] = timestamp  # Folders are at least as recent as the files in them
+                    if not path:
+                        break
+                    path = path.rpartition('/')[0]
+
+    @staticmethod
+    def __index_path(path: str) -> str:
+        """ Return the path as stored in the index. """
+        path = posixpath.normpath(path).strip('/')
+        return '' if path == '.' else path
+
     def __get_repo(self) -> None:
-        """ Clone the repository if necessary, else pull it. """
-        self.__repo_folder = self.__determine_repo_folder_name()
-        command = ['git']
-        if os.path.exists(self.__repo_folder):
-            logging.info('Updating Git repo %s in %s', self.url(), self.__repo_folder)
-            command.extend(['pull', '--prune'])
+        """ Clone the mirror of the repository if necessary, else fetch it, unless that was done already. The mirror
+            folder is only remembered after the mirror has been updated, and threads that need the mirror meanwhile
+            wait for the lock, so no command runs before the mirror is ready. """
+        repo_folder = self.__determine_repo_folder_name()
+        with self._repository_lock(repo_folder):
+            if repo_folder not in Git.__updated_mirrors:
+                Git.__updated_mirrors.add(repo_folder)
+                self.__update_mirror(repo_folder)
+            self.__repo_folder = repo_folder
+
+    def __update_mirror(self, repo_folder: str) -> None:
+        """ Clone the mirror of the repository if it doesn't exist, else fetch it. """
+        run_shell_command = super()._run_shell_command
+        if os.path.exists(repo_folder):
+            logging.info('Updating Git repo %s in %s', self.url(), repo_folder)
         else:
-            branch_string = self.__branch_to_checkout or 'master'
-            logging.info('Cloning Git repo %s (branch: %s) in %s', self.url(), branch_string, self.__repo_folder)
-            command.extend(['clone', self.__full_url(), self.__repo_folder])
-            if self.__branch_to_checkout:
-                command.insert(2, '--branch')
-                command.insert(3, self.__branch_to_checkout)
-        self._run_shell_command(tuple(command))
+            logging.info('Cloning Git repo %s in %s', self.url(), repo_folder)
+            run_shell_command(('git', 'clone', '--bare', '--filter=blob:none', self.__full_url(), repo_folder))
+            if not os.path.exists(repo_folder):
+                return  # Cloning failed, don't run the commands below in the current folder
+            # Keep the branches as remote branches, and the default branch as origin/HEAD, like a regular clone:
+            run_shell_command(('git', 'config', 'remote.origin.fetch', '+refs/heads/*:refs/remotes/origin/*'),
+                              folder=repo_folder)
+            run_shell_command(('git', 'config', '--add', 'remote.origin.fetch', '+HEAD:refs/remotes/origin/HEAD'),
+                              folder=repo_folder)
+        run_shell_command(('git', 'fetch', '--prune', '--filter=blob:none', 'origin'), folder=repo_folder)
+
+    def __revision(self) -> str:
+        """ Return the remote branch of this Git instance in the mirror. """
+        return 'origin/' + (self.__branch_to_checkout or 'HEAD')
 
     def __full_url(self) -> str:
         """ Return the Git repository url with username and password. """
@@ -125,11 +278,11 @@ class Git(VersionControlSystem):
             return self.url()
 
     def __determine_repo_folder_name(self) -> str:
+        """ Return the folder of the mirror. The folder name is made unique with a hash of the url, because
+            repositories on different servers may have the same name. """
         url_parts = [part for part in self.url().split('/') if part]
-        folder = url_parts[-1]
-        if self.__branch_to_checkout:
-            folder += '-{0!s}'.format(self.__branch_to_checkout)
-        return os.path.join(os.getcwd(), 'repos', folder)
+        url_hash = hashlib.sha256(self.url().encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.mirrors_folder, '{0}-{1}'.format(url_parts[-1], url_hash))
 
     @staticmethod
     def __valid_names(text: str, is_valid: Callable[[str], bool]=bool) -> List[str]:
@@ -15,11 +15,10 @@ limitations under the License.
 """
 
 
+import concurrent.futures
 from datetime import datetime
 import logging
-from typing import List, Dict
-
-import bs4
+from typing import List, Dict, Optional
 
 from ..abstract import version_control_system
 from hqlib.typing import DateTime
@@ -29,6 +28,7 @@ class Subversion(version_control_system.VersionControlSystem):
     """ Class representing the Subversion repository. """
 
     metric_source_name = 'Subversion'
+    max_workers = 8  # Maximum number of branches or paths whose information is retrieved concurrently
 
     @classmethod
     def branch_folder_for_branch(cls, trunk_url: str, branch: str) -> str:
@@ -44,31 +44,60 @@ class Subversion(version_control_system.VersionControlSystem):
             svn_path += 'trunk/'
         return svn_path
 
+    def bulk_prefetch(self, *paths: str) -> None:
+        """ Retrieve the information about the paths and the lists of their branches before the metrics are evaluated,
+            so the metrics find the output of these Subversion commands cached. The commands are run concurrently,
+            because the prefetcher calls this once for all paths in the Subversion repositories. """
+        urls = list(dict.fromkeys(self.normalize_path(path) for path in paths))
+        commands = [('svn', 'info', '--xml', url) for url in urls] + \
+            list(dict.fromkeys(('svn', 'list', '--xml', self.__branches_folder(url)) for url in urls))
+        if commands:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.max_workers, len(commands))) as executor:
+                list(executor.map(self._run_shell_command, commands))
+
     def last_changed_date(self, url: str) -> DateTime:
         """ Return the date when the url was last changed in Subversion. """
-        svn_info_xml = str(self._run_shell_command(('svn', 'info', '--xml', url)))
-        try:
-            date = bs4.BeautifulSoup(svn_info_xml, "lxml")('date')[0].string
-        except IndexError:
-            return datetime.min
-        return datetime.strptime(date, '%Y-%m-%dT%H:%M:%S.%fZ')
+        svn_info_xml = self._run_shell_command(('svn', 'info', '--xml', url))
+        date = next((element.text for element in self._xml_elements(svn_info_xml, 'date')), None)
+        return datetime.strptime(date, '%Y-%m-%dT%H:%M:%S.%fZ') if date else datetime.min
 
     def unmerged_branches(self, product_url: str, list_of_branches_to_ignore: List[str]=None,
                           re_of_branches_to_ignore: str='',
                           list_of_branches_to_include: List[str]=None) -> Dict[str, int]:
         """ Return a dictionary of branch names and number of unmerged revisions for each branch that has any
-            unmerged revisions. """
-        branches = [branch for branch in self.branches(product_url) if not
+            unmerged revisions. The branches are checked concurrently. """
+        branch_revisions = self.__branch_revisions(product_url)
+        branches = [branch for branch in branch_revisions if not
                     self._ignore_branch(branch, list_of_branches_to_ignore, re_of_branches_to_ignore,
                                         list_of_branches_to_include)]
-        branches_and_revs = [(branch, self.__nr_unmerged_revisions(product_url, branch)) for branch in branches]
+        if not branches:
+            return dict()
+        trunk_revision = self.__last_changed_revision(product_url)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.max_workers, len(branches))) as executor:
+            nr_revisions = executor.map(lambda branch: self.__nr_unmerged_revisions(
+                product_url, branch, branch_revisions[branch], trunk_revision), branches)
+            branches_and_revs = list(zip(branches, nr_revisions))
         unmerged_branches = [(branch, nr_revisions) for (branch, nr_revisions) in branches_and_revs if nr_revisions > 0]
         return dict(unmerged_branches)
 
-    def __nr_unmerged_revisions(self, product_url: str, branch_name: str) -> int:
-        """ Return whether the branch has unmerged revisions. """
+    def __nr_unmerged_revisions(self, product_url: str, branch_name: str, branch_revision: Optional[str],
+                                trunk_revision: Optional[str]) -> int:
+        """ Return the number of unmerged revisions of the branch. If there is a response cache, the number is cached
+            by the last changed revisions of the branch and the trunk, because only changes to those affect it. """
         branch_url = self.__branches_folder(product_url) + branch_name
-        trunk_url = product_url
+        cache = self.default_response_cache
+        cache_key = cache.key(' '.join(['svn unmerged revisions', branch_url, branch_revision, product_url,
+                                        trunk_revision])) if cache and branch_revision and trunk_revision else None
+        cached_nr_revisions = cache.lookup_json(cache_key) if cache_key else None
+        if cached_nr_revisions is not None:
+            return cached_nr_revisions
+        nr_revisions = self.__retrieve_nr_unmerged_revisions(branch_url, product_url)
+        if cache_key:
+            cache.store_json(cache_key, nr_revisions)
+        return nr_revisions
+
+    def __retrieve_nr_unmerged_revisions(self, branch_url: str, trunk_url: str) -> int:
+        """ Return the number of unmerged revisions of the branch, as reported by Subversion. """
         revisions = str(self._run_shell_command(('svn', 'mergeinfo', '--show-revs', 'eligible',
                                                  branch_url, trunk_url))).strip()
         logging.debug('Unmerged revisions from %s to %s: "%s"', branch_url, trunk_url, revisions)
@@ -79,15 +108,33 @@ class Subversion(version_control_system.VersionControlSystem):
         if 1 <= nr_revisions <= 3:
             # Create a list of revision numbers and remove the initial 'r'
             revision_numbers = [revision[1:].strip() for revision in revisions.split('\n')]
-            for revision in revision_numbers:
-                if '/tags/' in self.__revision_url(branch_url, revision):
-                    nr_revisions -= 1
+            nr_revisions -= len(self.__tag_revisions(branch_url, revision_numbers))
         return nr_revisions
 
-    def __revision_url(self, branch_url: str, revision_number: str) -> str:
-        """ Return the url for a specific revision number. """
-        svn_info_xml = str(self._run_shell_command(('svn', 'info', branch_url, '--xml', '-r', revision_number)))
-        return bs4.BeautifulSoup(svn_info_xml, "lxml")('url')[0].string
+    def __tag_revisions(self, branch_url: str, revision_numbers: List[str]) -> List[str]:
+        """ Return the revisions that only changed tags, retrieved with one log of the range of the revisions. """
+        revision_range = '{0}:{1}'.format(min(revision_numbers, key=int), max(revision_numbers, key=int))
+        svn_log_xml = self._run_shell_command(('svn', 'log', '--xml', '-v', '-r', revision_range, branch_url))
+        tag_revisions = []
+        for log_entry in self._xml_elements(svn_log_xml, 'logentry'):
+            paths = [path.text or '' for path in log_entry.iter('path')]
+            if log_entry.get('revision') in revision_numbers and paths and all('/tags/' in path for path in paths):
+                tag_revisions.append(log_entry.get('revision'))
+        return tag_revisions
+
+    def __branch_revisions(self, trunk_url: str) -> Dict[str, Optional[str]]:
+        """ Return the names of the branches with the revision in which they were last changed. """
+        svn_list_xml = self._run_shell_command(('svn', 'list', '--xml', self.__branches_folder(trunk_url)))
+        branch_revisions = dict()
+        for entry in self._xml_elements(svn_list_xml, 'entry'):
+            commit = entry.find('commit')
+            branch_revisions[entry.findtext('name')] = None if commit is None else commit.get('revision')
+        return branch_revisions
+
+    def __last_changed_revision(self, url: str) -> Optional[str]:
+        """ Return the revision in which the url was last changed. """
+        svn_info_xml = self._run_shell_command(('svn', 'info', '--xml', url))
+        return next((commit.get('revision') for commit in self._xml_elements(svn_info_xml, 'commit')), None)
 
     def branches(self, trunk_url: str) -> List[str]:
         """ Return a list of branch names for the specified trunk url. """
@@ -100,6 +147,5 @@ class Subversion(version_control_system.VersionControlSystem):
 
     def __svn_list(self, url: str) -> List[str]:
         """ Return a list of sub folder names. """
-        shell_command = ('svn', 'list', '--xml', url)
-        svn_info_xml = str(self._run_shell_command(shell_command))
-        return [name.string for name in bs4.BeautifulSoup(svn_info_xml, "lxml")('name')]
+        svn_list_xml = self._run_shell_command(('svn', 'list', '--xml', url))
+        return [name.text for name in self._xml_elements(svn_list_xml, 'name')]
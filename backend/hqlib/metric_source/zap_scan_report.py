@@ -29,8 +29,10 @@ class ZAPScanReport(domain.MetricSource):
     """ Class representing ZAP Scan reports. """
     metric_source_name = 'ZAP Scan rapport'
     needs_metric_source_id = True
+    cache_ttl = 60 * 60  # Scans run seldom, so cached reports are fresh for an hour
 
     def __init__(self, url_open=None, **kwargs) -> None:
+        kwargs.setdefault('cache_ttl', self.cache_ttl)
         self._url_open = url_open or url_opener.UrlOpener(**kwargs).url_open
         super().__init__()
 
@@ -30,12 +30,14 @@ from hqlib import app, formatting, commandlineargs, report, metric_source, log,
 
 class Reporter(object):  # pylint: disable=too-few-public-methods
     """ Class for creating the quality report for a specific project. """
-    def __init__(self, project_folder_or_filename):
+    def __init__(self, project_folder_or_filename, prefetch_workers=8):
         self.__project = configuration.Configuration.project(project_folder_or_filename)
+        self.__prefetch_workers = prefetch_workers
 
     def create_report(self, report_folder):
         """ Create, format, and write the quality report. """
         quality_report = report.QualityReport(self.__project)
+        metric_source.UrlPrefetcher(self.__prefetch_workers).prefetch(quality_report.metrics())
         history = self.__project.metric_source(metric_source.History)
         if history.filename():
             history.add_report(quality_report)
@@ -101,6 +103,32 @@ if __name__ == '__main__':
     args = commandlineargs.parse()
     log.init_logging(args.log)
     logging.info("%s v%s starting quality report", NAME, VERSION)
-    report = Reporter(args.project).create_report(args.report)
+    metric_source.UrlOpener.default_connection_pool = metric_source.ConnectionPool(
+        max_connections_per_host=args.max_connections_per_host, max_idle_time=args.connection_idle_time)
+    if args.cache_folder:
+        filesystem.create_dir(args.cache_folder)
+        metric_source.UrlOpener.default_response_cache = metric_source.VersionControlSystem.default_response_cache = \
+            metric_source.ResponseCache(os.path.join(args.cache_folder, 'responses.db'),
+                                        max_size=args.cache_size * 1024 * 1024)
+    if args.git_cache_folder:
+        metric_source.Git.mirrors_folder = os.path.abspath(args.git_cache_folder)
+    if args.max_host_failures > 0:
+        metric_source.UrlOpener.default_circuit_breaker = metric_source.CircuitBreaker(
+            max_failures=args.max_host_failures, cool_down=args.host_cool_down)
+    if args.record or args.replay:
+        filesystem.create_dir(args.record or args.replay)
+        metric_source.UrlOpener.default_recorder = metric_source.VersionControlSystem.default_recorder = \
+            metric_source.TrafficRecorder(args.record or args.replay, replay=bool(args.replay),
+                                          inject_latency=args.replay_latency)
+    report = Reporter(args.project, args.prefetch_workers).create_report(args.report)
+    logging.info("Url reads: %(hits)d from memory, %(coalesced)d coalesced with a read in flight, %(flights)d "
+                 "requested", metric_source.UrlOpener.url_read_statistics())
+    logging.info("Jenkins API: %(parses)d responses parsed in %(parse_time).2f seconds, %(fallbacks)d times the Python "
+                 "API was used because the JSON API couldn't be read", metric_source.JenkinsApi.statistics())
+    logging.info("Shell commands: %(commands)d run in %(time).1f seconds",
+                 metric_source.VersionControlSystem.shell_command_statistics())
+    if metric_source.UrlOpener.default_circuit_breaker:
+        for host in metric_source.UrlOpener.default_circuit_breaker.tripped_hosts():
+            logging.warning("%s was unreachable during the run, metrics depending on it may be missing", host)
     logging.info("%s v%s done with quality report", NAME, VERSION)
     sys.exit(2 if args.failure_exit_code and report.direct_action_needed() else 0)
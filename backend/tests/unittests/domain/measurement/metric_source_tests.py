@@ -34,6 +34,18 @@ class MetricSourceTests(unittest.TestCase):
         """ Test that the metric source id is returned as url. """
         self.assertEqual(['http://url/to/subject'], domain.MetricSource().metric_source_urls('http://url/to/subject'))
 
+    def test_prefetch_urls(self):
+        """ Test that there are no urls to prefetch by default. """
+        self.assertEqual([], domain.MetricSource().prefetch_urls('http://url/to/subject'))
+
+    def test_prefetch(self):
+        """ Test that prefetching a url does nothing by default. """
+        self.assertEqual(None, domain.MetricSource().prefetch('http://url/to/subject'))
+
+    def test_bulk_prefetch(self):
+        """ Test that there is nothing to prefetch in bulk by default. """
+        self.assertEqual(None, domain.MetricSource().bulk_prefetch('id1', 'id2'))
+
     def test_datetime(self):
         """ Test that the datetime is now by default. """
         self.assertTrue(datetime.datetime.now() - domain.MetricSource().datetime() < datetime.timedelta(seconds=10))
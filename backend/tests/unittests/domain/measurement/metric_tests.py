@@ -87,6 +87,34 @@ class MetricTest(unittest.TestCase):
         self.assertFalse(MetricUnderTest(project=project, subject=product)._metric_source_id)
         MetricUnderTest.metric_source_class = None
 
+    def test_prefetch_requests(self):
+        """ Test that the metric asks its metric source for the urls to prefetch. """
+        MetricUnderTest.metric_source_class = metric_source.JunitTestReport
+        metric_source_instance = metric_source.JunitTestReport()
+        project = domain.Project(metric_sources={metric_source.JunitTestReport: metric_source_instance})
+        product = domain.Product(metric_source_ids={metric_source_instance: 'http://junit.xml'})
+        self.assertEqual([(metric_source_instance, 'http://junit.xml')],
+                         MetricUnderTest(project=project, subject=product).prefetch_requests())
+        MetricUnderTest.metric_source_class = None
+
+    def test_bulk_prefetch_requests(self):
+        """ Test that the metric returns its metric source and metric source ids for bulk prefetching. """
+        MetricUnderTest.metric_source_class = metric_source.JunitTestReport
+        metric_source_instance = metric_source.JunitTestReport()
+        project = domain.Project(metric_sources={metric_source.JunitTestReport: metric_source_instance})
+        product = domain.Product(metric_source_ids={metric_source_instance: 'http://junit.xml'})
+        self.assertEqual([(metric_source_instance, 'http://junit.xml')],
+                         MetricUnderTest(project=project, subject=product).bulk_prefetch_requests())
+        MetricUnderTest.metric_source_class = None
+
+    def test_no_bulk_prefetch_requests_without_metric_source(self):
+        """ Test that a metric without metric source has nothing to prefetch in bulk. """
+        self.assertEqual([], self.__metric.bulk_prefetch_requests())
+
+    def test_no_prefetch_requests_without_metric_source(self):
+        """ Test that a metric without metric source has nothing to prefetch. """
+        self.assertEqual([], self.__metric.prefetch_requests())
+
     def test_default_report(self):
         """ Test the default report. """
         self.assertEqual('Subclass responsibility', self.__metric.report())
@@ -14,9 +14,15 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import logging
+import os
+import subprocess
+import tempfile
+import threading
 import unittest
+import unittest.mock
 
-from hqlib.metric_source import VersionControlSystem
+from hqlib.metric_source import VersionControlSystem, TrafficRecorder
 
 
 class VersionControlSystemTests(unittest.TestCase):
@@ -37,3 +43,124 @@ class VersionControlSystemTests(unittest.TestCase):
     def test_do_not_ignore_branches_by_default(self):
         """ Test that branches are not ignored by default. """
         self.assertFalse(VersionControlSystem._ignore_branch('foo'))
+
+
+class VersionControlSystemShellCommandTests(unittest.TestCase):
+    """ Unit tests for running shell commands. """
+
+    def setUp(self):
+        VersionControlSystem._run_shell_command.cache_clear()
+
+    def test_working_directory(self):
+        """ Test that the command runs in the folder without changing the working directory of the process. """
+        kwargs_received = dict()
+        folder = tempfile.gettempdir()
+        vcs = VersionControlSystem(url='http://vcs/', run_shell_command=lambda command, **kwargs:
+                                   kwargs_received.update(kwargs, cwd_in_command=os.getcwd()) or 'output')
+        cwd = os.getcwd()
+        self.assertEqual('output', vcs._run_shell_command(('vcs', 'log'), folder=folder))
+        self.assertEqual(folder, kwargs_received['cwd'])
+        self.assertEqual(cwd, kwargs_received['cwd_in_command'])
+
+    def test_no_folder(self):
+        """ Test that the command runs in the current folder if no folder is specified. """
+        kwargs_received = dict()
+        vcs = VersionControlSystem(url='http://vcs/', run_shell_command=lambda command, **kwargs:
+                                   kwargs_received.update(kwargs) or 'output')
+        vcs._run_shell_command(('vcs', 'log'))
+        self.assertEqual(None, kwargs_received['cwd'])
+
+    def test_statistics(self):
+        """ Test that the commands are counted, also when they fail. """
+        def fail(command, **kwargs):  # pylint: disable=unused-argument
+            """ Fail the command. """
+            raise subprocess.CalledProcessError(1, command)
+        before = VersionControlSystem.shell_command_statistics()
+        VersionControlSystem(url='http://vcs/', run_shell_command=fail)._run_shell_command(('vcs', 'log'),
+                                                                                           log_level=logging.DEBUG)
+        after = VersionControlSystem.shell_command_statistics()
+        self.assertEqual(before['commands'] + 1, after['commands'])
+        self.assertLessEqual(before['time'], after['time'])
+
+    def test_repository_lock(self):
+        """ Test that there is one lock per repository folder. """
+        self.assertIs(VersionControlSystem._repository_lock('a'), VersionControlSystem._repository_lock('a'))
+        self.assertIsNot(VersionControlSystem._repository_lock('a'), VersionControlSystem._repository_lock('b'))
+
+    def test_concurrent_commands(self):
+        """ Test that commands in different folders can run at the same time. """
+        barrier = threading.Barrier(2, timeout=5)
+        vcs = VersionControlSystem(url='http://vcs/', run_shell_command=lambda command, **kwargs:
+                                   str(barrier.wait() >= 0))
+        threads = [threading.Thread(target=vcs._run_shell_command, args=(('vcs', 'log'), folder))
+                   for folder in (tempfile.gettempdir(), os.getcwd())]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertFalse(barrier.broken)
+
+
+class VersionControlSystemRecordingTests(unittest.TestCase):
+    """ Unit tests for recording and replaying the shell commands of the version control system class. """
+
+    def setUp(self):
+        VersionControlSystem._run_shell_command.cache_clear()
+        self.__folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        VersionControlSystem.default_recorder = None
+        VersionControlSystem._run_shell_command.cache_clear()
+        self.__folder.cleanup()
+
+    def __run(self, shell_command, replay=False, log_level=logging.WARNING):
+        """ Run the shell command with a fresh version control system and recorder. """
+        VersionControlSystem._run_shell_command.cache_clear()
+        VersionControlSystem.default_recorder = TrafficRecorder(self.__folder.name, replay=replay)
+        vcs = VersionControlSystem(url='http://vcs/', run_shell_command=shell_command)
+        return vcs._run_shell_command(('vcs', 'log'), log_level=log_level)
+
+    def test_record_and_replay(self):
+        """ Test that the output of shell commands can be recorded and replayed. """
+        self.assertEqual('output', self.__run(lambda *args, **kwargs: 'output'))
+        self.assertEqual('output', self.__run(lambda *args, **kwargs: self.fail('Not replayed'), replay=True))
+
+    def test_replay_missing(self):
+        """ Test that replaying a command that wasn't recorded is treated as a failing command. """
+        self.assertEqual('', self.__run(lambda *args, **kwargs: 'output', replay=True))
+
+    def test_replay_missing_raises(self):
+        """ Test that replaying a command that wasn't recorded raises when the log level is higher than warning. """
+        self.assertRaises(subprocess.CalledProcessError, self.__run, lambda *args, **kwargs: 'output', replay=True,
+                          log_level=logging.ERROR)
+
+
+class VersionControlSystemXMLTests(unittest.TestCase):
+    """ Unit tests for parsing the XML output of shell commands. """
+
+    def test_elements(self):
+        """ Test that the elements with the tag are returned. """
+        elements = VersionControlSystem._xml_elements('<list><entry><name>a</name></entry><name>b</name></list>', 'name')
+        self.assertEqual(['a', 'b'], [element.text for element in elements])
+
+    def test_children(self):
+        """ Test that the children of an element can be used before the next element is returned. """
+        xml = '<list>' + ''.join('<entry><name>{0}</name></entry>'.format(index) for index in range(1000)) + '</list>'
+        entries = VersionControlSystem._xml_elements(xml, 'entry')
+        self.assertEqual([str(index) for index in range(1000)], [entry.findtext('name') for entry in entries])
+
+    def test_parsed_in_chunks(self):
+        """ Test that elements split over chunks are parsed. """
+        with unittest.mock.patch.object(VersionControlSystem, 'xml_chunk_size', 3):
+            elements = VersionControlSystem._xml_elements('<info><url>http://svn/</url></info>', 'url')
+            self.assertEqual(['http://svn/'], [element.text for element in elements])
+
+    def test_no_output(self):
+        """ Test that there are no elements when the shell command failed. """
+        self.assertEqual([], list(VersionControlSystem._xml_elements('', 'name')))
+
+    def test_invalid_xml(self):
+        """ Test that the elements before a parse error are returned and the error is logged. """
+        with self.assertLogs(level=logging.WARNING):
+            elements = [element.text for element in VersionControlSystem._xml_elements('<a><b>1</b><b>2</a>', 'b')]
+        self.assertEqual(['1'], elements)
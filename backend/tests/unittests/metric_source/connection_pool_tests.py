@@ -0,0 +1,254 @@
+"""
+Copyright 2012-2017 Ministerie van Sociale Zaken en Werkgelegenheid
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import gc
+import http.client
+import io
+import unittest
+import urllib.error
+import urllib.request
+
+from hqlib.metric_source.connection_pool import ConnectionPool, ClosingHTTPBasicAuthHandler
+
+
+class FakeResponse(io.BytesIO):
+    """ Fake a HTTP response. """
+    status = 200
+    reason = 'OK'
+    msg = http.client.HTTPMessage()
+
+    def __init__(self, body, will_close=False):
+        super().__init__(body)
+        self.will_close = will_close
+        self.length = len(body)
+        self.read1_sizes = []
+
+    def read(self, size=-1):
+        """ Read and keep track of the remaining length. """
+        data = super().read(size)
+        self.length -= len(data)
+        return data
+
+    def read1(self, size=-1):
+        """ Read and keep track of the remaining length. """
+        self.read1_sizes.append(size)
+        data = super().read1(size)
+        self.length -= len(data)
+        return data
+
+    def isclosed(self):
+        """ Return whether the response has been closed. """
+        return self.closed
+
+
+class FakeConnection(object):
+    """ Fake a HTTP connection. """
+    created = []
+    raise_exception = None
+    will_close = False
+
+    body = b'contents'
+
+    def __init__(self, host, timeout=None, **kwargs):  # pylint: disable=unused-argument
+        self.host = host
+        self.timeout = timeout
+        self.sock = None
+        self.closed = False
+        self.tunnel = None
+        self.requests = []
+        self.responses = []
+        self.created.append(self)
+
+    def set_tunnel(self, host, headers=None):
+        """ Record the tunnel. """
+        self.tunnel = (host, headers)
+
+    def request(self, method, selector, data, headers):  # pylint: disable=unused-argument
+        """ Record the request. """
+        if self.raise_exception:
+            exception, self.__class__.raise_exception = self.raise_exception, None
+            raise exception
+        self.requests.append((method, selector, headers))
+
+    def getresponse(self):
+        """ Return a fake response. """
+        self.responses.append(FakeResponse(self.body, self.will_close))
+        return self.responses[-1]
+
+    def close(self):
+        """ Close the connection. """
+        self.closed = True
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    """ Unit tests for the connection pool. """
+
+    def setUp(self):
+        FakeConnection.created = []
+        FakeConnection.raise_exception = None
+        FakeConnection.will_close = False
+        FakeConnection.body = b'contents'
+        self.__time = 0
+        self.__pool = ConnectionPool(max_connections_per_host=1, max_idle_time=10, clock=lambda: self.__time)
+
+    def open(self, url='http://host/path', request=None):
+        """ Open the url using the pool. """
+        request = request or urllib.request.Request(url)
+        request.timeout = 5
+        return self.__pool.open(FakeConnection, request)
+
+    def tunnel_request(self, url):
+        """ Return a request for the url that is tunnelled through a proxy, like urllib's proxy handler does. """
+        request = urllib.request.Request(url)
+        request.add_header('Proxy-authorization', 'Basic credentials')
+        request.set_proxy('proxy:3128', 'https')
+        return request
+
+    def test_read(self):
+        """ Test that the response can be read. """
+        self.assertEqual(b'contents', self.open().read())
+
+    def test_keep_alive(self):
+        """ Test that the connection is kept alive. """
+        self.open()
+        self.assertEqual('keep-alive', FakeConnection.created[0].requests[0][2]['Connection'])
+
+    def test_reuse_connection(self):
+        """ Test that a connection is reused for the same host. """
+        self.open().read()
+        self.open('http://host/other').read()
+        self.assertEqual(1, len(FakeConnection.created))
+        self.assertEqual(1, self.__pool.nr_idle_connections())
+
+    def test_discarded_response(self):
+        """ Test that the connection is closed if the response is discarded without reading or closing it. """
+        self.open()
+        gc.collect()
+        self.assertTrue(FakeConnection.created[0].closed)
+        self.assertEqual(0, self.__pool.nr_idle_connections())
+
+    def test_discarded_response_after_reading(self):
+        """ Test that discarding a response that has been read completely doesn't close the pooled connection. """
+        self.open().read()
+        gc.collect()
+        self.assertFalse(FakeConnection.created[0].closed)
+        self.assertEqual(1, self.__pool.nr_idle_connections())
+
+    def test_separate_hosts(self):
+        """ Test that connections are not shared between hosts. """
+        self.open().read()
+        self.open('http://other/path')
+        self.assertEqual(['host', 'other'], [connection.host for connection in FakeConnection.created])
+
+    def test_idle_eviction(self):
+        """ Test that connections that have been idle too long are closed instead of reused. """
+        self.open().read()
+        self.__time = 11
+        self.open()
+        self.assertEqual(2, len(FakeConnection.created))
+        self.assertTrue(FakeConnection.created[0].closed)
+
+    def test_server_closes_connection(self):
+        """ Test that connections the server wants closed are not pooled. """
+        FakeConnection.will_close = True
+        self.open().read()
+        self.assertTrue(FakeConnection.created[0].closed)
+        self.assertEqual(0, self.__pool.nr_idle_connections())
+
+    def test_retry_stale_connection(self):
+        """ Test that the request is retried on a fresh connection when the server closed the idle connection. """
+        self.open().read()
+        FakeConnection.raise_exception = http.client.RemoteDisconnected()
+        self.assertEqual(b'contents', self.open().read())
+        self.assertEqual(2, len(FakeConnection.created))
+
+    def test_fresh_connection_error(self):
+        """ Test that errors on a fresh connection are converted to URL errors. """
+        FakeConnection.raise_exception = OSError('oops')
+        self.assertRaises(urllib.error.URLError, self.open)
+        self.assertTrue(FakeConnection.created[0].closed)
+
+    def test_close(self):
+        """ Test that the idle connections can be closed. """
+        self.open().read()
+        self.__pool.close()
+        self.assertTrue(FakeConnection.created[0].closed)
+        self.assertEqual(0, self.__pool.nr_idle_connections())
+
+    def test_connection_released_after_reading_body(self):
+        """ Test that the connection is returned to the pool only after the body has been read. """
+        response = self.open()
+        self.assertEqual(0, self.__pool.nr_idle_connections())
+        self.assertEqual(b'cont', response.read(4))
+        self.assertEqual(0, self.__pool.nr_idle_connections())
+        self.assertEqual(b'ents', response.read(4))
+        self.assertEqual(1, self.__pool.nr_idle_connections())
+        self.assertFalse(FakeConnection.created[0].closed)
+
+    def test_sized_reads_dont_wait(self):
+        """ Test that sized reads return what has been received, so the caller can check its deadline. """
+        self.open().read(3)
+        self.assertEqual([3], FakeConnection.created[0].responses[0].read1_sizes)
+
+    def test_close_before_reading_body(self):
+        """ Test that the connection is closed if the response is closed before the body has been read. """
+        response = self.open()
+        response.read(1)
+        response.close()
+        self.assertTrue(FakeConnection.created[0].closed)
+        self.assertEqual(0, self.__pool.nr_idle_connections())
+
+    def test_no_body(self):
+        """ Test that the connection is returned to the pool right away if the response has no body. """
+        FakeConnection.body = b''
+        self.open()
+        self.assertEqual(1, self.__pool.nr_idle_connections())
+
+    def test_tunnel(self):
+        """ Test that requests tunnelled through a proxy set up the tunnel, with the proxy authorization. """
+        request = self.tunnel_request('https://host/path')
+        self.open(request=request).read()
+        connection = FakeConnection.created[0]
+        self.assertEqual('proxy:3128', connection.host)
+        self.assertEqual(('host', {'Proxy-Authorization': 'Basic credentials'}), connection.tunnel)
+        self.assertFalse('Proxy-Authorization' in connection.requests[0][2])
+
+    def test_tunnels_to_different_hosts(self):
+        """ Test that connections tunnelled through the same proxy are not shared between origin hosts. """
+        self.open(request=self.tunnel_request('https://host/path')).read()
+        self.open(request=self.tunnel_request('https://other/path')).read()
+        self.open(request=self.tunnel_request('https://host/other')).read()
+        self.assertEqual([('host', {'Proxy-Authorization': 'Basic credentials'}),
+                          ('other', {'Proxy-Authorization': 'Basic credentials'})],
+                         [connection.tunnel for connection in FakeConnection.created])
+
+    def test_handlers(self):
+        """ Test that the pool provides handlers for both HTTP and HTTPS. """
+        http_handler, https_handler = self.__pool.handlers()
+        self.assertTrue(isinstance(http_handler, urllib.request.HTTPHandler))
+        self.assertTrue(isinstance(https_handler, urllib.request.HTTPSHandler))
+
+
+class ClosingHTTPBasicAuthHandlerTest(unittest.TestCase):
+    """ Unit tests for the basic authentication handler. """
+
+    def test_close_unauthorized_response(self):
+        """ Test that the 401 response is closed before retrying, so its connection isn't left open. """
+        response = io.BytesIO(b'Unauthorized')
+        handler = ClosingHTTPBasicAuthHandler()
+        handler.http_error_401(urllib.request.Request('http://host/path'), response, 401, 'Unauthorized',
+                               http.client.HTTPMessage())
+        self.assertTrue(response.closed)
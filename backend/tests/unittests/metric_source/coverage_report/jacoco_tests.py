@@ -16,6 +16,7 @@ limitations under the License.
 
 import datetime
 import unittest
+import unittest.mock
 import urllib.error
 
 from hqlib.metric_source import JaCoCo
@@ -53,6 +54,14 @@ class JacocoTest(unittest.TestCase):
         self.__opener = FakeUrlOpener()
         self.__jacoco = JaCoCo(url_open=self.__opener.url_open)
 
+    def test_cache_ttl(self):
+        """ Test that the coverage report passes its time to live for cached responses to the url opener. """
+        with unittest.mock.patch('hqlib.metric_source.abstract.coverage_report.UrlOpener') as url_opener:
+            JaCoCo()
+            JaCoCo(cache_ttl=0)
+        self.assertEqual([unittest.mock.call(cache_ttl=JaCoCo.cache_ttl), unittest.mock.call(cache_ttl=0)],
+                         url_opener.call_args_list)
+
     def test_statement_coverage(self):
         """ Test the statement coverage for a specific product. """
         self.assertEqual(round(100 * (6293 - 1162) / 6293.),
@@ -15,10 +15,14 @@ limitations under the License.
 """
 
 import datetime
+import io
 import json
+import os
+import tempfile
 import unittest
+import unittest.mock
 
-from typing import Sequence
+from typing import Optional, Sequence
 
 from hqlib.metric_source import History, CompactHistory
 
@@ -26,18 +30,33 @@ from hqlib.metric_source import History, CompactHistory
 class FakeFile(object):  # pylint: disable=too-few-public-methods
     """ Fake a file object. """
     initial_content: Sequence[str] = []
+    log_content: Sequence[str] = []
+    index_content: Optional[Sequence[str]] = None
     new_contents = ''
 
-    def __init__(self, *args, **kwargs):  # pylint: disable=unused-argument
+    def __init__(self, filename='', *args, **kwargs):  # pylint: disable=unused-argument
+        if filename.endswith(CompactHistory.index_file_extension) and self.index_content is None:
+            raise FileNotFoundError
+        if filename.endswith(CompactHistory.log_file_extension):
+            self.__content = self.log_content
+        elif filename.endswith(CompactHistory.index_file_extension):
+            self.__content = self.index_content
+        else:
+            self.__content = self.initial_content
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
         pass
 
     def __iter__(self):
         """ Return an iterator for the fake contents of the file. """
-        return self.initial_content.__iter__()
+        return self.__content.__iter__()
 
     def read(self):
         """ Return the file contents as string. """
-        return ''.join(self.initial_content)
+        return ''.join(self.__content)
 
     @classmethod
     def write(cls, data):
@@ -64,6 +83,10 @@ class EmptyCompactHistoryTestCase(unittest.TestCase):
         """ Test that the empty history file has no recent history. """
         self.assertEqual([], self.__history.recent_history('metric id'))
 
+    def test_recent_history_for_all(self):
+        """ Test that the empty history file has no recent history for any metric. """
+        self.assertEqual({}, self.__history.recent_history_for_all())
+
 
 class FailingFile(FakeFile):  # pylint: disable=too-few-public-methods
     """ Fake a file that raises an exception. """
@@ -104,6 +127,9 @@ class CompactHistoryTest(unittest.TestCase):
 
     def setUp(self):
         FakeFile.initial_content = COMPACT_HISTORY
+        FakeFile.log_content = []
+        FakeFile.index_content = None
+        FakeFile.new_contents = ''
         self.__history = CompactHistory('fake file', file_=FakeFile)
 
     def test_filename(self):
@@ -118,6 +144,56 @@ class CompactHistoryTest(unittest.TestCase):
         """ Test the recent history of a non-existing metric. """
         self.assertEqual([], self.__history.recent_history('Non existing'))
 
+    def test_limited_recent_history(self):
+        """ Test that the recent history is limited to the most recent dates. """
+        self.assertEqual([38, 38], CompactHistory('fake file', recent_history=2, file_=FakeFile).recent_history(
+            'OpenBugsNone'))
+
+    def test_recent_history_with_gap(self):
+        """ Test that dates on which the metric wasn't measured are skipped. """
+        FakeFile.log_content = ['{"date": "2015-01-01 00:00:00", "metrics": {}}\n',
+                                '{"date": "2015-01-02 00:00:00", "metrics": {"OpenBugsNone": {"status": "red", '
+                                '"value": 40}}}\n']
+        self.assertEqual([10, 38, 38, 40], self.__history.recent_history('OpenBugsNone'))
+
+    def test_recent_history_for_all(self):
+        """ Test the recent history of all metrics. """
+        FakeFile.log_content = ['{"date": "2015-01-01 00:00:00", "metrics": {"NewMetric": {"status": "grey"}}}\n',
+                                '{"date": "2015-01-02 00:00:00", "metrics": {"OpenBugsNone": {"status": "red", '
+                                '"value": 40}, "NewMetric": {"status": "green", "value": 1}}}\n']
+        self.assertEqual(dict(OpenBugsNone=[38, 38, 40], NewMetric=[-1, 1]),
+                         CompactHistory('fake file', recent_history=4, file_=FakeFile).recent_history_for_all())
+
+    def test_recent_history_for_all_after_adding_metrics(self):
+        """ Test that the recent history of all metrics includes metrics added after reading the history. """
+        self.__history.recent_history('OpenBugsNone')
+        self.__history.add_metrics(datetime.datetime(2015, 1, 1), [FakeMetric(5, 'OpenBugsNone', 'green')])
+        self.assertEqual(dict(OpenBugsNone=[10, 38, 38, 5]), self.__history.recent_history_for_all())
+        self.assertEqual([10, 38, 38, 5], self.__history.recent_history('OpenBugsNone'))
+
+    def test_recent_history_for_all_measurements_ended(self):
+        """ Test that metrics whose measurements ended before the recent dates have no recent history. """
+        FakeFile.log_content = ['{"date": "2015-01-01 00:00:00", "metrics": {"NewMetric": {"status": "grey"}}}\n',
+                                '{"date": "2015-01-02 00:00:00", "metrics": {"NewMetric": {"status": "green", '
+                                '"value": 1}}}\n']
+        history = CompactHistory('fake file', recent_history=2, file_=FakeFile)
+        self.assertEqual(dict(OpenBugsNone=[], NewMetric=[-1, 1]), history.recent_history_for_all())
+        self.assertEqual([], history.recent_history('OpenBugsNone'))
+
+    def test_recent_history_for_all_measurements_ended_during_recent_dates(self):
+        """ Test that the recent history stops when the measurements of the metric end within the recent dates. """
+        FakeFile.log_content = ['{"date": "2015-01-01 00:00:00", "metrics": {"NewMetric": {"status": "grey"}}}\n']
+        history = CompactHistory('fake file', recent_history=3, file_=FakeFile)
+        self.assertEqual(dict(OpenBugsNone=[38, 38], NewMetric=[-1]), history.recent_history_for_all())
+
+    def test_recent_history_is_computed_once(self):
+        """ Test that the recent history of all metrics is computed once and reused for each metric. """
+        with unittest.mock.patch.object(CompactHistory, 'recent_history_for_all',
+                                        return_value=dict(OpenBugsNone=[38])) as recent_history_for_all:
+            self.assertEqual([38], self.__history.recent_history('OpenBugsNone'))
+            self.assertEqual([], self.__history.recent_history('NewMetric'))
+        recent_history_for_all.assert_called_once_with()
+
     def test_status_start_date(self):
         """ Test that the status start date is returned correctly. """
         self.assertEqual(datetime.datetime(2013, 2, 28, 17, 16, 45),
@@ -141,26 +217,180 @@ class CompactHistoryTest(unittest.TestCase):
 
     def test_add_metrics(self):
         """ Test that metrics can be added. """
+        self.__history.add_metrics(datetime.datetime(2015, 1, 1), [FakeMetric()])
+        record = json.loads(FakeFile.new_contents)
+        self.assertEqual(dict(date='2015-01-01 00:00:00', metrics=dict(FakeMetric=dict(status='green', value=10))),
+                         record)
+
+    def test_add_metrics_after_reading(self):
+        """ Test that added metrics are part of the history that has been read already. """
+        self.__history.recent_history('OpenBugsNone')
+        self.__history.add_metrics(datetime.datetime(2015, 1, 1), [FakeMetric(38, 'OpenBugsNone', 'red')])
+        self.assertEqual([10, 38, 38, 38], self.__history.recent_history('OpenBugsNone'))
+
+    def test_log(self):
+        """ Test that the records in the log are part of the history. """
+        FakeFile.log_content = ['{"date": "2015-01-01 00:00:00", "metrics": {"OpenBugsNone": {"status": "green", '
+                                '"value": 5}, "NewMetric": {"status": "grey"}}}\n']
+        self.assertEqual([10, 38, 38, 5], self.__history.recent_history('OpenBugsNone'))
+        self.assertEqual([-1], self.__history.recent_history('NewMetric'))
+        self.assertEqual(datetime.datetime(2015, 1, 1), self.__history.status_start_date('OpenBugsNone', 'green'))
+        self.assertEqual({'green': 1, 'grey': 1, 'date': '2015-01-01 00:00:00'}, self.__history.statuses()[-1])
+
+    def test_merged_records_in_log(self):
+        """ Test that records in the log that have been merged into the history file already are ignored. """
+        FakeFile.log_content = ['{"date": "2013-03-05 17:16:45", "metrics": {"OpenBugsNone": {"status": "red", '
+                                '"value": 38}}}\n']
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual([10, 38, 38], self.__history.recent_history('OpenBugsNone'))
+
+    def test_log_record_before_last_date(self):
+        """ Test that records in the log with a date before the last date in the history are not lost. """
+        FakeFile.log_content = ['{"date": "2013-03-01 12:00:00", "metrics": {"OpenBugsNone": {"status": "green", '
+                                '"value": 5}}}\n']
+        self.assertEqual([10, 38, 38, 5], self.__history.recent_history('OpenBugsNone'))
+        self.assertEqual([10, 38, 38, 5], self.__history.recent_history_for_all()['OpenBugsNone'])
+
+    def test_index(self):
+        """ Test that the index is read instead of the history file. """
+        FakeFile.index_content = ['{"window": 100, "dates": ["2013-03-05 17:16:45"], "statuses": [{"red": 1}], '
+                                  '"metrics": {"OpenBugsNone": [{"value": 38, "start": "2013-02-28 17:16:45", '
+                                  '"end": "2013-03-05 17:16:45", "status": "red"}]}}']
+        self.assertEqual([38], self.__history.recent_history('OpenBugsNone'))
+        self.assertEqual([dict(date='2013-03-05 17:16:45', red=1)], self.__history.statuses())
+
+    def test_index_too_small(self):
+        """ Test that the history file is read if the index doesn't contain enough dates for the recent history. """
+        FakeFile.index_content = ['{"window": 1, "dates": ["2013-03-05 17:16:45"], "statuses": [{"red": 1}], '
+                                  '"metrics": {"OpenBugsNone": [{"value": 38, "start": "2013-02-28 17:16:45", '
+                                  '"end": "2013-03-05 17:16:45", "status": "red"}]}}']
+        self.assertEqual([10, 38, 38], self.__history.recent_history('OpenBugsNone'))
 
-        class FakeMetric(object):
-            """ Fake a metric. """
-            @staticmethod
-            def numerical_value():
-                """ Return the value. """
-                return 10
-            @staticmethod
-            def stable_id():
-                """ Return the stable metric id. """
-                return 'FakeMetric'
-            @staticmethod
-            def status():
-                """ Return the metric status. """
-                return 'green'
 
-        self.__history.add_metrics(datetime.datetime(2015, 1, 1), [FakeMetric()])
-        history = json.loads(FakeFile.new_contents)
-        self.assertEqual(10, history['metrics']['FakeMetric'][0]['value'])
-        self.assertEqual('green', history['metrics']['FakeMetric'][0]['status'])
+class FakeMetric(object):
+    """ Fake a metric. """
+    def __init__(self, value=10, stable_id='FakeMetric', status='green'):
+        self.__value = value
+        self.__stable_id = stable_id
+        self.__status = status
+
+    def numerical_value(self):
+        """ Return the value. """
+        return self.__value
+
+    def stable_id(self):
+        """ Return the stable metric id. """
+        return self.__stable_id
+
+    def status(self):
+        """ Return the metric status. """
+        return self.__status
+
+
+class CompactHistoryCompactionTest(unittest.TestCase):
+    """ Unit tests for merging the log of the CompactHistory class into the history file. """
+
+    def setUp(self):
+        self.__folder = tempfile.TemporaryDirectory()
+        self.__filename = os.path.join(self.__folder.name, 'history.json')
+        self.__history = CompactHistory(self.__filename)
+
+    def tearDown(self):
+        self.__folder.cleanup()
+
+    def __add(self, *values, first_day=1):
+        """ Add a report per day with the values to the history. """
+        for day, value in enumerate(values, start=first_day):
+            self.__history.add_metrics(datetime.datetime(2017, 1, day), [FakeMetric(value)])
+
+    def test_add_without_history_file(self):
+        """ Test that reports are appended to the log and the history file isn't created. """
+        self.__add(1, 2, 2)
+        self.assertFalse(os.path.exists(self.__filename))
+        self.assertEqual([1, 2, 2], CompactHistory(self.__filename).recent_history('FakeMetric'))
+
+    def test_compact(self):
+        """ Test that the log is merged into the history file and emptied. """
+        self.__add(1, 2, 2)
+        self.__history.compact()
+        with open(self.__filename) as history_file:
+            history = json.load(history_file)
+        self.assertEqual([dict(start='2017-01-01 00:00:00', end='2017-01-01 00:00:00', status='green', value=1),
+                          dict(start='2017-01-02 00:00:00', end='2017-01-03 00:00:00', status='green', value=2)],
+                         history['metrics']['FakeMetric'])
+        with open(self.__history.log_filename()) as log_file:
+            self.assertEqual('', log_file.read())
+        self.assertEqual([1, 2, 2], CompactHistory(self.__filename).recent_history('FakeMetric'))
+
+    def test_compact_index(self):
+        """ Test that the index contains the dates and statuses and the recent intervals of the metrics. """
+        self.__history.index_window = 2
+        self.__add(1, 2, 3)
+        self.__history.compact()
+        with open(self.__history.index_filename()) as index_file:
+            index = json.load(index_file)
+        self.assertEqual(3, len(index['dates']))
+        self.assertEqual(3, len(index['statuses']))
+        self.assertEqual([2, 3], [measurement['value'] for measurement in index['metrics']['FakeMetric']])
+
+    def test_index_keeps_last_interval(self):
+        """ Test that the index contains the last interval of metrics that weren't measured recently. """
+        self.__history.index_window = 1
+        self.__history.add_metrics(datetime.datetime(2017, 1, 1), [FakeMetric(1, 'OldMetric')])
+        self.__add(2, first_day=2)
+        self.__history.compact()
+        history = CompactHistory(self.__filename, recent_history=1)
+        self.assertEqual(datetime.datetime(2017, 1, 1), history.status_start_date('OldMetric', 'green'))
+        self.assertEqual([], history.recent_history('OldMetric'))
+
+    def test_compact_without_holding_lock(self):
+        """ Test that the history file is written without holding the lock, so the history can be used meanwhile. """
+        lock_held = []
+
+        def file_(filename, *args, **kwargs):
+            """ Record whether the lock is held while writing the new history file. """
+            if filename == self.__filename + '.tmp':
+                lock_held.append(history._CompactHistory__lock.locked())  # pylint: disable=protected-access
+            return open(filename, *args, **kwargs)
+
+        history = CompactHistory(self.__filename, file_=file_)
+        history.add_metrics(datetime.datetime(2017, 1, 1), [FakeMetric()])
+        history.compact()
+        self.assertEqual([False], lock_held)
+
+    def test_create_missing_index(self):
+        """ Test that the index is created in the background if there's a history file without index. """
+        self.__add(1)
+        self.__history.compact()
+        os.remove(self.__history.index_filename())
+        self.__add(2, first_day=2)
+        self.__history._CompactHistory__compaction_thread.join()  # pylint: disable=protected-access
+        self.assertTrue(os.path.exists(self.__history.index_filename()))
+
+    def test_compact_empty_log(self):
+        """ Test that compacting without log doesn't create a history file. """
+        self.__history.compact()
+        self.assertFalse(os.path.exists(self.__filename))
+
+    def test_compact_in_background(self):
+        """ Test that the log is merged into the history file when the log gets long. """
+        self.__history.compaction_threshold = 3
+        self.__add(1, 2, 3)
+        self.__history._CompactHistory__compaction_thread.join()
+        self.assertTrue(os.path.exists(self.__filename))
+        self.__add(4, first_day=4)
+        self.assertEqual([1, 2, 3, 4], CompactHistory(self.__filename).recent_history('FakeMetric'))
+
+    def test_interrupted_compaction(self):
+        """ Test that records that are both in the history file and in the log are counted once. """
+        self.__add(1, 2)
+        with open(self.__history.log_filename()) as log_file:
+            log = log_file.read()
+        self.__history.compact()
+        with open(self.__history.log_filename(), 'w') as log_file:
+            log_file.write(log)
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual([1, 2], CompactHistory(self.__filename).recent_history('FakeMetric'))
 
 
 HISTORY = ['{"date": "2013-02-28 17:16:46", "OpenBugsNone": "38", '
@@ -175,10 +405,18 @@ OLD_HISTORY = ['{"date": "2013-02-27 17:16:46", '
                '"YellowMetaMetric": "0" , "MissingMetaMetric": "0", "GreyMetaMetric": "0" }\r\n']
 
 
+class FakeBinaryFile(io.BytesIO):
+    """ Fake a file opened in binary mode. """
+    initial_content: Sequence[str] = []
+
+    def __init__(self, *args, **kwargs):  # pylint: disable=unused-argument
+        super().__init__(''.join(self.initial_content).encode('ascii'))
+
+
 class HistoryTestCase(unittest.TestCase):
     """ Base class for History file test cases. """
     def setUp(self):
-        History._History__load_complete_history.cache_clear()
+        History._History__load_recent_history.cache_clear()
         History._History__historic_values.cache_clear()
 
 
@@ -187,7 +425,7 @@ class EmptyHistoryTest(HistoryTestCase):
 
     def setUp(self):
         super().setUp()
-        self.__history = History('non-existing file', file_=FakeFile)
+        self.__history = History('non-existing file', file_=FakeBinaryFile)
 
     def test_no_recent_history(self):
         """ Test that there is no history when the history file does not exist. """
@@ -211,7 +449,7 @@ class HistoryTest(HistoryTestCase):
 
     def setUp(self):
         super().setUp()
-        self.__history = History('fake file', file_=FakeFile, recent_history=3)
+        self.__history = History('fake file', file_=FakeBinaryFile, recent_history=3)
 
     def test_filename(self):
         """ Test getting the filename. """
@@ -219,45 +457,68 @@ class HistoryTest(HistoryTestCase):
 
     def test_recent_history(self):
         """ Test the recent history of a specific metric. """
-        FakeFile.initial_content = HISTORY
+        FakeBinaryFile.initial_content = HISTORY
         self.assertEqual(['38'], self.__history.recent_history('OpenBugsNone'))
 
     def test_missing_recent_history(self):
         """ Test the recent history of a non-existing metric. """
-        FakeFile.initial_content = HISTORY
+        FakeBinaryFile.initial_content = HISTORY
         self.assertEqual([], self.__history.recent_history('Non existing'))
 
     def test_status_start_date(self):
         """ Test that the status start date is returned correctly. """
-        FakeFile.initial_content = OLD_HISTORY
+        FakeBinaryFile.initial_content = OLD_HISTORY
         self.assertEqual(datetime.datetime(2013, 2, 27, 17, 16, 46, 567000),
                          self.__history.status_start_date('OpenBugsNone', 'green'))
 
     def test_statuses(self):
         """ Test that the statuses are returned correctly. """
-        FakeFile.initial_content = HISTORY
+        FakeBinaryFile.initial_content = HISTORY
         self.assertEqual([{'green': 1, 'date': '2013-02-28 17:16:46'}], self.__history.statuses())
 
     def test_status_start_date_no_history(self):
         """ Test the status start date without history. """
-        FakeFile.initial_content = ''
+        FakeBinaryFile.initial_content = ''
         self.assertEqual(datetime.datetime(2013, 1, 1, 0, 0, 0),
                          self.__history.status_start_date('OpenBugsNone', 'red',
                                                           now=lambda: datetime.datetime(2013, 1, 1, 0, 0, 0)))
 
     def test_status_start_date_new_metric(self):
         """ Test the status start date for a new metric. """
-        FakeFile.initial_content = OLD_HISTORY
+        FakeBinaryFile.initial_content = OLD_HISTORY
         self.assertEqual(datetime.datetime(2013, 1, 1, 0, 0, 0),
                          self.__history.status_start_date('NewMetric', 'red',
                                                           now=lambda: datetime.datetime(2013, 1, 1, 0, 0, 0)))
 
     def test_status_no_microseconds(self):
         """ Test that the status start date works without microseconds. """
-        FakeFile.initial_content = HISTORY
+        FakeBinaryFile.initial_content = HISTORY
         self.assertEqual(datetime.datetime(2013, 2, 27, 15, 45, 32),
                          self.__history.status_start_date('OpenBugsFoo', 'green'))
 
+    def test_recent_history_is_read_from_the_end(self):
+        """ Test that the recent history consists of the last lines, ignoring lines with meta metrics only. """
+        FakeBinaryFile.initial_content = [HISTORY[0].replace('"38"', '"{0}"'.format(index)) for index in range(5)] + \
+            ['{"date": "2013-03-01 00:00:00", "GreenMetaMetric": "100"}\r\n']
+        self.assertEqual(['2', '3', '4'], self.__history.recent_history('OpenBugsNone'))
+
+    def test_recent_history_in_small_blocks(self):
+        """ Test that lines split over the blocks read from the end of the file are read correctly. """
+        FakeBinaryFile.initial_content = [OLD_HISTORY[0], HISTORY[0]]
+        with unittest.mock.patch.object(History, 'block_size', 7):
+            self.assertEqual(['35', '38'], self.__history.recent_history('OpenBugsNone'))
+
+    def test_recent_history_without_trailing_line_break(self):
+        """ Test that the last line is read if the file doesn't end with a line break. """
+        FakeBinaryFile.initial_content = [OLD_HISTORY[0], HISTORY[0].strip()]
+        self.assertEqual(['35', '38'], self.__history.recent_history('OpenBugsNone'))
+
+    def test_statuses_of_complete_history(self):
+        """ Test that the statuses are returned for all lines, not only the recent ones. """
+        FakeBinaryFile.initial_content = [OLD_HISTORY[0]] * 4 + [HISTORY[0]]
+        self.assertEqual([{'green': 1, 'date': '2013-02-27 17:16:46'}] * 4 +
+                         [{'green': 1, 'date': '2013-02-28 17:16:46'}], self.__history.statuses())
+
     def test_url(self):
         """ Test that the url is the filename. """
         self.assertEqual('fake file', self.__history.url())
@@ -63,7 +63,7 @@ class TrelloBoardTest(unittest.TestCase):
         self.__cards_json = ''
         self.__trello_board = TrelloBoard('object_id', 'appkey', 'token', urlopen=self.__urlopen, card_class=FakeCard)
 
-    def __urlopen(self, url):
+    def __urlopen(self, url, **kwargs):  # pylint: disable=unused-argument
         """ Return a fake JSON string. """
         if self.__raise:
             raise urllib.error.URLError(url)
@@ -159,7 +159,7 @@ class TrelloCardTest(unittest.TestCase):
         """ Return a fake current date time earlier than __now(). """
         return datetime.datetime(2013, 5, 4, 17, 45, 33)
 
-    def __urlopen(self, url):  # pylint: disable=unused-argument
+    def __urlopen(self, url, **kwargs):  # pylint: disable=unused-argument
         """ Return a fake JSON string. """
         return io.StringIO(self.__json)
 
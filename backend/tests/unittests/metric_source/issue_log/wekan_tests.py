@@ -15,10 +15,12 @@ limitations under the License.
 """
 
 import datetime
+import tempfile
 import unittest
 
 
-from hqlib.metric_source.issue_log.wekan import WekanBoard
+from hqlib.metric_source import TrafficRecorder
+from hqlib.metric_source.issue_log.wekan import WekanBoard, recorded_api
 
 # pylint: disable=too-few-public-methods
 
@@ -186,3 +188,33 @@ class WekanBoardTest(unittest.TestCase):
         """ Test the WekanBoard date and time without Wekan board. """
         self.assertEqual(datetime.datetime.min, WekanBoard('', '', '', 'id',
                                                            api=FakeWekanAPI([FakeBoard([FakeCardList()])])).datetime())
+
+
+class FakeWekanAPIClass(object):
+    """ Fake the Wekan API class, which logs in when created. """
+
+    calls = []
+
+    def __init__(self, api_url, credentials):
+        self.api_url = api_url
+        self.login = self.api_call('/users/login', data=credentials, authed=False)
+
+    def api_call(self, url, data=None, authed=True):  # pylint: disable=unused-argument
+        """ Return the response of the Wekan server. """
+        self.calls.append(url)
+        return dict(url=url)
+
+
+class RecordedWekanAPITest(unittest.TestCase):
+    """ Unit tests for recording and replaying the Wekan API. """
+
+    def test_record_and_replay(self):
+        """ Test that Wekan API calls can be recorded and replayed. """
+        with tempfile.TemporaryDirectory() as folder:
+            api = recorded_api(FakeWekanAPIClass, TrafficRecorder(folder))('http://wekan', dict(username='user'))
+            api.api_call('/api/boards')
+            api = recorded_api(FakeWekanAPIClass, TrafficRecorder(folder, replay=True))(
+                'http://wekan', dict(username='user'))
+            self.assertEqual(dict(url='/users/login'), api.login)
+            self.assertEqual(dict(url='/api/boards'), api.api_call('/api/boards'))
+            self.assertEqual(['/users/login', '/api/boards'], FakeWekanAPIClass.calls)
@@ -0,0 +1,109 @@
+"""
+Copyright 2012-2017 Ministerie van Sociale Zaken en Werkgelegenheid
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import unittest
+import urllib.error
+
+from hqlib.metric_source import JenkinsApi
+
+
+class FakeUrlRead(object):  # pylint: disable=too-few-public-methods
+    """ Fake url read function that returns the contents per url. """
+    def __init__(self, **contents):
+        self.contents = contents
+        self.urls_read = []
+
+    def __call__(self, url):
+        self.urls_read.append(url)
+        postfix = url.split('/')[-1]
+        if postfix not in self.contents:
+            raise urllib.error.HTTPError(url, 404, 'Not found', None, None)
+        return self.contents[postfix]
+
+
+class JenkinsApiTest(unittest.TestCase):
+    """ Unit tests for the Jenkins API client. """
+
+    def test_json(self):
+        """ Test that the JSON API is read. """
+        url_read = FakeUrlRead(json='{"jobs": [], "buildable": true}')
+        self.assertEqual(dict(jobs=[], buildable=True), JenkinsApi(url_read).read('http://jenkins/api/json'))
+        self.assertEqual(['http://jenkins/api/json'], url_read.urls_read)
+
+    def test_bytes(self):
+        """ Test that responses in bytes are decoded. """
+        self.assertEqual(dict(jobs=[]), JenkinsApi(FakeUrlRead(json=b'{"jobs": []}')).read('http://jenkins/api/json'))
+
+    def test_no_fallback_on_http_error(self):
+        """ Test that HTTP errors on the JSON API are passed on without trying the Python API. """
+        url_read = FakeUrlRead(python='{"jobs": [], "buildable": True}')
+        self.assertRaises(urllib.error.HTTPError, JenkinsApi(url_read).read, 'http://jenkins/api/json')
+        self.assertEqual(['http://jenkins/api/json'], url_read.urls_read)
+
+    def test_fallback_when_json_invalid(self):
+        """ Test that the Python API is read if the JSON API returns something else than JSON, and from then on only
+            the Python API. """
+        url_read = FakeUrlRead(json='<html/>', python='{"jobs": [], "buildable": True}')
+        api = JenkinsApi(url_read)
+        self.assertEqual(dict(jobs=[], buildable=True), api.read('http://jenkins/api/json'))
+        self.assertEqual(dict(jobs=[], buildable=True), api.read('http://jenkins/job/x/api/json'))
+        self.assertEqual(['http://jenkins/api/json', 'http://jenkins/api/python', 'http://jenkins/job/x/api/python'],
+                         url_read.urls_read)
+
+    def test_no_fallback_when_both_fail(self):
+        """ Test that the JSON API keeps being used if the Python API can't be read either. """
+        url_read = FakeUrlRead(json='<html/>')
+        api = JenkinsApi(url_read)
+        self.assertRaises(ValueError, api.read, 'http://jenkins/missing/api/json')
+        url_read.contents['json'] = '{}'
+        self.assertEqual(dict(), api.read('http://jenkins/api/json'))
+
+    def test_python_api_failure_is_chained(self):
+        """ Test that the failure of the Python API is the cause of the error that is raised. """
+        api = JenkinsApi(FakeUrlRead(json='{"a":}', python='{"a":}'))
+        with self.assertRaises(ValueError) as context:
+            api.read('http://jenkins/api/json')
+        self.assertIsInstance(context.exception.__cause__, ValueError)
+
+    def test_parse_error(self):
+        """ Test that a ValueError is raised if neither API returns a valid response. """
+        api = JenkinsApi(FakeUrlRead(json='{"a":}', python='{"a":}'))
+        self.assertRaises(ValueError, api.read, 'http://jenkins/api/json')
+
+    def test_url_error(self):
+        """ Test that url errors are passed on without trying the Python API. """
+        def url_read(url):
+            """ Fail to connect. """
+            urls_read.append(url)
+            raise urllib.error.URLError('connection refused')
+        urls_read = []
+        self.assertRaises(urllib.error.URLError, JenkinsApi(url_read).read, 'http://jenkins/api/json')
+        self.assertEqual(['http://jenkins/api/json'], urls_read)
+
+    def test_python_url(self):
+        """ Test that the Python API url keeps the query. """
+        self.assertEqual('http://jenkins/api/python?tree=jobs[name]',
+                         JenkinsApi.python_url('http://jenkins/api/json?tree=jobs[name]'))
+
+    def test_statistics(self):
+        """ Test that the parsed responses and the time spent parsing are counted. """
+        before = JenkinsApi.statistics()
+        times = iter([10., 10.5])
+        JenkinsApi(FakeUrlRead(json='{}'), clock=lambda: next(times)).read('http://jenkins/api/json')
+        after = JenkinsApi.statistics()
+        self.assertEqual(before['parses'] + 1, after['parses'])
+        self.assertAlmostEqual(before['parse_time'] + 0.5, after['parse_time'])
+        self.assertEqual(before['fallbacks'], after['fallbacks'])
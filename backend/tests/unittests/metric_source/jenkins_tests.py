@@ -50,6 +50,13 @@ class JenkinsTest(unittest.TestCase):
         """ Test the Jenkins url. """
         self.assertEqual('http://jenkins/', self.__jenkins.url())
 
+    def test_prefetch(self):
+        """ Test that prefetching reads the url. """
+        urls_read = []
+        self.__jenkins.url_read = urls_read.append
+        self.__jenkins.prefetch('http://jenkins/api/json')
+        self.assertEqual(['http://jenkins/api/json'], urls_read)
+
     def test_no_failing_jobs(self):
         """ Test the number of failing jobs when there are no failing jobs. """
         self.assertEqual({}, self.__jenkins.failing_jobs_url())
@@ -58,30 +65,50 @@ class JenkinsTest(unittest.TestCase):
         """ Test the failing jobs with one failing job. """
         date_time = datetime.datetime(2013, 4, 1, 12, 0, 0)
         self.__jenkins.contents = '{{"jobs": [{{"name": "job1", "color": "red", "description": "", ' \
-                                  '"url": "http://url", "buildable": True}}], "timestamp": "{}", ' \
-                                  '"builds": [{{}}]}}'.format(to_jenkins_timestamp(date_time))
+                                  '"url": "http://url", "buildable": true, "lastStableBuild": {{"timestamp": "{}"}}, ' \
+                                  '"builds": [{{}}]}}]}}'.format(to_jenkins_timestamp(date_time))
         expected_days_ago = (datetime.datetime.utcnow() - date_time).days
         self.assertEqual({'job1 ({0:d} dagen)'.format(expected_days_ago): 'http://url'},
                          self.__jenkins.failing_jobs_url())
 
+    def test_failing_job_without_stable_build(self):
+        """ Test that the age of a failing job without stable build is unknown. """
+        self.__jenkins.contents = '{"jobs": [{"name": "job1", "color": "red", "description": "", ' \
+                                  '"url": "http://url", "buildable": true, "lastStableBuild": null, ' \
+                                  '"builds": [{}]}]}'
+        self.assertEqual({'job1 (? dagen)': 'http://url'}, self.__jenkins.failing_jobs_url())
+
+    def test_failing_job_with_invalid_timestamp(self):
+        """ Test that the age of a failing job is unknown if the timestamp of its stable build is invalid. """
+        self.__jenkins.contents = '{"jobs": [{"name": "job1", "color": "red", "description": "", ' \
+                                  '"url": "http://url", "buildable": true, "lastStableBuild": {"timestamp": "x"}, ' \
+                                  '"builds": [{}]}]}'
+        self.assertEqual({'job1 (? dagen)': 'http://url'}, self.__jenkins.failing_jobs_url())
+
+    def test_ignore_failing_job_without_builds(self):
+        """ Test that failing jobs without builds are ignored. """
+        self.__jenkins.contents = '{"jobs": [{"name": "job1", "color": "red", "description": "", ' \
+                                  '"url": "http://url", "buildable": true, "lastStableBuild": null, "builds": []}]}'
+        self.assertEqual({}, self.__jenkins.failing_jobs_url())
+
     def test_ignore_disable_job(self):
         """ Test that disabled failing jobs are ignored. """
         self.__jenkins.contents = '{"jobs": [{"name": "job1", "color": "red", "description": "", ' \
-                                  '"url": "http://url", "buildable": False}], "builds": [{}]}'
+                                  '"url": "http://url", "buildable": false, "builds": [{}]}]}'
         self.assertEqual({}, self.__jenkins.failing_jobs_url())
 
     def test_ignore_pipeline_job(self):
         """ Test that pipleine jobs without buildable flag are ignored. """
         self.__jenkins.contents = '{"jobs": [{"name": "job1", "color": "red", "description": "", ' \
-                                  '"url": "http://url"}], "builds": [{}]}'
+                                  '"url": "http://url", "builds": [{}]}]}'
         self.assertEqual({}, self.__jenkins.failing_jobs_url())
 
     def test_failing_jobs_url(self):
         """ Test that the failing jobs url dictionary contains the url for the failing job. """
         timestamp = to_jenkins_timestamp(datetime.datetime.utcnow() - datetime.timedelta(days=100))
         self.__jenkins.contents = '{{"jobs": [{{"name": "job1", "color": "red", "description": "", ' \
-                                  '"url": "http://url", "buildable": True}}], "timestamp": "{}", ' \
-                                  '"builds": [{{}}]}}'.format(timestamp)
+                                  '"url": "http://url", "buildable": true, "lastStableBuild": {{"timestamp": "{}"}}, ' \
+                                  '"builds": [{{}}]}}]}}'.format(timestamp)
         self.assertEqual({'job1 (100 dagen)': 'http://url'}, self.__jenkins.failing_jobs_url())
 
     def test_failing_jobs_url_no_description(self):
@@ -90,13 +117,28 @@ class JenkinsTest(unittest.TestCase):
         jan_first = now.replace(month=1, day=1, hour=0, minute=0, second=0)
         if now.month == now.day == 1:  # pragma: no branch
             jan_first = jan_first.replace(year=jan_first.year - 1)  # pragma: no cover
-        self.__jenkins.contents = '{{"jobs": [{{"name": "job1", "color": "red", "description": None, ' \
-                                  '"url": "http://url", "buildable":  True}}], "timestamp": "{}", ' \
-                                  '"builds": [{{}}]}}'.format(to_jenkins_timestamp(jan_first))
+        self.__jenkins.contents = '{{"jobs": [{{"name": "job1", "color": "red", "description": null, ' \
+                                  '"url": "http://url", "buildable":  true, ' \
+                                  '"lastStableBuild": {{"timestamp": "{}"}}, "builds": [{{}}]}}]}}'.format(
+                                      to_jenkins_timestamp(jan_first))
         expected_days_ago = (datetime.datetime.utcnow() - jan_first).days
         self.assertEqual({'job1 ({0:d} dagen)'.format(expected_days_ago): 'http://url'},
                          self.__jenkins.failing_jobs_url())
 
+    def test_one_request(self):
+        """ Test that the failing and unused jobs of all jobs are determined with one request. """
+        urls_read = []
+        url_read = self.__jenkins.url_read
+        self.__jenkins.url_read = lambda url: urls_read.append(url) or url_read(url)
+        self.__jenkins.contents = '{"jobs": [{"name": "job1", "color": "red", "description": "", ' \
+                                  '"url": "http://url1", "buildable": true, "builds": [{}]}, ' \
+                                  '{"name": "job2", "color": "blue", "description": "", ' \
+                                  '"url": "http://url2", "buildable": true, "builds": [{}]}]}'
+        self.__jenkins.failing_jobs_url()
+        self.__jenkins.unused_jobs_url()
+        self.assertEqual(['http://jenkins/api/json?tree=jobs[name,description,color,url,buildable,'
+                          'lastCompletedBuild[timestamp],lastStableBuild[timestamp],builds[number]{0,1}]'], urls_read)
+
     def test_no_unused_jobs(self):
         """ Test the number of unused jobs when there are no unused jobs. """
         self.assertEqual({}, self.__jenkins.unused_jobs_url())
@@ -105,27 +147,36 @@ class JenkinsTest(unittest.TestCase):
         """ Test the unused jobs with one unused job. """
         date_time = datetime.datetime(2000, 4, 1, 12, 0, 0)
         self.__jenkins.contents = '{{"jobs": [{{"name": "job1", "color": "red", "description": "", ' \
-                                  '"url": "http://url", "buildable": True}}], ' \
-                                  '"timestamp": "{}"}}'.format(to_jenkins_timestamp(date_time))
+                                  '"url": "http://url", "buildable": true, "lastCompletedBuild": ' \
+                                  '{{"timestamp": "{0}"}}, "lastStableBuild": {{"timestamp": "{0}"}}}}]}}'.format(
+                                      to_jenkins_timestamp(date_time))
         expected_days_ago = (datetime.datetime.utcnow() - date_time).days
         self.assertEqual({'job1 ({0:d} dagen)'.format(expected_days_ago): 'http://url'},
                          self.__jenkins.unused_jobs_url())
 
+    def test_unused_job_without_builds(self):
+        """ Test that a job that never completed a build is unused. """
+        self.__jenkins.contents = '{"jobs": [{"name": "job1", "color": "notbuilt", "description": "", ' \
+                                  '"url": "http://url", "buildable": true, "lastCompletedBuild": null, ' \
+                                  '"lastStableBuild": null, "builds": []}]}'
+        self.assertEqual({'job1 (? dagen)': 'http://url'}, self.__jenkins.unused_jobs_url())
+
     def test_unused_jobs_grace(self):
         """ Test the unused jobs with one unused job within grace time. """
         self.__jenkins.contents = '{{"jobs": [{{"name": "job1", "color": "red", "description": "[gracedays=400]", ' \
-                                  '"url": "http://url", "buildable": True}}], "timestamp": "{}", ' \
-                                  '"builds": [{{}}]}}'.format(to_jenkins_timestamp(datetime.datetime.utcnow() -
-                                                                                   datetime.timedelta(days=100)))
+                                  '"url": "http://url", "buildable": true, "lastCompletedBuild": ' \
+                                  '{{"timestamp": "{}"}}, "builds": [{{}}]}}]}}'.format(
+                                      to_jenkins_timestamp(datetime.datetime.utcnow() - datetime.timedelta(days=100)))
         self.assertEqual({}, self.__jenkins.unused_jobs_url())
 
     def test_unused_jobs_after_grace(self):
         """ Test the unused jobs with one unused job within grace time. """
         last_year = datetime.datetime.utcnow().year - 1
+        timestamp = to_jenkins_timestamp(datetime.datetime(last_year, 1, 1, 12, 0, 0))
         self.__jenkins.contents = '{{"jobs": [{{"name": "job1", "color": "red", "description": "[gracedays=200]", ' \
-                                  '"url": "http://url", "buildable": True}}], "timestamp": "{}", ' \
-                                  '"builds": [{{}}]}}'.format(to_jenkins_timestamp(datetime.datetime(last_year, 1, 1,
-                                                                                                     12, 0, 0)))
+                                  '"url": "http://url", "buildable": true, "lastCompletedBuild": ' \
+                                  '{{"timestamp": "{0}"}}, "lastStableBuild": {{"timestamp": "{0}"}}, ' \
+                                  '"builds": [{{}}]}}]}}'.format(timestamp)
         expected_days_ago = (datetime.datetime.utcnow() - datetime.datetime(last_year, 1, 1, 12, 0, 0)).days
         self.assertEqual({'job1 ({0:d} dagen)'.format(expected_days_ago): 'http://url'},
                          self.__jenkins.unused_jobs_url())
@@ -137,3 +188,54 @@ class JenkinsTest(unittest.TestCase):
     def test_nr_of_active_jobs_on_error(self):
         """ Test that the number of active jobs is -1 when an URL error is thrown. """
         self.assertEqual(-1, JenkinsUnderTest('http://raise').number_of_active_jobs())
+
+
+class JenkinsFolderTest(unittest.TestCase):
+    """ Unit tests for jobs in Jenkins folders and multibranch pipelines. """
+
+    def setUp(self):
+        JenkinsUnderTest._api.cache_clear()
+        self.__urls_read = []
+        self.__jenkins = JenkinsUnderTest('http://jenkins/', 'username', 'password', job_re='folder/',
+                                          folder_depth=2)
+        url_read = self.__jenkins.url_read
+        self.__jenkins.url_read = lambda url: self.__urls_read.append(url) or url_read(url)
+        self.__jenkins.contents = '{"jobs": [{"name": "folder", "jobs": [' \
+                                  '{"name": "job1", "color": "red", "description": "", "url": "http://job1", ' \
+                                  '"buildable": true, "lastStableBuild": null, "builds": [{}]}, ' \
+                                  '{"name": "pipeline", "jobs": [{"name": "master", "color": "red", ' \
+                                  '"description": "", "url": "http://master", "buildable": true, ' \
+                                  '"lastStableBuild": null, "builds": [{}]}]}]}, ' \
+                                  '{"name": "job2", "color": "red", "description": "", "url": "http://job2", ' \
+                                  '"buildable": true, "lastStableBuild": null, "builds": [{}]}]}'
+
+    def test_nested_tree_query(self):
+        """ Test that the jobs in folders are retrieved with one nested query. """
+        fields = 'name,description,color,url,buildable,lastCompletedBuild[timestamp],lastStableBuild[timestamp],' \
+                 'builds[number]{0,1}'
+        self.__jenkins.number_of_active_jobs()
+        self.assertEqual(['http://jenkins/api/json?tree=jobs[{0},jobs[{0},jobs[{0}]]]'.format(fields)],
+                         self.__urls_read)
+
+    def test_nested_jobs(self):
+        """ Test that jobs in folders and multibranch pipelines are named after their folders. """
+        self.assertEqual(2, self.__jenkins.number_of_active_jobs())
+        self.assertEqual({'folder/job1 (? dagen)': 'http://job1', 'folder/pipeline/master (? dagen)': 'http://master'},
+                         self.__jenkins.failing_jobs_url())
+
+    def test_nested_job_url(self):
+        """ Test that the url of a nested job has a job path element for each folder. """
+        self.assertEqual('http://jenkins/job/folder/job/pipeline/job/master/',
+                         self.__jenkins._job_url('http://jenkins/job/{job}/', 'folder/pipeline/master'))
+
+    def test_nested_job_datetime(self):
+        """ Test that the build of a nested job is read from the url of the job in its folder. """
+        self.__jenkins.contents = '{"timestamp": 0}'
+        self.__jenkins._job_datetime(dict(name='folder/job1'), self.__jenkins._last_stable_build_url)
+        self.assertEqual(['http://jenkins/job/folder/job/job1/lastStableBuild/api/json'], self.__urls_read)
+
+    def test_folders_without_jobs(self):
+        """ Test that folders at the maximum depth are not counted as jobs. """
+        self.__jenkins.contents = '{"jobs": [{"name": "folder", "jobs": [{"name": "subfolder"}]}]}'
+        self.assertEqual(0, self.__jenkins.number_of_active_jobs())
+        self.assertEqual({}, self.__jenkins.failing_jobs_url())
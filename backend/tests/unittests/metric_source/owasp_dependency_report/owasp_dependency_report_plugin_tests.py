@@ -194,6 +194,25 @@ class JenkinsOWASPDependencyReportTest(unittest.TestCase):
         self.assertEqual(['http://jenkins/job/job_name/lastSuccessfulBuild/dependency-check-jenkins-pluginResult/'],
                          self.__jenkins.metric_source_urls('job_name'))
 
+    def test_url_of_nested_job(self):
+        """ Test the url for a OWASP dependency report of a job in a folder. """
+        self.assertEqual(['http://jenkins/job/folder/job/job_name/lastSuccessfulBuild/'
+                          'dependency-check-jenkins-pluginResult/'],
+                         self.__jenkins.metric_source_urls('folder/job_name'))
+
+    def test_prefetch_urls(self):
+        """ Test that the pages listing the vulnerable files are prefetched, and not the jobs API. """
+        report = 'lastSuccessfulBuild/dependency-check-jenkins-pluginResult/tab.files/'
+        self.assertEqual(['http://jenkins/job/job1/' + report, 'http://jenkins/job/job2/' + report],
+                         self.__jenkins.prefetch_urls('job1', 'job2'))
+
+    def test_prefetched_page_is_used(self):
+        """ Test that the warnings are counted from the page read with url_read, which caches prefetched pages. """
+        urls_read = []
+        self.__jenkins.url_read = lambda url, encoding='': urls_read.append(url) or self.html
+        self.assertEqual(3, self.__jenkins.nr_warnings(('job',), 'high'))
+        self.assertEqual(self.__jenkins.prefetch_urls('job'), urls_read)
+
     def test_http_error(self):
         """ Test that the default is returned when a HTTP error occurs. """
         self.__jenkins.contents = 'raise'
@@ -201,4 +220,4 @@ class JenkinsOWASPDependencyReportTest(unittest.TestCase):
 
     def test_datetime(self):
         """ Test that the age of the job is returned. """
-        self.assertEqual(datetime.datetime.min, self.__jenkins.datetime(('job',)))
+        self.assertEqual(datetime.datetime.min, self.__jenkins.datetime('job'))
@@ -0,0 +1,89 @@
+"""
+Copyright 2012-2017 Ministerie van Sociale Zaken en Werkgelegenheid
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import unittest
+
+from hqlib.metric_source import ResponseCache
+
+
+class ResponseCacheTest(unittest.TestCase):
+    """ Unit tests for the on-disk response cache. """
+
+    def setUp(self):
+        self.__time = 1000
+        self.__cache = ResponseCache(':memory:', max_size=10, default_ttl=60, clock=lambda: self.__time)
+
+    def test_missing(self):
+        """ Test that a response that wasn't stored can't be looked up. """
+        self.assertEqual(None, self.__cache.lookup('key'))
+
+    def test_store(self):
+        """ Test that a stored response can be looked up, including its validators. """
+        self.__cache.store('key', b'body', etag='"1"', last_modified='Mon, 01 Jan 2018 00:00:00 GMT')
+        response = self.__cache.lookup('key')
+        self.assertEqual((b'body', '"1"', 'Mon, 01 Jan 2018 00:00:00 GMT'), response[:3])
+
+    def test_key_includes_credentials(self):
+        """ Test that responses retrieved with different credentials have different keys. """
+        self.assertNotEqual(ResponseCache.key('http://url', 'user1', 'pass'), ResponseCache.key('http://url', 'user2'))
+
+    def test_fresh(self):
+        """ Test that a response is fresh within the time to live. """
+        self.__cache.store('key', b'body')
+        self.__time += 59
+        self.assertTrue(self.__cache.is_fresh(self.__cache.lookup('key')))
+
+    def test_stale(self):
+        """ Test that a response is stale after the time to live. """
+        self.__cache.store('key', b'body')
+        self.__time += 60
+        self.assertFalse(self.__cache.is_fresh(self.__cache.lookup('key')))
+
+    def test_ttl_override(self):
+        """ Test that the default time to live can be overridden, e.g. per metric source. """
+        self.__cache.store('key', b'body')
+        self.__time += 100
+        self.assertTrue(self.__cache.is_fresh(self.__cache.lookup('key'), ttl=3600))
+
+    def test_revalidated(self):
+        """ Test that a revalidated response is fresh again. """
+        self.__cache.store('key', b'body')
+        self.__time += 100
+        self.__cache.revalidated('key')
+        self.assertTrue(self.__cache.is_fresh(self.__cache.lookup('key')))
+
+    def test_evict_least_recently_used(self):
+        """ Test that the least recently used responses are evicted when the cache is too big. """
+        self.__cache.store('key1', b'1234')
+        self.__time += 1
+        self.__cache.store('key2', b'1234')
+        self.__time += 1
+        self.__cache.lookup('key1')
+        self.__time += 1
+        self.__cache.store('key3', b'1234')
+        self.assertEqual(None, self.__cache.lookup('key2'))
+        self.assertNotEqual(None, self.__cache.lookup('key1'))
+        self.assertEqual(8, self.__cache.size())
+
+    def test_json(self):
+        """ Test that JSON-serializable values can be stored. """
+        cache = ResponseCache(':memory:')
+        cache.store_json('key', dict(measures=dict(ncloc=100.0)))
+        self.assertEqual(dict(measures=dict(ncloc=100.0)), cache.lookup_json('key'))
+
+    def test_missing_json(self):
+        """ Test that a JSON value that wasn't stored can't be looked up. """
+        self.assertEqual(None, self.__cache.lookup_json('key'))
@@ -0,0 +1,78 @@
+"""
+Copyright 2012-2017 Ministerie van Sociale Zaken en Werkgelegenheid
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import concurrent.futures
+import threading
+import unittest
+
+from hqlib.metric_source import SingleFlight
+
+
+class SingleFlightTest(unittest.TestCase):
+    """ Unit tests for the single flight class. """
+
+    def setUp(self):
+        self.__single_flight = SingleFlight()
+        self.__release = threading.Event()
+        self.__calls = []
+
+    def __slow_call(self, result):
+        """ Return the result once the test releases the call. """
+        self.__calls.append(result)
+        self.__release.wait(5)
+        return result
+
+    def __run_concurrently(self, nr_callers, function):
+        """ Start the callers, release the call when all but the first are waiting and return the outcomes. """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=nr_callers) as executor:
+            futures = [executor.submit(self.__single_flight.call, 'key', function) for _ in range(nr_callers)]
+            while self.__single_flight.statistics()['coalesced'] < nr_callers - 1:
+                threading.Event().wait(0.001)
+            self.__release.set()
+            return [future.exception() or future.result() for future in futures]
+
+    def test_call(self):
+        """ Test that the result of the function is returned. """
+        self.assertEqual('result', self.__single_flight.call('key', lambda: 'result'))
+        self.assertEqual(dict(flights=1, coalesced=0), self.__single_flight.statistics())
+
+    def test_sequential_calls(self):
+        """ Test that calls that don't overlap are all executed. """
+        self.__single_flight.call('key', lambda: 'result')
+        self.__single_flight.call('key', lambda: 'result')
+        self.assertEqual(dict(flights=2, coalesced=0), self.__single_flight.statistics())
+
+    def test_concurrent_calls(self):
+        """ Test that concurrent calls for the same key are executed once and share the result. """
+        self.assertEqual(['result'] * 4, self.__run_concurrently(4, lambda: self.__slow_call('result')))
+        self.assertEqual(['result'], self.__calls)
+        self.assertEqual(dict(flights=1, coalesced=3), self.__single_flight.statistics())
+
+    def test_concurrent_exception(self):
+        """ Test that concurrent calls share the exception. """
+        def failing_call():
+            """ Raise an exception once the test releases the call. """
+            self.__slow_call(None)
+            raise ValueError('failure')
+
+        outcomes = self.__run_concurrently(3, failing_call)
+        self.assertTrue(all(isinstance(outcome, ValueError) for outcome in outcomes))
+        self.assertEqual([None], self.__calls)
+
+    def test_different_keys(self):
+        """ Test that calls for different keys are not coalesced. """
+        self.__single_flight.call('key1', lambda: self.__single_flight.call('key2', lambda: 'result'))
+        self.assertEqual(dict(flights=2, coalesced=0), self.__single_flight.statistics())
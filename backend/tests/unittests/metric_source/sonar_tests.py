@@ -15,20 +15,30 @@ limitations under the License.
 """
 
 import datetime
+import io
 import unittest
 import urllib.error
 
-from hqlib.metric_source import Sonar
+from hqlib.metric_source import Sonar, ResponseCache
 
 
 class SonarUnderTest(Sonar):  # pylint: disable=too-few-public-methods
     """ Override the url open method to be able to return test data. """
 
-    sonar_version = '5.6'
+    sonar_version = '6.3'
 
     api_components_show_json = '{"component": {"analysisDate": "2017-04-07T16:27:27+0000"}}'
 
-    project_json = """[{"k": "product"}]"""
+    project_json = """[{"k": "product", "qu": "TRK"}]"""
+
+    violations_by_rule_json = None
+
+    metrics_search_json = '{{"metrics": [{0}], "total": {1}}}'.format(
+        ', '.join('{{"key": "{0}"}}'.format(key) for key in Sonar.metric_keys), len(Sonar.metric_keys))
+
+    measures_search_json = """{"measures": [
+        {"metric": "ncloc", "value": "200", "component": "product"},
+        {"metric": "lines", "value": "300", "component": "product"}]}"""
 
     json = violations_json = """
 [
@@ -251,6 +261,12 @@ class SonarUnderTest(Sonar):  # pylint: disable=too-few-public-methods
                 return '{"analyses": []}'
             else:
                 return '{"analyses": [{"events": [{"name": "4.2"}], "date": "2016-04-07T16:27:27+0000"}]}'
+        if 'facets=rules' in url and self.violations_by_rule_json:
+            return self.violations_by_rule_json
+        if 'measures/search' in url:
+            return self.measures_search_json
+        if 'metrics/search' in url:
+            return self.metrics_search_json
         if 'projects/index' in url:
             json = self.project_json
         elif 'metricKeys' in url:
@@ -267,6 +283,11 @@ class SonarTestCase(unittest.TestCase):
     def setUp(self):
         SonarUnderTest._Sonar__get_json.cache_clear()
         SonarUnderTest._Sonar__metric.cache_clear()
+        SonarUnderTest._Sonar__measures.cache_clear()
+        SonarUnderTest._Sonar__violations_by_rule.cache_clear()
+        SonarUnderTest._Sonar__server_version.cache_clear()
+        SonarUnderTest._Sonar__analysis_date.cache_clear()
+        SonarUnderTest._Sonar__metric_keys.cache_clear()
         self._sonar = SonarUnderTest('http://sonar/')
 
 
@@ -286,6 +307,24 @@ class SonarTest(SonarTestCase):
         self.assertEqual('http://sonar/issues/search#resolved=false|componentRoots=product',
                          self._sonar.violations_url('product'))
 
+    def test_prefetch(self):
+        """ Test that prefetching reads the url. """
+        urls_read = []
+        self._sonar.url_read = urls_read.append
+        self._sonar.prefetch('http://sonar/api/projects/index?subprojects=true')
+        self.assertEqual(['http://sonar/api/projects/index?subprojects=true'], urls_read)
+
+    def test_prefetch_urls(self):
+        """ Test that the urls to prefetch include the projects and the measures of the product. """
+        urls = self._sonar.prefetch_urls('product')
+        self.assertTrue('http://sonar/api/projects/index?subprojects=true' in urls)
+        self.assertTrue('http://sonar/api/issues/search?componentRoots=product&resolved=false&rules={0}&facets=rules&'
+                        'ps=1'.format(','.join(Sonar.rule_keys)) in urls)
+        self.assertTrue('http://sonar/api/measures/component?componentKey=product&metricKeys=ncloc,lines,'
+                        'major_violations,critical_violations,blocker_violations,duplicated_lines,line_coverage,'
+                        'branch_coverage,tests,test_failures,test_errors,it_line_coverage,it_branch_coverage,'
+                        'overall_line_coverage,overall_branch_coverage,functions' in urls)
+
     def test_version(self):
         """ Test that the version of a product is equal to the version returned by the dashboard of that product. """
         self.assertEqual('4.2', self._sonar.version('product'))
@@ -332,6 +371,28 @@ class SonarTest(SonarTestCase):
         self._sonar.json = """{"paging": {"total": 0}}"""
         self.assertEqual(0, self._sonar.commented_loc('product'))
 
+    def test_violations_by_rule(self):
+        """ Test that the number of violations per rule is retrieved with one request. """
+        self._sonar.violations_by_rule_json = """{"total": 45, "facets": [{"property": "rules", "values": [
+            {"val": "squid:MethodCyclomaticComplexity", "count": 20},
+            {"val": "squid:S138", "count": 15},
+            {"val": "squid:NoSonar", "count": 10}]}]}"""
+        urls_read = []
+        url_read = self._sonar.url_read
+        self._sonar.url_read = lambda url: urls_read.append(url) or url_read(url)
+        self.assertEqual(20, self._sonar.complex_methods('product'))
+        self.assertEqual(15, self._sonar.long_methods('product'))
+        self.assertEqual(0, self._sonar.many_parameters_methods('product'))
+        self.assertEqual(10, self._sonar.no_sonar('product'))
+        self.assertEqual(1, len([url for url in urls_read if 'issues/search' in url]))
+
+    def test_violations_by_rule_order(self):
+        """ Test that the rules are tried in order when counting violations per rule. """
+        self._sonar.violations_by_rule_json = """{"facets": [{"property": "rules", "values": [
+            {"val": "squid:MethodCyclomaticComplexity", "count": 20},
+            {"val": "pmd:CyclomaticComplexity", "count": 5}]}]}"""
+        self.assertEqual(5, self._sonar.complex_methods('product'))
+
     def test_long_methods(self):
         """ Test that the number of long methods equals the number of long methods returned by the violations page. """
         self._sonar.json = """{"paging": {"total": 50}}"""
@@ -348,6 +409,109 @@ class SonarTest(SonarTestCase):
         self._sonar.json = """{"paging": {"total": 0}}"""
         self.assertEqual(0, self._sonar.many_parameters_methods('product'))
 
+    def test_one_measures_request_per_product(self):
+        """ Test that the measures of all metrics of a product are retrieved with one request. """
+        urls_read = []
+        url_read = self._sonar.url_read
+        self._sonar.url_read = lambda url: urls_read.append(url) or url_read(url)
+        self._sonar.ncloc('product')
+        self._sonar.lines('product')
+        self._sonar.failing_unittests('product')
+        self.assertEqual(1, len([url for url in urls_read if 'metricKeys' in url]))
+
+    def test_measure_per_metric_if_batch_fails(self):
+        """ Test that the measure of a metric is retrieved separately if Sonar can't return all measures at once. """
+        url_read = self._sonar.url_read
+
+        def url_read_without_batch(url):
+            """ Fail if the url asks for multiple metrics. """
+            if 'metricKeys=ncloc,' in url:
+                raise urllib.error.HTTPError(url, 404, 'Not found', None, None)
+            return url_read(url)
+
+        self._sonar.url_read = url_read_without_batch
+        self.assertEqual(100, self._sonar.ncloc('product'))
+
+    def test_unknown_metric_keys(self):
+        """ Test that metrics the Sonar server doesn't have are not asked for, because Sonar would reject the request
+            for all measures. """
+        self._sonar.metrics_search_json = '{"metrics": [{"key": "ncloc"}, {"key": "lines"}], "total": 2}'
+        urls_read = []
+        url_read = self._sonar.url_read
+
+        def url_read_rejecting_unknown_keys(url):
+            """ Fail if the url asks for a metric that Sonar doesn't have. """
+            urls_read.append(url)
+            if 'it_line_coverage' in url:
+                raise urllib.error.HTTPError(url, 404, 'Metric not found', None, None)
+            return url_read(url)
+
+        self._sonar.url_read = url_read_rejecting_unknown_keys
+        self.assertEqual(100, self._sonar.ncloc('product'))
+        self.assertEqual(100, self._sonar.lines('product'))
+        self.assertEqual(['http://sonar/api/measures/component?componentKey=product&metricKeys=ncloc,lines'],
+                         [url for url in urls_read if 'metricKeys' in url])
+
+    def test_metric_keys_paged(self):
+        """ Test that all pages of metrics are read to find the metrics that Sonar has. """
+        self._sonar.metrics_page_size = 1
+        pages = dict(p1='{"metrics": [{"key": "ncloc"}], "total": 2}', p2='{"metrics": [{"key": "lines"}], "total": 2}')
+        url_read = self._sonar.url_read
+        self._sonar.url_read = lambda url: pages[url.split('&')[-1].replace('=', '')] if 'metrics/search' in url \
+            else url_read(url)
+        self.assertEqual(['ncloc', 'lines'], [url for url in self._sonar.prefetch_urls('product')
+                                              if 'metricKeys' in url][0].split('metricKeys=')[1].split(','))
+
+    def test_all_metric_keys_if_metrics_unknown(self):
+        """ Test that all metrics are asked for if Sonar doesn't return its metrics. """
+        self._sonar.metrics_search_json = '{}'
+        self.assertEqual(list(Sonar.metric_keys), [url for url in self._sonar.prefetch_urls('product')
+                                                   if 'metricKeys' in url][0].split('metricKeys=')[1].split(','))
+
+    def test_bulk_prefetch(self):
+        """ Test that the measures of multiple projects can be retrieved at once. """
+        urls_read = []
+        url_read = self._sonar.url_read
+        self._sonar.url_read = lambda url: urls_read.append(url) or url_read(url)
+        self._sonar.bulk_prefetch('product', 'missing')
+        self.assertEqual(200, self._sonar.ncloc('product'))
+        self.assertEqual(-1, self._sonar.methods('product'))
+        self.assertEqual(['http://sonar/api/measures/search?projectKeys=product&metricKeys={0}'.format(
+            ','.join(Sonar.metric_keys))], [url for url in urls_read if 'measures' in url])
+
+    def test_bulk_prefetch_chunks(self):
+        """ Test that the projects are divided over multiple requests to limit the length of the urls. """
+        self._sonar.project_json = '[{"k": "product1", "qu": "TRK"}, {"k": "product2", "qu": "TRK"}, ' \
+                                   '{"k": "product3", "qu": "TRK"}]'
+        self._sonar.max_url_length = 320
+        urls_read = []
+        url_read = self._sonar.url_read
+        self._sonar.url_read = lambda url: urls_read.append(url) or url_read(url)
+        self._sonar.bulk_prefetch('product1', 'product2', 'product3')
+        self.assertEqual(['product1,product2', 'product3'],
+                         [url.split('projectKeys=')[1].split('&')[0] for url in urls_read if 'measures' in url])
+
+    def test_bulk_prefetch_skips_modules(self):
+        """ Test that modules are not passed to the measures search API, because Sonar may reject the request. """
+        self._sonar.project_json = '[{"k": "product", "qu": "TRK"}, {"k": "product:module", "qu": "BRC"}]'
+        urls_read = []
+        url_read = self._sonar.url_read
+        self._sonar.url_read = lambda url: urls_read.append(url) or url_read(url)
+        self._sonar.bulk_prefetch('product', 'product:module')
+        self.assertEqual(['product'],
+                         [url.split('projectKeys=')[1].split('&')[0] for url in urls_read if 'measures/search' in url])
+
+    def test_bulk_prefetch_not_supported(self):
+        """ Test that the measures of multiple projects aren't retrieved at once if Sonar is too old. """
+        self._sonar.sonar_version = '5.6'
+        self._sonar.bulk_prefetch('product')
+        self.assertEqual(100, self._sonar.ncloc('product'))
+
+    def test_prefetch_urls_after_bulk_prefetch(self):
+        """ Test that the measures of a product aren't prefetched again after the bulk prefetch. """
+        self._sonar.bulk_prefetch('product')
+        self.assertFalse([url for url in self._sonar.prefetch_urls('product') if 'measures' in url])
+
     def test_missing_metric_value(self):
         """ Test that -1 is returned for missing values. """
         self._sonar.metrics_json = '{"component": {"measures":[]}}'
@@ -477,17 +641,205 @@ class SonarSuppressionTest(SonarTestCase):
         """ Test that the number of false positives is zero. """
         self._sonar.false_positives_json = """
         {
+            "paging": {"pageIndex": 1, "pageSize": 1, "total": 0},
             "issues": []
         }"""
         self.assertEqual(0, self._sonar.false_positives('product'))
 
+    def test_false_positives_more_than_one_page(self):
+        """ Test that the number of false positives is read from the paging information, not counted. """
+        self._sonar.false_positives_json = """{"paging": {"total": 1234}, "issues": [{"key": "issue"}]}"""
+        self.assertEqual(1234, self._sonar.false_positives('product'))
+
+    def test_false_positives_total_outside_paging(self):
+        """ Test that the number of false positives is read from the total if there is no paging information. """
+        self._sonar.false_positives_json = """{"total": 12, "issues": []}"""
+        self.assertEqual(12, self._sonar.false_positives('product'))
+
+    def test_false_positives_without_total(self):
+        """ Test that the number of false positives is the default if the response has no total. """
+        self._sonar.false_positives_json = """{"issues": []}"""
+        self.assertEqual(0, self._sonar.false_positives('product'))
+
+    def test_counting_requests_one_issue(self):
+        """ Test that counting issues asks for one issue per page, so that no issue lists are downloaded. """
+        urls_read = []
+        url_read = self._sonar.url_read
+        self._sonar.url_read = lambda url: urls_read.append(url) or url_read(url)
+        self._sonar.json = """{"paging": {"total": 10}}"""
+        self._sonar.no_sonar('product')
+        self._sonar.false_positives('product')
+        issue_urls = [url for url in urls_read if 'issues/search' in url]
+        self.assertTrue(issue_urls)
+        self.assertTrue(all(url.endswith('&ps=1') for url in issue_urls))
+
+
+class SonarIssuesTest(SonarTestCase):
+    """ Unit tests for iterating over Sonar issues. """
+
+    def setUp(self):
+        super().setUp()
+        self.__urls_opened = []
+        self.__pages = dict()
+        self._sonar.url_open = self.__url_open
+
+    def __url_open(self, url):
+        """ Return the page of issues for the url. """
+        self.__urls_opened.append(url)
+        if url not in self.__pages:
+            raise urllib.error.URLError('not found')
+        return io.BytesIO(self.__pages[url].encode('utf-8'))
+
+    def test_pages(self):
+        """ Test that the issues are retrieved one page at a time until all issues are retrieved. """
+        url = 'http://sonar/api/issues/search?componentRoots=product&resolutions=FALSE-POSITIVE&ps=2&p={0}'
+        self.__pages[url.format(1)] = '{"paging": {"total": 3}, "issues": [{"key": "1"}, {"key": "2"}]}'
+        self.__pages[url.format(2)] = '{"paging": {"total": 3}, "issues": [{"key": "3"}]}'
+        issues = self._sonar.issues('product', page_size=2, resolutions='FALSE-POSITIVE')
+        self.assertEqual({"key": "1"}, next(issues))
+        self.assertEqual([url.format(1)], self.__urls_opened)
+        self.assertEqual([{"key": "2"}, {"key": "3"}], list(issues))
+        self.assertEqual([url.format(1), url.format(2)], self.__urls_opened)
+
+    def test_no_issues(self):
+        """ Test that there are no issues if the first page is empty. """
+        self.__pages['http://sonar/api/issues/search?componentRoots=product&ps=500&p=1'] = \
+            '{"paging": {"total": 0}, "issues": []}'
+        self.assertEqual([], list(self._sonar.issues('product')))
+
+    def test_max_issues(self):
+        """ Test that the issues beyond the maximum number of issues Sonar returns are not requested. """
+        self._sonar.max_issues = 2
+        url = 'http://sonar/api/issues/search?componentRoots=product&ps=2&p={0}'
+        self.__pages[url.format(1)] = '{"paging": {"total": 3}, "issues": [{"key": "1"}, {"key": "2"}]}'
+        self.assertEqual(2, len(list(self._sonar.issues('product', page_size=2))))
+        self.assertEqual([url.format(1)], self.__urls_opened)
+
+    def test_http_error(self):
+        """ Test that the iteration stops when a page can't be retrieved. """
+        self.assertEqual([], list(self._sonar.issues('product')))
+
+    def test_invalid_page(self):
+        """ Test that the iteration stops when a page has no issues. """
+        self.__pages['http://sonar/api/issues/search?componentRoots=product&ps=500&p=1'] = '{"errors": []}'
+        self.assertEqual([], list(self._sonar.issues('product')))
+
+
+class SonarSnapshotTest(SonarTestCase):
+    """ Unit tests for reusing Sonar data until the next analysis. """
+
+    def setUp(self):
+        super().setUp()
+        self.__cache = ResponseCache(':memory:')
+        self.__urls_read = []
+
+    def __sonar(self, analysis_date='2017-04-07T16:27:27+0000'):
+        """ Return a Sonar instance with the response cache that records the urls it reads. """
+        for cached_method in (SonarUnderTest._Sonar__get_json, SonarUnderTest._Sonar__metric,
+                              SonarUnderTest._Sonar__measures, SonarUnderTest._Sonar__violations_by_rule,
+                              SonarUnderTest._Sonar__analysis_date):
+            cached_method.cache_clear()
+        sonar = SonarUnderTest('http://sonar/', response_cache=self.__cache)
+        sonar.sonar_version = '6.4'
+        sonar.api_components_show_json = '{"component": {"analysisDate": "%s"}}' % analysis_date
+        sonar.violations_by_rule_json = '{"facets": [{"property": "rules", "values": [{"val": "squid:S138", ' \
+                                        '"count": 15}]}]}'
+        url_read = sonar.url_read
+        sonar.url_read = lambda url: self.__urls_read.append(url) or url_read(url)
+        return sonar
+
+    def __measure(self, sonar):
+        """ Retrieve measures, rule violations and false positives and return the Sonar urls read. """
+        del self.__urls_read[:]
+        self.assertEqual((100, 15, 8), (sonar.ncloc('product'), sonar.long_methods('product'),
+                                        sonar.false_positives('product')))
+        return [url for url in self.__urls_read if 'measures' in url or 'issues' in url]
+
+    def test_reuse(self):
+        """ Test that the stored data is reused if the product wasn't analysed again. """
+        self.assertEqual(3, len(self.__measure(self.__sonar())))
+        self.assertEqual([], self.__measure(self.__sonar()))
+
+    def test_new_analysis(self):
+        """ Test that the data is retrieved again if the product was analysed again. """
+        self.__measure(self.__sonar())
+        self.assertEqual(3, len(self.__measure(self.__sonar(analysis_date='2017-04-08T16:27:27+0000'))))
+
+    def test_invalid_measures_not_stored(self):
+        """ Test that measures that couldn't be parsed are not stored, but retrieved again. """
+        sonar = self.__sonar()
+        sonar.metrics_json = '{"component": {}}'
+        sonar.ncloc('product')
+        sonar = self.__sonar()
+        del self.__urls_read[:]
+        sonar.ncloc('product')
+        self.assertEqual(1, len([url for url in self.__urls_read if 'api/measures' in url]))
+
+    def test_prefetch_analysis_date_only(self):
+        """ Test that only the analysis date is prefetched when stored data can be reused. """
+        self.__measure(self.__sonar())
+        self.assertEqual(['http://sonar/api/projects/index?subprojects=true',
+                          'http://sonar/api/components/show?component=product'],
+                         self.__sonar().prefetch_urls('product'))
+
+    def test_prefetch_without_stored_data(self):
+        """ Test that the measures and violations are prefetched when there's no stored data for the analysis. """
+        self.__measure(self.__sonar())
+        urls = self.__sonar(analysis_date='2017-04-08T16:27:27+0000').prefetch_urls('product')
+        self.assertEqual(4, len(urls))
+        self.assertTrue([url for url in urls if 'api/measures/component' in url])
+        self.assertTrue([url for url in urls if 'facets=rules' in url])
+
+    def test_bulk_prefetch_analysis_dates(self):
+        """ Test that the analysis dates are retrieved when prefetching in bulk. """
+        sonar = self.__sonar()
+        sonar.bulk_prefetch('product', 'other')
+        self.assertTrue({'http://sonar/api/components/show?component=product',
+                         'http://sonar/api/components/show?component=other'} <= set(self.__urls_read))
+
 
 class SonarVersionsTest(SonarTestCase):
     """ Unit tests for Sonar meta data. """
 
     def test_version_number(self):
         """ Test that the version number is correct. """
-        self.assertEqual('5.6', self._sonar.version_number())
+        self.assertEqual('6.3', self._sonar.version_number())
+
+    def test_old_sonar_uses_old_api(self):
+        """ Test that the new API isn't tried if the Sonar server is too old to support it. """
+        self._sonar.sonar_version = '5.6'
+        self._sonar.json = '[{"version": "1.0"}]'
+        urls_read = []
+        url_read = self._sonar.url_read
+        self._sonar.url_read = lambda url: urls_read.append(url) or url_read(url)
+        self.assertEqual('1.0', self._sonar.version('product'))
+        self.assertFalse([url for url in urls_read if 'analyses' in url])
+
+    def test_new_sonar_does_not_use_old_api(self):
+        """ Test that the old API isn't tried if the Sonar server is too new to still support it. """
+        urls_read = []
+        url_read = self._sonar.url_read
+        self._sonar.url_read = lambda url: urls_read.append(url) or url_read(url)
+        self.assertEqual('?', self._sonar.version('raise'))
+        self.assertFalse([url for url in urls_read if 'api/resources' in url])
+
+    def test_unknown_version_tries_both_apis(self):
+        """ Test that both the new and the old API are tried if the version of the Sonar server is unknown. """
+        self._sonar.sonar_version = None
+        urls_read = []
+        url_read = self._sonar.url_read
+        self._sonar.url_read = lambda url: urls_read.append(url) or url_read(url)
+        self._sonar.version('raise')
+        self.assertTrue([url for url in urls_read if 'analyses' in url])
+        self.assertTrue([url for url in urls_read if 'api/resources' in url])
+
+    def test_server_version_cached(self):
+        """ Test that the version of the Sonar server is kept in the response cache. """
+        cache = ResponseCache(':memory:')
+        self.assertEqual('6.3', SonarUnderTest('http://sonar/', response_cache=cache).version_number())
+        sonar = SonarUnderTest('http://sonar/', response_cache=cache)
+        sonar.sonar_version = '6.4'
+        self.assertEqual('6.3', sonar.version_number())
 
     def test_plugin_version(self):
         """ Test that the plugins can be retrieved. """
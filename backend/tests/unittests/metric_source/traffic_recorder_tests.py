@@ -0,0 +1,105 @@
+"""
+Copyright 2012-2017 Ministerie van Sociale Zaken en Werkgelegenheid
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import io
+import subprocess
+import tempfile
+import unittest
+import urllib.error
+
+from hqlib.metric_source import TrafficRecorder
+
+
+class TrafficRecorderTest(unittest.TestCase):
+    """ Unit tests for the traffic recorder. """
+
+    def setUp(self):
+        self.__folder = tempfile.TemporaryDirectory()
+        self.__recorder = TrafficRecorder(self.__folder.name, clock=iter([0, 2.5, 10, 12.5]).__next__)
+        self.__sleeps = []
+        self.__replayer = TrafficRecorder(self.__folder.name, replay=True, sleep=self.__sleeps.append)
+
+    def tearDown(self):
+        self.__folder.cleanup()
+
+    def test_record_and_replay(self):
+        """ Test that a recorded result is replayed. """
+        self.assertEqual(dict(key='value'), self.__recorder.call('request', lambda: dict(key='value')))
+        self.assertEqual(dict(key='value'), self.__replayer.call('request', lambda: self.fail('Not replayed')))
+
+    def test_replay_missing(self):
+        """ Test that replaying a request that wasn't recorded raises an URL error. """
+        self.assertRaises(urllib.error.URLError, self.__replayer.call, 'request', lambda: None)
+
+    def test_requests_are_distinguished(self):
+        """ Test that each request has its own recording. """
+        self.__recorder.call('request 1', lambda: 1)
+        self.__recorder.call('request 2', lambda: 2)
+        self.assertEqual(2, self.__replayer.call('request 2', lambda: None))
+
+    def test_url_open(self):
+        """ Test that the contents of an url are recorded and replayed as bytes. """
+        self.assertEqual(b'contents', self.__recorder.url_open('url', lambda: io.StringIO('contents')).read())
+        self.assertEqual(b'contents', self.__replayer.url_open('url', lambda: None).read())
+
+    def test_http_error(self):
+        """ Test that HTTP errors are recorded and replayed. """
+        def url_open():
+            """ Fake a missing url. """
+            raise urllib.error.HTTPError('http://url', 404, 'Not found', {}, None)
+
+        self.assertRaises(urllib.error.HTTPError, self.__recorder.url_open, 'url', url_open)
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self.__replayer.url_open('url', lambda: None)
+        self.assertEqual(404, context.exception.code)
+
+    def test_url_error(self):
+        """ Test that other url open exceptions are replayed as URL error. """
+        def url_open():
+            """ Fake a time out. """
+            raise TimeoutError('Timed out')
+
+        self.assertRaises(TimeoutError, self.__recorder.url_open, 'url', url_open)
+        self.assertRaises(urllib.error.URLError, self.__replayer.url_open, 'url', lambda: None)
+
+    def test_called_process_error(self):
+        """ Test that failing shell commands are recorded and replayed. """
+        def shell_command():
+            """ Fake a failing shell command. """
+            raise subprocess.CalledProcessError(1, ('git', 'log'), 'output')
+
+        self.assertRaises(subprocess.CalledProcessError, self.__recorder.call, 'command', shell_command)
+        self.assertRaises(subprocess.CalledProcessError, self.__replayer.call, 'command', lambda: None)
+
+    def test_latency_not_injected_by_default(self):
+        """ Test that recorded latency is not injected unless asked for. """
+        self.__recorder.call('request', lambda: None)
+        self.__replayer.call('request', lambda: None)
+        self.assertEqual([], self.__sleeps)
+
+    def test_inject_latency(self):
+        """ Test that the recorded latency can be injected when replaying. """
+        replayer = TrafficRecorder(self.__folder.name, replay=True, inject_latency=True, sleep=self.__sleeps.append)
+        self.__recorder.call('request', lambda: None)
+        self.__recorder.call('other request', lambda: None)
+        replayer.call('request', lambda: None)
+        replayer.call('other request', lambda: None)
+        self.assertEqual([2.5, 2.5], self.__sleeps)
+
+    def test_replaying(self):
+        """ Test that the recorder knows whether it replays. """
+        self.assertFalse(self.__recorder.replaying())
+        self.assertTrue(self.__replayer.replaying())
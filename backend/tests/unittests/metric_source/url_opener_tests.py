@@ -14,13 +14,16 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import email.message
 import unittest
 import urllib.request
 import urllib.error
+import urllib.response
 import io
-import sys
+import tempfile
+import threading
 
-from hqlib.metric_source import url_opener
+from hqlib.metric_source import url_opener, CircuitBreaker, ConnectionPool, ResponseCache, TrafficRecorder
 
 
 class FakeBuildOpener(object):  # pylint: disable=too-few-public-methods
@@ -32,7 +35,7 @@ class FakeBuildOpener(object):  # pylint: disable=too-few-public-methods
         pass
 
     @classmethod
-    def open(cls, *args):  # pylint: disable=unused-argument
+    def open(cls, *args, **kwargs):  # pylint: disable=unused-argument
         """ Fake opening a url and returning its contents. """
         if cls.raise_exception:
             raise cls.raise_exception(None, None, None, None, None)
@@ -40,6 +43,23 @@ class FakeBuildOpener(object):  # pylint: disable=too-few-public-methods
             return 'url contents'
 
 
+class FakeServer(object):
+    """ Fake a server that supports conditional requests. """
+    def __init__(self):
+        self.requests = []
+        self.etag = '"1"'
+
+    def open(self, request, **kwargs):  # pylint: disable=unused-argument
+        """ Return the response or raise a 304 HTTP error if the client has the current version. """
+        self.requests.append(request)
+        if request.get_header('If-none-match') == self.etag:
+            raise urllib.error.HTTPError(request.full_url, 304, 'Not Modified', {}, None)
+        headers = email.message.Message()
+        headers['ETag'] = self.etag
+        return urllib.response.addinfourl(io.BytesIO(b'contents ' + self.etag.encode()), headers,
+                                          request.full_url, 200)
+
+
 class UrlOpenerTest(unittest.TestCase):
     """ Unit tests for the URL opener class. """
 
@@ -64,6 +84,51 @@ class UrlOpenerTest(unittest.TestCase):
         opener = url_opener.UrlOpener(url_open=FakeBuildOpener.open)
         self.assertEqual('url contents', opener.url_open('http://bla'))
 
+    def test_connection_pool(self):
+        """ Test that the opener uses the handlers of the connection pool by default. """
+        handlers = []
+        pool = ConnectionPool()
+        opener = url_opener.UrlOpener(build_opener=lambda *args: handlers.extend(args) or FakeBuildOpener(),
+                                      connection_pool=pool)
+        self.assertEqual('url contents', opener.url_open('http://bla'))
+        self.assertEqual([type(handler) for handler in pool.handlers()], [type(handler) for handler in handlers])
+
+    def test_response_cache(self):
+        """ Test that responses are stored in the response cache and revalidated with a conditional request. """
+        server = FakeServer()
+        opener = url_opener.UrlOpener(url_open=server.open, response_cache=ResponseCache(':memory:'))
+        self.assertEqual(b'contents "1"', opener.url_open('http://bla').read())
+        self.assertEqual(b'contents "1"', opener.url_open('http://bla').read())
+        self.assertEqual('"1"', server.requests[-1].get_header('If-none-match'))
+
+    def test_response_cache_changed(self):
+        """ Test that changed responses replace the cached response. """
+        server = FakeServer()
+        opener = url_opener.UrlOpener(url_open=server.open, response_cache=ResponseCache(':memory:'))
+        opener.url_open('http://bla')
+        server.etag = '"2"'
+        self.assertEqual(b'contents "2"', opener.url_open('http://bla').read())
+
+    def test_response_cache_ttl(self):
+        """ Test that fresh responses are served from the cache without a request. """
+        server = FakeServer()
+        opener = url_opener.UrlOpener(url_open=server.open, response_cache=ResponseCache(':memory:'), cache_ttl=60)
+        opener.url_open('http://bla')
+        self.assertEqual(b'contents "1"', opener.url_open('http://bla').read())
+        self.assertEqual(1, len(server.requests))
+
+    def test_response_cache_ttl_per_source(self):
+        """ Test that metric sources can override the time to live of cached responses. """
+        class SlowlyChangingSource(url_opener.UrlOpener):  # pylint: disable=too-few-public-methods
+            """ Metric source whose responses change seldom. """
+            cache_ttl = 60
+
+        server = FakeServer()
+        opener = SlowlyChangingSource(url_open=server.open, response_cache=ResponseCache(':memory:'))
+        opener.url_open('http://bla')
+        opener.url_open('http://bla')
+        self.assertEqual(1, len(server.requests))
+
     def test_exception_while_opening(self):
         """ Test an exception during opening. """
         FakeBuildOpener.raise_exception = urllib.error.HTTPError
@@ -78,30 +143,151 @@ class UrlOpenerTest(unittest.TestCase):
         self.assertRaises(TimeoutError, opener.url_open, 'http://bla')
         FakeBuildOpener.raise_exception = None
 
+    def test_circuit_breaker(self):
+        """ Test that urls on a host that failed too often are not opened. """
+        urls_opened = []
+
+        def url_open(url, **kwargs):  # pylint: disable=unused-argument
+            """ Fake an unreachable host. """
+            urls_opened.append(url)
+            raise urllib.error.URLError('connection refused')
+
+        opener = url_opener.UrlOpener(url_open=url_open, circuit_breaker=CircuitBreaker(max_failures=2))
+        for path in ('1', '2', '3'):
+            self.assertRaises(urllib.error.URLError, opener.url_open, 'http://bla/' + path)
+        self.assertEqual(['http://bla/1', 'http://bla/2'], urls_opened)
+
+    def test_circuit_breaker_ignores_http_errors(self):
+        """ Test that HTTP errors don't count as failures, because the host did respond. """
+        FakeBuildOpener.raise_exception = urllib.error.HTTPError
+        breaker = CircuitBreaker(max_failures=1)
+        opener = url_opener.UrlOpener(url_open=FakeBuildOpener.open, circuit_breaker=breaker)
+        self.assertRaises(urllib.error.HTTPError, opener.url_open, 'http://bla')
+        FakeBuildOpener.raise_exception = None
+        self.assertEqual('url contents', opener.url_open('http://bla'))
+        self.assertEqual([], breaker.tripped_hosts())
+
+    def test_circuit_breaker_timeout(self):
+        """ Test that time outs count as failures. """
+        FakeBuildOpener.raise_exception = TimeoutError
+        opener = url_opener.UrlOpener(url_open=FakeBuildOpener.open, circuit_breaker=CircuitBreaker(max_failures=1))
+        self.assertRaises(TimeoutError, opener.url_open, 'http://bla')
+        FakeBuildOpener.raise_exception = None
+        self.assertRaises(urllib.error.URLError, opener.url_open, 'http://bla')
+
+    def test_circuit_breaker_read_timeout(self):
+        """ Test that time outs while reading the response count as failures, even though opening succeeded. """
+        timeout = url_opener.Timeout(deadline=4, clock=FakeClock(step=2))
+        opener = url_opener.UrlOpener(url_open=lambda url, **kwargs: io.StringIO('contents'), timeout=timeout,
+                                      circuit_breaker=CircuitBreaker(max_failures=1))
+        self.assertRaises(TimeoutError, opener.url_read, 'http://slow/1')
+        self.assertRaises(urllib.error.URLError, opener.url_open, 'http://slow/2')
+
+    def test_record_and_replay(self):
+        """ Test that responses can be recorded and replayed. """
+        with tempfile.TemporaryDirectory() as folder:
+            opener = url_opener.UrlOpener(url_open=lambda url, **kwargs: io.StringIO('url contents'),
+                                          recorder=TrafficRecorder(folder))
+            self.assertEqual(b'url contents', opener.url_open('http://bla').read())
+            opener = url_opener.UrlOpener(url_open=lambda url, **kwargs: self.fail('Not replayed'),
+                                          recorder=TrafficRecorder(folder, replay=True))
+            self.assertEqual(b'url contents', opener.url_open('http://bla').read())
+
     def test_url_read(self):
         """ Test reading an url. """
-        opener = url_opener.UrlOpener(url_open=lambda url: io.StringIO('contents'))
+        opener = url_opener.UrlOpener(url_open=lambda url, **kwargs: io.StringIO('contents'))
         self.assertEqual('contents', opener.url_read('http://bla'))
 
+    def test_concurrent_url_reads(self):
+        """ Test that concurrent reads of the same url share one request. """
+        release, urls_opened = threading.Event(), []
+
+        def url_open(url, **kwargs):  # pylint: disable=unused-argument
+            """ Open the url once the test releases the request. """
+            urls_opened.append(url)
+            release.wait(5)
+            return io.StringIO('contents')
 
-class FakeSignalModule(object):
-    """ Fake the signal module for unit test purposes. """
-    SIGALRM = 0
+        opener = url_opener.UrlOpener(url_open=url_open)
+        coalesced = url_opener.UrlOpener.url_read_statistics()['coalesced']
+        threads = [threading.Thread(target=opener.url_read, args=('http://concurrent',)) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        while url_opener.UrlOpener.url_read_statistics()['coalesced'] < coalesced + 2:
+            threading.Event().wait(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(['http://concurrent'], urls_opened)
+        self.assertEqual('contents', opener.url_read('http://concurrent'))
+
+    def test_prefetch(self):
+        """ Test that prefetching an url caches its contents. """
+        urls_opened = []
+        opener = url_opener.UrlOpener(url_open=lambda url, **kwargs: urls_opened.append(url) or io.StringIO('contents'))
+        opener.prefetch('http://prefetch')
+        self.assertEqual('contents', opener.url_read('http://prefetch'))
+        self.assertEqual(['http://prefetch'], urls_opened)
+
+    def test_prefetch_exception(self):
+        """ Test that exceptions while prefetching are ignored. """
+        FakeBuildOpener.raise_exception = urllib.error.HTTPError
+        opener = url_opener.UrlOpener(url_open=FakeBuildOpener.open)
+        opener.prefetch('http://bla')
+        FakeBuildOpener.raise_exception = None
 
-    @staticmethod
-    def signal(_, handler):
-        """ Register the signal. We call the handler immediately. """
-        handler()
+
+class FakeClock(object):  # pylint: disable=too-few-public-methods
+    """ Fake a clock that advances a fixed number of seconds each time it is read. """
+    def __init__(self, step):
+        self.__time = 0
+        self.__step = step
+
+    def __call__(self):
+        self.__time += self.__step
+        return self.__time
 
 
 class TimeoutTest(unittest.TestCase):
     """ Unit tests for the Timeout class. """
 
-    @unittest.skipIf(sys.platform.startswith("win"), "Timeout only works on Posix platforms.")
-    def test_with(self):
-        """ Test the with statement. """
-        try:
-            with url_opener.Timeout(4, signal=FakeSignalModule()):
-                self.fail("Expected TimeoutError")  # pragma: no cover
-        except TimeoutError as reason:
-            self.assertEqual("Operation timed out after 4 seconds.", str(reason))
+    def test_socket_timeout(self):
+        """ Test that the socket time out is passed to the opener. """
+        timeouts = []
+        url_opener.Timeout(socket_timeout=4).open(lambda url, timeout: timeouts.append(timeout), 'http://bla')
+        self.assertEqual([4], timeouts)
+
+    def test_read(self):
+        """ Test that the response can be read within the deadline. """
+        response = url_opener.Timeout().open(lambda url, **kwargs: io.BytesIO(b'contents'), 'http://bla')
+        self.assertEqual(b'contents', response.read())
+
+    def test_read_in_chunks(self):
+        """ Test that a limited number of bytes can be read. """
+        response = url_opener.Timeout().open(lambda url, **kwargs: io.StringIO('contents'), 'http://bla')
+        self.assertEqual('cont', response.read(4))
+        self.assertEqual('ents', response.read())
+
+    def test_open_past_deadline(self):
+        """ Test that a TimeoutError is raised when opening the url takes the request past the deadline. """
+        timeout = url_opener.Timeout(deadline=4, clock=FakeClock(step=5))
+        self.assertRaises(TimeoutError, timeout.open, lambda url, **kwargs: io.StringIO('contents'), 'http://bla')
+
+    def test_read_past_deadline(self):
+        """ Test that a TimeoutError is raised when reading the response takes the request past the deadline. """
+        response = url_opener.Timeout(deadline=4, clock=FakeClock(step=2)).open(
+            lambda url, **kwargs: io.StringIO('contents'), 'http://bla')
+        self.assertRaises(TimeoutError, response.read)
+
+    def test_in_thread(self):
+        """ Test that the time out can be used outside the main thread. """
+        responses = []
+
+        def use_timeout():
+            """ Use the time out in a thread. """
+            responses.append(url_opener.Timeout().open(lambda url, **kwargs: io.StringIO('contents'), 'http://bla'))
+
+        thread = threading.Thread(target=use_timeout)
+        thread.start()
+        thread.join()
+        self.assertEqual('contents', responses[0].read())
@@ -0,0 +1,103 @@
+"""
+Copyright 2012-2017 Ministerie van Sociale Zaken en Werkgelegenheid
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import threading
+import unittest
+
+from hqlib.metric_source import UrlPrefetcher
+
+
+class FakeMetricSource(object):
+    """ Fake a metric source that records the urls it is asked to prefetch. """
+    def __init__(self, exception=None):
+        self.urls = []
+        self.metric_source_ids = []
+        self.threads = set()
+        self.__exception = exception
+        self.__lock = threading.Lock()
+
+    def prefetch(self, url):
+        """ Record the url. """
+        if self.__exception:
+            raise self.__exception
+        with self.__lock:
+            self.urls.append(url)
+            self.threads.add(threading.current_thread())
+
+    def bulk_prefetch(self, *metric_source_ids):
+        """ Record the metric source ids. """
+        with self.__lock:
+            self.metric_source_ids.append(metric_source_ids)
+
+
+class FakeMetric(object):
+    """ Fake a metric with prefetch requests. """
+    def __init__(self, metric_source, *urls, metric_source_id='id'):
+        self.__requests = [(metric_source, url) for url in urls]
+        self.__bulk_requests = [(metric_source, metric_source_id)]
+
+    def prefetch_requests(self):
+        """ Return the prefetch requests. """
+        return self.__requests
+
+    def bulk_prefetch_requests(self):
+        """ Return the bulk prefetch requests. """
+        return self.__bulk_requests
+
+
+class UrlPrefetcherTest(unittest.TestCase):
+    """ Unit tests for the url prefetcher. """
+
+    def test_no_metrics(self):
+        """ Test that nothing is prefetched without metrics. """
+        self.assertEqual(0, UrlPrefetcher().prefetch([]))
+
+    def test_prefetch(self):
+        """ Test that the urls of the metrics are prefetched. """
+        metric_source = FakeMetricSource()
+        self.assertEqual(2, UrlPrefetcher().prefetch([FakeMetric(metric_source, 'http://a', 'http://b')]))
+        self.assertEqual(['http://a', 'http://b'], sorted(metric_source.urls))
+
+    def test_prefetch_in_threads(self):
+        """ Test that the urls are not prefetched in the main thread. """
+        metric_source = FakeMetricSource()
+        UrlPrefetcher().prefetch([FakeMetric(metric_source, 'http://a')])
+        self.assertFalse(threading.main_thread() in metric_source.threads)
+
+    def test_duplicate_urls(self):
+        """ Test that urls needed by multiple metrics are prefetched once. """
+        metric_source = FakeMetricSource()
+        UrlPrefetcher().prefetch([FakeMetric(metric_source, 'http://a'), FakeMetric(metric_source, 'http://a')])
+        self.assertEqual(['http://a'], metric_source.urls)
+
+    def test_bulk_prefetch(self):
+        """ Test that metric sources get all metric source ids at once, without duplicates. """
+        metric_source = FakeMetricSource()
+        UrlPrefetcher().prefetch([FakeMetric(metric_source, metric_source_id='a'),
+                                  FakeMetric(metric_source, metric_source_id='b'),
+                                  FakeMetric(metric_source, metric_source_id='a')])
+        self.assertEqual([('a', 'b')], metric_source.metric_source_ids)
+
+    def test_disabled(self):
+        """ Test that nothing is prefetched if there are no workers. """
+        metric_source = FakeMetricSource()
+        self.assertEqual(0, UrlPrefetcher(max_workers=0).prefetch([FakeMetric(metric_source, 'http://a')]))
+        self.assertEqual([], metric_source.urls)
+
+    def test_exception(self):
+        """ Test that exceptions while prefetching are ignored. """
+        metric_source = FakeMetricSource(exception=ValueError('oops'))
+        self.assertEqual(1, UrlPrefetcher().prefetch([FakeMetric(metric_source, 'http://a')]))
@@ -15,14 +15,116 @@ limitations under the License.
 """
 
 import datetime
+import os
+import shutil
+import tempfile
+import threading
 import unittest
 
-from hqlib.metric_source import Git, VersionControlSystem
+from hqlib.metric_source import Git, ResponseCache, VersionControlSystem
 
 
-class GitTests(unittest.TestCase):
+def cloning(run_shell_command):
+    """ Return a fake shell command runner that creates the mirror folder when cloning. """
+    def run(command, **kwargs):
+        """ Create the mirror folder when cloning and then run the fake command. """
+        if command[1] == 'clone':
+            os.makedirs(command[-1], exist_ok=True)
+        return run_shell_command(command, **kwargs)
+    return run
+
+
+class MirrorsFolderTestCase(unittest.TestCase):
+    """ Base class for Git unit tests that use a temporary mirrors folder. """
+    def setUp(self):
+        VersionControlSystem._run_shell_command.cache_clear()
+        Git._run_shell_command.cache_clear()
+        Git._Git__last_changed_timestamps.cache_clear()
+        Git._Git__updated_mirrors.clear()
+        self.mirrors_folder = tempfile.mkdtemp()
+        Git.mirrors_folder = self.mirrors_folder
+
+    def tearDown(self):
+        shutil.rmtree(self.mirrors_folder)
+        Git.mirrors_folder = self.__original_mirrors_folder
+
+    __original_mirrors_folder = Git.mirrors_folder
+
+
+class FakeGitRepo(object):  # pylint: disable=too-few-public-methods
+    """ Fake the output of Git commands for a repository with two unmerged branches that share a commit. """
+    def __init__(self):
+        self.commands = []
+        self.tips = 'm0 origin/master\na2 origin/a\nb1 origin/b\n'
+
+    def __call__(self, command, **kwargs):  # pylint: disable=unused-argument
+        self.commands.append(command)
+        if command[1] == 'clone':
+            os.makedirs(command[-1], exist_ok=True)
+        if command[1] == 'branch':
+            return '  origin/a\n  origin/b\n'
+        if command[1] == 'for-each-ref':
+            return self.tips
+        if command[1:3] == ('rev-list', '--count'):
+            return '3\n'
+        if command[1] == 'rev-list':
+            return self.__rev_list(command[4:])
+        return ''
+
+    def __rev_list(self, branches):
+        """ Return the commits reachable from the branches, but not from master, with their parents. """
+        parents = dict(a2=['a1'], a1=['m0'], b1=['a1'], m0=[])
+        tips = dict(line.split()[::-1] for line in self.tips.strip().split('\n'))
+        commits, to_visit = [], [tips[branch] for branch in branches]
+        while to_visit:
+            commit = to_visit.pop()
+            if commit != 'm0' and commit not in commits:
+                commits.append(commit)
+                to_visit.extend(parents[commit])
+        return ''.join(' '.join([commit] + parents[commit]) + '\n' for commit in commits)
+
+
+class GitUnmergedCommitsCacheTests(MirrorsFolderTestCase):
+    """ Unit tests for caching the number of unmerged commits per branch. """
+    def setUp(self):
+        super().setUp()
+        VersionControlSystem.default_response_cache = ResponseCache(':memory:')
+
+    def tearDown(self):
+        VersionControlSystem.default_response_cache = None
+        super().tearDown()
+
+    def __unmerged_branches(self, repo):
+        """ Return the unmerged branches and the commits walked. """
+        VersionControlSystem._run_shell_command.cache_clear()
+        Git._run_shell_command.cache_clear()
+        unmerged_branches = Git(url='http://git/', run_shell_command=repo).unmerged_branches('path')
+        return unmerged_branches, [command[4:] for command in repo.commands if 'rev-list' in command]
+
+    def test_cached(self):
+        """ Test that unchanged branches are not walked again. """
+        self.__unmerged_branches(FakeGitRepo())
+        self.assertEqual(({'origin/a': 2, 'origin/b': 2}, []), self.__unmerged_branches(FakeGitRepo()))
+
+    def test_changed_branch(self):
+        """ Test that only branches whose tip changed are walked again. """
+        self.__unmerged_branches(FakeGitRepo())
+        repo = FakeGitRepo()
+        repo.tips = 'm0 origin/master\na2 origin/a\na1 origin/b\n'
+        self.assertEqual(({'origin/a': 2, 'origin/b': 1}, [('origin/b',)]), self.__unmerged_branches(repo))
+
+    def test_changed_master(self):
+        """ Test that all branches are walked again when the master branch changed. """
+        self.__unmerged_branches(FakeGitRepo())
+        repo = FakeGitRepo()
+        repo.tips = 'm1 origin/master\na2 origin/a\nb1 origin/b\n'
+        self.assertEqual([('origin/a', 'origin/b')], self.__unmerged_branches(repo)[1])
+
+
+class GitTests(MirrorsFolderTestCase):
     """ Unit tests for the Git class. """
     def setUp(self):
+        super().setUp()
         self.__git = Git(url='http://git/', run_shell_command=lambda *args, **kwargs: '')
         self.__git_branch = Git(url=self.__git.url(), branch='branch')
 
@@ -42,9 +144,18 @@ class GitTests(unittest.TestCase):
         """ Test the date with a (faked) repo. """
         VersionControlSystem._run_shell_command.cache_clear()
         Git._run_shell_command.cache_clear()
-        git = Git(url=self.__git.url(), run_shell_command=lambda *args, **kwargs: '1490445344.0', branch='branch')
+        git = Git(url=self.__git.url(), run_shell_command=cloning(lambda *args, **kwargs: '\x001490445344\n\npath\n'),
+                  branch='branch')
         self.assertEqual(datetime.datetime.fromtimestamp(1490445344.0), git.last_changed_date('path'))
 
+    def test_last_changed_date_with_wildcard(self):
+        """ Test that the date of paths with wildcards is retrieved with git log. """
+        VersionControlSystem._run_shell_command.cache_clear()
+        Git._run_shell_command.cache_clear()
+        git = Git(url=self.__git.url(), run_shell_command=cloning(lambda *args, **kwargs: '"1490445344"\n'),
+                  branch='branch')
+        self.assertEqual(datetime.datetime.fromtimestamp(1490445344.0), git.last_changed_date('docs/*.md'))
+
     def test_branches(self):
         """ Test that there are no branches by default. """
         self.assertFalse(self.__git.branches('path'))
@@ -57,9 +168,44 @@ class GitTests(unittest.TestCase):
         """ Test the unmerged branches with a (faked) repo. """
         VersionControlSystem._run_shell_command.cache_clear()
         Git._run_shell_command.cache_clear()
-        git = Git(url=self.__git.url(), username='u', password='p',
-                  run_shell_command=lambda *args, **kwargs: 'branch\n')
-        self.assertEqual(dict(branch=1), git.unmerged_branches('path'))
+        git = Git(url=self.__git.url(), username='u', password='p', run_shell_command=FakeGitRepo())
+        self.assertEqual({'origin/a': 2, 'origin/b': 2}, git.unmerged_branches('path'))
+
+    def test_unmerged_branches_one_walk(self):
+        """ Test that the unmerged commits of all branches are retrieved with one command. """
+        VersionControlSystem._run_shell_command.cache_clear()
+        Git._run_shell_command.cache_clear()
+        repo = FakeGitRepo()
+        Git(url=self.__git.url(), run_shell_command=repo).unmerged_branches('path')
+        self.assertEqual([('git', 'rev-list', '--parents', '^origin/master', 'origin/a', 'origin/b')],
+                         [command for command in repo.commands if 'rev-list' in command])
+
+    def test_unmerged_branches_ignored(self):
+        """ Test that ignored branches are not walked. """
+        VersionControlSystem._run_shell_command.cache_clear()
+        Git._run_shell_command.cache_clear()
+        repo = FakeGitRepo()
+        git = Git(url=self.__git.url(), run_shell_command=repo)
+        self.assertEqual({'origin/b': 2}, git.unmerged_branches('path', list_of_branches_to_ignore=['origin/a']))
+        self.assertEqual([('git', 'rev-list', '--parents', '^origin/master', 'origin/b')],
+                         [command for command in repo.commands if 'rev-list' in command])
+
+    def test_unmerged_branch_without_tip(self):
+        """ Test that the unmerged commits of a branch whose tip is unknown are counted separately. """
+        VersionControlSystem._run_shell_command.cache_clear()
+        Git._run_shell_command.cache_clear()
+        repo = FakeGitRepo()
+        repo.tips = 'm0 origin/master\na2 origin/a\n'
+        git = Git(url=self.__git.url(), run_shell_command=repo)
+        self.assertEqual({'origin/a': 2, 'origin/b': 3}, git.unmerged_branches('path'))
+
+    def test_recording_key(self):
+        """ Test that cloning and fetching the mirror are recorded as the same command for all branches. """
+        self.assertEqual(self.__git_branch._recording_key(('git', 'clone', 'http://u:p@git/', 'folder')),
+                         self.__git_branch._recording_key(('git', 'fetch', '--prune', 'origin')))
+        self.assertEqual(self.__git_branch._recording_key(('git', 'fetch', '--prune', 'origin')),
+                         self.__git._recording_key(('git', 'fetch', '--prune', 'origin')))
+        self.assertNotEqual(self.__git_branch._recording_key(('git', 'log')), self.__git._recording_key(('git', 'log')))
 
     def test_normalize_path(self):
         """ Test path that needs no changes. """
@@ -73,3 +219,204 @@ class GitTests(unittest.TestCase):
         """ Test that a branch folder can be created from a trunk folder and a branch name. """
         self.assertEqual('http://git/master/branch',
                          self.__git.branch_folder_for_branch('http://git/master', 'branch'))
+
+
+class FakeGitLog(object):  # pylint: disable=too-few-public-methods
+    """ Fake the output of Git commands for a repository with a history of file changes. """
+    log = dict(h1='\x00200\n\ndocs/b.md\n\x00100\n\ndocs/a.md\ndocs/b.md\nREADME\n',
+               h2='\x00300\n\ndocs/a.md\n')
+
+    def __init__(self, head='h1', ancestors=('h1',)):
+        self.commands = []
+        self.head = head
+        self.ancestors = ancestors
+
+    def __call__(self, command, **kwargs):  # pylint: disable=unused-argument
+        self.commands.append(command)
+        if command[1] == 'clone':
+            os.makedirs(command[-1], exist_ok=True)
+        if command[1] == 'rev-parse':
+            return self.head + '\n'
+        if command[1] == 'merge-base':
+            return command[2] + '\n' if command[2] in self.ancestors else ''
+        if 'log' in command:
+            revisions = command[-1]
+            if revisions == 'origin/HEAD':
+                return ''.join(self.log[commit] for commit in ('h2', 'h1') if commit <= self.head)
+            return self.log[revisions.split('..')[1]]
+        return ''
+
+
+class GitLastChangedDateTests(MirrorsFolderTestCase):
+    """ Unit tests for the index of last changed dates of a Git repository. """
+    def setUp(self):
+        super().setUp()
+        VersionControlSystem.default_response_cache = ResponseCache(':memory:')
+
+    def tearDown(self):
+        VersionControlSystem.default_response_cache = None
+        super().tearDown()
+
+    @staticmethod
+    def __git(repo):
+        """ Return a Git instance for the fake repository. """
+        VersionControlSystem._run_shell_command.cache_clear()
+        Git._run_shell_command.cache_clear()
+        Git._Git__last_changed_timestamps.cache_clear()
+        return Git(url='http://git/', run_shell_command=repo)
+
+    def __assert_date(self, timestamp, git, path):
+        """ Assert that the last changed date of the path is the timestamp. """
+        self.assertEqual(datetime.datetime.fromtimestamp(timestamp), git.last_changed_date(path))
+
+    def test_files(self):
+        """ Test that the date of a file is the date of its last commit. """
+        git = self.__git(FakeGitLog())
+        self.__assert_date(100, git, 'docs/a.md')
+        self.__assert_date(200, git, 'docs/b.md')
+
+    def test_folders(self):
+        """ Test that the date of a folder is the date of the last commit of any file in it. """
+        git = self.__git(FakeGitLog())
+        self.__assert_date(200, git, 'docs')
+        self.__assert_date(200, git, './docs/')
+        self.__assert_date(200, git, '.')
+
+    def test_missing_path(self):
+        """ Test that there is no date for paths that aren't in the repository. """
+        self.assertEqual(datetime.datetime.min, self.__git(FakeGitLog()).last_changed_date('missing'))
+
+    def test_one_log(self):
+        """ Test that the log is read once for any number of paths. """
+        repo = FakeGitLog()
+        git = self.__git(repo)
+        for path in ('docs/a.md', 'docs/b.md', 'README', 'missing'):
+            git.last_changed_date(path)
+        self.assertEqual(1, len([command for command in repo.commands if 'log' in command]))
+
+    def test_stored_index(self):
+        """ Test that the stored index is used if the head didn't change. """
+        self.__git(FakeGitLog()).last_changed_date('README')
+        repo = FakeGitLog()
+        self.__assert_date(100, self.__git(repo), 'README')
+        self.assertEqual([], [command for command in repo.commands if 'log' in command])
+
+    def test_incremental(self):
+        """ Test that only the new commits are read if the head changed. """
+        self.__git(FakeGitLog()).last_changed_date('README')
+        repo = FakeGitLog(head='h2')
+        git = self.__git(repo)
+        self.__assert_date(300, git, 'docs/a.md')
+        self.__assert_date(200, git, 'docs/b.md')
+        self.assertEqual(['h1..h2'], [command[-1] for command in repo.commands if 'log' in command])
+
+    def test_rewritten_history(self):
+        """ Test that the index is rebuilt if the previously indexed head is no longer an ancestor. """
+        self.__git(FakeGitLog()).last_changed_date('README')
+        repo = FakeGitLog(head='h2', ancestors=())
+        self.__assert_date(300, self.__git(repo), 'docs')
+        self.assertEqual(['origin/HEAD'], [command[-1] for command in repo.commands if 'log' in command])
+
+
+class GitMirrorTests(MirrorsFolderTestCase):
+    """ Unit tests for the mirrors of Git repositories. """
+    def setUp(self):
+        super().setUp()
+        self.__commands = []
+
+    def __run_shell_command(self, command, **kwargs):  # pylint: disable=unused-argument
+        """ Record the command and create the mirror folder when cloning. """
+        self.__commands.append(command)
+        if command[1] == 'clone':
+            os.makedirs(command[-1])
+        return ''
+
+    def __git(self, **kwargs):
+        """ Return a Git instance that records the commands. """
+        return Git(url='http://git/repo.git', run_shell_command=self.__run_shell_command, **kwargs)
+
+    def test_clone(self):
+        """ Test that a bare mirror without file contents is cloned in the mirrors folder. """
+        self.__git().branches('path')
+        folder = self.__commands[0][-1]
+        self.assertEqual(('git', 'clone', '--bare', '--filter=blob:none', 'http://git/repo.git'),
+                         self.__commands[0][:-1])
+        self.assertEqual(self.mirrors_folder, os.path.dirname(folder))
+        self.assertTrue(os.path.basename(folder).startswith('repo.git-'))
+        self.assertIn(('git', 'fetch', '--prune', '--filter=blob:none', 'origin'), self.__commands)
+
+    def test_fetch(self):
+        """ Test that an existing mirror is fetched. """
+        self.__git().branches('path')
+        Git._Git__updated_mirrors.clear()
+        del self.__commands[:]
+        self.__git(branch='other').branches('path')
+        self.assertEqual(('git', 'fetch', '--prune', '--filter=blob:none', 'origin'), self.__commands[0])
+
+    def test_shared_mirror(self):
+        """ Test that branches of the same repository share one mirror that is updated once. """
+        self.__git().branches('path')
+        self.__git(branch='branch').branches('path')
+        self.assertEqual(1, len([command for command in self.__commands if command[1] == 'clone']))
+        self.assertEqual(1, len([command for command in self.__commands if command[1] == 'fetch']))
+
+    def test_mirror_per_url(self):
+        """ Test that repositories with the same name on different servers get different mirrors. """
+        self.__git().branches('path')
+        Git(url='http://other/repo.git', run_shell_command=self.__run_shell_command).branches('path')
+        clones = [command[-1] for command in self.__commands if command[1] == 'clone']
+        self.assertEqual(2, len(set(clones)))
+
+    def test_failed_clone(self):
+        """ Test that the mirror isn't configured and that no commands are run if it couldn't be cloned. """
+        git = Git(url='http://git/repo.git', run_shell_command=lambda command, **kwargs: self.__commands.append(command)
+                  or '  origin/a\n')
+        self.assertEqual([], git.branches('path'))
+        self.assertEqual(['clone'], [command[1] for command in self.__commands])
+
+    def test_commands_wait_for_mirror(self):
+        """ Test that commands from other threads wait until the mirror has been cloned and then run in the mirror. """
+        clone_started, clone_done, folders = threading.Event(), threading.Event(), []
+
+        def run_shell_command(command, **kwargs):
+            """ Block the clone until the test releases it and record the folder of the other commands. """
+            if command[1] == 'clone':
+                clone_started.set()
+                clone_done.wait()
+                os.makedirs(command[-1])
+            else:
+                folders.append((command[1], kwargs.get('cwd')))
+            return ''
+
+        git = Git(url='http://git/repo.git', run_shell_command=run_shell_command)
+        prefetch = threading.Thread(target=git.bulk_prefetch)
+        prefetch.start()
+        clone_started.wait()
+        branches = threading.Thread(target=git.branches, args=('path',))
+        branches.start()
+        branches.join(0.1)
+        self.assertTrue(branches.is_alive())
+        clone_done.set()
+        prefetch.join()
+        branches.join()
+        mirror = [folder for command, folder in folders if command == 'fetch'][0]
+        self.assertEqual(self.mirrors_folder, os.path.dirname(mirror))
+        self.assertEqual([('branch', mirror)], [item for item in folders if item[0] == 'branch'])
+
+    def test_bulk_prefetch(self):
+        """ Test that prefetching clones the mirror, and only once. """
+        git = self.__git()
+        git.bulk_prefetch('path')
+        git.bulk_prefetch('path')
+        self.assertEqual(1, len([command for command in self.__commands if command[1] == 'clone']))
+
+    def test_branch_revision(self):
+        """ Test that the last changed dates of a branch are read from the remote branch in the mirror. """
+        self.__git(branch='branch').last_changed_date('path')
+        self.assertIn('origin/branch', [command[-1] for command in self.__commands if 'log' in command])
+
+    def test_ignore_head(self):
+        """ Test that the default branch isn't listed as branch. """
+        git = Git(url='http://git/repo.git',
+                  run_shell_command=cloning(lambda *args, **kwargs: '  origin/HEAD\n  origin/a\n'))
+        self.assertEqual(['origin/a'], git.branches('path'))
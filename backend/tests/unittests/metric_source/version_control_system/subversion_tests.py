@@ -15,25 +15,38 @@ limitations under the License.
 """
 
 import datetime
+import threading
 import unittest
 
-from hqlib.metric_source import Subversion
+from hqlib.metric_source import Subversion, ResponseCache
 
 
 class SubversionUnderTest(Subversion):
     """ Override the Subversion class to prevent it from running shell commands. """
     mergeinfo = ''
+    log = ''
+    branch_names = ('folder',)
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.last_command = None
+        self.commands = []
+        self.__lock = threading.Lock()
 
     def _run_shell_command(self, command, *args, **kwargs):  # pylint: disable=unused-argument
-        self.last_command = command
+        with self.__lock:
+            self.last_command = command
+            self.commands.append(command)
         if command[1] == 'mergeinfo':
             return self.mergeinfo
+        elif command[1] == 'log':
+            return self.log
+        elif command[1] == 'info' and 'path' not in command[3]:
+            return '<info><entry revision="20"><commit revision="15"></commit></entry></info>'
         elif command[1] == 'list' and 'path' not in command[3]:
-            return '<name>folder</name>'
+            entries = ''.join('<entry kind="dir"><name>{0}</name><commit revision="10"></commit></entry>'.format(name)
+                              for name in self.branch_names)
+            return '<lists><list path="{0}">{1}</list></lists>'.format(command[3], entries)
 
 
 class SubversionTests(unittest.TestCase):
@@ -49,6 +62,11 @@ class SubversionTests(unittest.TestCase):
         """ Test that there are no branches by default. """
         self.assertFalse(self.__svn.branches('path'))
 
+    def test_branch_names(self):
+        """ Test that the branch names are parsed from the list of the branches folder. """
+        self.__svn.branch_names = ['branch1', 'branch2']
+        self.assertEqual(['branch1', 'branch2'], self.__svn.branches('http://svn/trunk/'))
+
     def test_unmerged_branches(self):
         """ Test that there are no unmerged branches by default. """
         self.assertEqual({}, self.__svn.unmerged_branches('http://svn/'))
@@ -79,6 +97,54 @@ class SubversionTests(unittest.TestCase):
         self.__svn.mergeinfo = 'rev1\nrev2\nrev3\nrev4\nrev5'
         self.assertEqual(dict(), self.__svn.unmerged_branches('http://svn/', list_of_branches_to_include=['other']))
 
+    def test_unmerged_branch_with_tag_revisions(self):
+        """ Test that revisions that only changed a tag are not counted as unmerged revisions. """
+        self.__svn.mergeinfo = 'r3\nr5'
+        self.__svn.log = '<log><logentry revision="3"><paths><path>/tags/folder-1.0/pom.xml</path></paths>' \
+                         '</logentry><logentry revision="4"><paths><path>/tags/other/pom.xml</path></paths>' \
+                         '</logentry><logentry revision="5"><paths><path>/branches/folder/pom.xml</path></paths>' \
+                         '</logentry></log>'
+        self.assertEqual(dict(folder=1), self.__svn.unmerged_branches('http://svn/trunk/'))
+
+    def test_tag_revisions_are_retrieved_with_one_log(self):
+        """ Test that the revisions to check for tags are retrieved with one log command for the revision range. """
+        self.__svn.mergeinfo = 'r12\nr9\nr10'
+        self.__svn.unmerged_branches('http://svn/trunk/')
+        log_commands = [command for command in self.__svn.commands if command[1] == 'log']
+        self.assertEqual([('svn', 'log', '--xml', '-v', '-r', '9:12', 'http://svn/branches/folder')], log_commands)
+
+    def test_multiple_unmerged_branches(self):
+        """ Test that the unmerged revisions of multiple branches are retrieved. """
+        self.__svn.branch_names = ['branch{0}'.format(index) for index in range(20)]
+        self.__svn.mergeinfo = 'r1\nr2\nr3\nr4\nr5'
+        self.assertEqual({'branch{0}'.format(index): 5 for index in range(20)},
+                         self.__svn.unmerged_branches('http://svn/trunk/'))
+
+    def test_unmerged_revisions_are_cached(self):
+        """ Test that the number of unmerged revisions is cached by the last changed revisions. """
+        Subversion.default_response_cache = ResponseCache(':memory:')
+        try:
+            self.__svn.mergeinfo = 'r1\nr2\nr3\nr4\nr5'
+            self.__svn.unmerged_branches('http://svn/trunk/')
+            svn = SubversionUnderTest(url='http://svn/')
+            self.assertEqual(dict(folder=5), svn.unmerged_branches('http://svn/trunk/'))
+            self.assertFalse([command for command in svn.commands if command[1] == 'mergeinfo'])
+        finally:
+            Subversion.default_response_cache = None
+
+    def test_bulk_prefetch(self):
+        """ Test that the information about the paths and their branches is retrieved before the metrics need it. """
+        self.__svn.bulk_prefetch('http://svn/product1/trunk/', 'http://svn/product2', 'http://svn/product1/trunk/')
+        self.assertEqual([('svn', 'info', '--xml', 'http://svn/product1/trunk/'),
+                          ('svn', 'info', '--xml', 'http://svn/product2/trunk/'),
+                          ('svn', 'list', '--xml', 'http://svn/product1/branches/'),
+                          ('svn', 'list', '--xml', 'http://svn/product2/branches/')], sorted(self.__svn.commands))
+
+    def test_bulk_prefetch_without_paths(self):
+        """ Test that no commands are run without paths. """
+        self.__svn.bulk_prefetch()
+        self.assertEqual([], self.__svn.commands)
+
     def test_normalize_path(self):
         """ Test path that needs no changes. """
         self.assertEqual('http://svn/trunk/', self.__svn.normalize_path('http://svn/trunk/'))
@@ -0,0 +1,48 @@
+"""
+Copyright 2012-2017 Ministerie van Sociale Zaken en Werkgelegenheid
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+# Utility to merge the log of a compact history file into the history file.
+#
+# The CompactHistory metric source appends reports to a log next to the history file and only merges them into the
+# history file now and then. Run this script before copying or committing only the history file, so the history file
+# contains all reports.
+
+
+import argparse
+import logging
+
+from hqlib.metric_source import CompactHistory
+
+
+def parse_args():
+    """ Parse the command line arguments. """
+    parser = argparse.ArgumentParser(description='Merge the log of a compact history file into the history file.')
+    parser.add_argument('filename', help='filename of the history file')
+    parser.add_argument('--log', default="INFO", choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help="log level (INFO by default)")
+    return parser.parse_args()
+
+
+def init_logging(log_level):
+    """ Initialize logging for the application. """
+    logging.basicConfig(format='%(asctime)s:%(levelname)s:%(message)s', level=getattr(logging, log_level.upper(), None))
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    init_logging(args.log)
+    CompactHistory(args.filename).compact()